@@ -0,0 +1,290 @@
+"""Benchmark model throughput on this machine.
+
+Runs a fixed prompt suite against each installed model (or the ones given)
+at several context lengths and concurrency levels. Requests go through the
+app's OllamaClient and a ModelScheduler with the app's slot limits, so the
+numbers match what users of the app would see. For each run it reports:
+
+- time to first token (including time queued for a slot)
+- prefill and decode tokens/s, from Ollama's timing stats
+- overall generated tokens/s and the peak scheduler queue depth
+
+Usage:
+    python bench.py [--models llama3.2:1b,qwen2:0.5b] [--contexts 1024,4096] [--concurrency 1,2,4]
+    python bench.py --json results.json    # also write the results as JSON ('-' = stdout only)
+    python bench.py --fake [--fake-speed 20]  # against the bundled fake Ollama
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+from config import SCHEDULER_GLOBAL_CONCURRENCY, SCHEDULER_MODEL_CONCURRENCY
+from utils.ollama_client import OllamaClient
+from utils.model_manager import ModelManager
+from utils.scheduler import ModelScheduler, INTERACTIVE
+from utils.tokens import estimate_tokens
+
+PROMPTS = [
+    "Explain in a short paragraph how a hash map handles collisions.",
+    "Write a haiku about a lighthouse in winter.",
+    "List three practical tips for keeping houseplants alive.",
+    "Summarize the plot of a heist story in four sentences."
+]
+
+# Background text the prompt is padded with to reach a context length
+FILLER = (
+    "The following notes are background material. They describe a small town by the sea, its harbour, "
+    "the fishing boats that leave before dawn, the market square, the library with its creaking stairs, "
+    "and the people who have lived there for generations. "
+)
+
+# Fraction of (num_ctx - max_tokens) the padded prompt fills
+PROMPT_FILL = 0.75
+
+def build_messages(prompt: str, num_ctx: int, max_tokens: int, model: str) -> List[Dict]:
+    """Pad a prompt with background text to fill most of the context window."""
+    target = int((num_ctx - max_tokens) * PROMPT_FILL)
+    filler_tokens = max(1, estimate_tokens(FILLER, model))
+    repeats = max(0, (target - estimate_tokens(prompt, model)) // filler_tokens)
+    messages = []
+    if repeats:
+        messages.append({'role': 'system', 'content': FILLER * repeats})
+    messages.append({'role': 'user', 'content': prompt})
+    return messages
+
+def _rate(count: int, duration_ns: int) -> float:
+    return count / (duration_ns / 1e9) if count and duration_ns else 0.0
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+class QueueDepth:
+    """Peak number of requests waiting in the scheduler."""
+    
+    def __init__(self, scheduler: ModelScheduler):
+        self.scheduler = scheduler
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    def sample(self):
+        queued = self.scheduler.stats()['queued']
+        with self._lock:
+            self.peak = max(self.peak, queued)
+
+def run_request(client: OllamaClient, scheduler: ModelScheduler, depth: QueueDepth, model: str,
+                messages: List[Dict], options: Dict, keep_alive: int, key: str) -> Dict:
+    """Run one chat request through the scheduler and measure it."""
+    started = time.perf_counter()
+    ticket = scheduler.submit(model, INTERACTIVE, key)
+    depth.sample()
+    try:
+        ticket.wait()
+        stats = {}
+        first_token = None
+        for _ in client.chat(model, messages, stream=True, options=options, keep_alive=keep_alive, stats=stats):
+            if first_token is None:
+                first_token = time.perf_counter()
+        ended = time.perf_counter()
+    finally:
+        scheduler.release(ticket)
+    
+    return {
+        'queue_wait': ticket.queue_wait,
+        'ttft': (first_token or ended) - started,
+        'total': ended - started,
+        'prompt_tokens': stats.get('prompt_eval_count', 0),
+        'eval_tokens': stats.get('eval_count', 0),
+        'prefill_tps': _rate(stats.get('prompt_eval_count', 0), stats.get('prompt_eval_duration', 0)),
+        'decode_tps': _rate(stats.get('eval_count', 0), stats.get('eval_duration', 0)),
+        'load_seconds': stats.get('load_duration', 0) / 1e9
+    }
+
+def run_level(client: OllamaClient, scheduler: ModelScheduler, model: str, num_ctx: int, concurrency: int,
+              rounds: int, max_tokens: int, keep_alive: int) -> Dict:
+    """Run the prompt suite with a number of concurrent clients and summarize the results."""
+    options = {'num_ctx': num_ctx, 'num_predict': max_tokens, 'temperature': 0, 'seed': 1}
+    suites = [build_messages(prompt, num_ctx, max_tokens, model) for prompt in PROMPTS]
+    depth = QueueDepth(scheduler)
+    results, errors = [], []
+    lock = threading.Lock()
+    
+    def worker(index: int):
+        for round_index in range(rounds):
+            messages = suites[(index + round_index) % len(suites)]
+            try:
+                result = run_request(client, scheduler, depth, model, messages, options, keep_alive, f'bench-{index}')
+                with lock:
+                    results.append(result)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    
+    ttfts = [r['ttft'] for r in results]
+    return {
+        'model': model,
+        'num_ctx': num_ctx,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(errors),
+        'error_samples': errors[:3],
+        'prompt_tokens': round(statistics.mean(r['prompt_tokens'] for r in results)) if results else 0,
+        'ttft_p50': round(_percentile(ttfts, 0.5), 3),
+        'ttft_p95': round(_percentile(ttfts, 0.95), 3),
+        'queue_wait_max': round(max((r['queue_wait'] for r in results), default=0.0), 3),
+        'prefill_tps': round(statistics.mean(r['prefill_tps'] for r in results), 1) if results else 0.0,
+        'decode_tps': round(statistics.mean(r['decode_tps'] for r in results), 1) if results else 0.0,
+        'throughput_tps': round(sum(r['eval_tokens'] for r in results) / wall, 1) if wall else 0.0,
+        'peak_queue': depth.peak,
+        'wall_seconds': round(wall, 2)
+    }
+
+def warm_up(client: OllamaClient, model: str, keep_alive: int) -> float:
+    """Load a model with a tiny request so load time is not counted in the runs.
+    
+    Returns:
+        float: Load time reported by Ollama in seconds
+    """
+    stats = {}
+    options = {'num_predict': 1, 'temperature': 0}
+    for _ in client.chat(model, [{'role': 'user', 'content': 'Hi'}], stream=True,
+                         options=options, keep_alive=keep_alive, stats=stats):
+        pass
+    return stats.get('load_duration', 0) / 1e9
+
+def machine_info() -> Dict:
+    info = {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+    try:
+        info['memory_bytes'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    return info
+
+def print_table(report: Dict):
+    columns = [
+        ('model', 'model', 22), ('num_ctx', 'ctx', 6), ('concurrency', 'conc', 4), ('requests', 'reqs', 4),
+        ('ttft_p50', 'ttft p50', 8), ('ttft_p95', 'ttft p95', 8), ('prefill_tps', 'prefill/s', 9),
+        ('decode_tps', 'decode/s', 8), ('throughput_tps', 'total/s', 8), ('peak_queue', 'peak q', 6),
+        ('errors', 'errs', 4)
+    ]
+    print(' '.join(f"{title:>{width}}" if key != 'model' else f"{title:<{width}}" for key, title, width in columns))
+    for row in report['results']:
+        print(' '.join(
+            f"{str(row[key])[:width]:<{width}}" if key == 'model' else f"{row[key]:>{width}}"
+            for key, title, width in columns
+        ))
+    print()
+    for model in report['models']:
+        size_gb = model['size_bytes'] / 1024 ** 3 if model['size_bytes'] else 0
+        print(f"{model['name']}: {size_gb:.1f} GB, load {model['load_seconds']:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--models', default='', help='Comma-separated models (default: all installed)')
+    parser.add_argument('--contexts', default='1024,4096', help='Comma-separated context lengths (num_ctx)')
+    parser.add_argument('--concurrency', default='1,2,4', help='Comma-separated numbers of concurrent clients')
+    parser.add_argument('--rounds', type=int, default=2, help='Requests per client at each level')
+    parser.add_argument('--max-tokens', type=int, default=64, help='Tokens generated per request (num_predict)')
+    parser.add_argument('--global-limit', type=int, default=SCHEDULER_GLOBAL_CONCURRENCY, help='Scheduler slots across all models')
+    parser.add_argument('--model-limit', type=int, default=SCHEDULER_MODEL_CONCURRENCY, help='Scheduler slots per model')
+    parser.add_argument('--base-url', default=None, help='Ollama URL (defaults to OLLAMA_BASE_URL)')
+    parser.add_argument('--fake', action='store_true', help='Run against the bundled fake Ollama')
+    parser.add_argument('--fake-speed', type=float, default=1.0, help='Time scale of the fake (e.g. 20 = 20x faster)')
+    parser.add_argument('--json', default=None, help="Write results as JSON to this file ('-' = print JSON instead of the table)")
+    args = parser.parse_args()
+    
+    contexts = [int(c) for c in args.contexts.split(',') if c.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    
+    fake = None
+    base_url = args.base_url
+    if args.fake:
+        from benchmarks.fake_ollama import FakeOllama
+        fake = FakeOllama(speed=args.fake_speed)
+        base_url = fake.start()
+    
+    client = OllamaClient(base_url)
+    model_manager = ModelManager(client)
+    installed = model_manager.get_available_models(refresh=True)
+    if args.models:
+        models = [m.strip() for m in args.models.split(',') if m.strip()]
+    else:
+        models = [m.get('name') for m in sorted(installed, key=lambda m: m.get('size') or 0)]
+    if not models:
+        print("No models installed. Install one with 'ollama pull <model>' or pass --models.")
+        sys.exit(1)
+    
+    scheduler = ModelScheduler(
+        global_limit=args.global_limit, model_limit=args.model_limit,
+        max_queue=max(levels) * len(models) * 2, max_queue_per_model=max(levels) * 2
+    )
+    keep_alive = 600
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'machine': machine_info(),
+        'ollama_url': client.base_url,
+        'fake': args.fake,
+        'settings': {
+            'contexts': contexts, 'concurrency': levels, 'rounds': args.rounds, 'max_tokens': args.max_tokens,
+            'global_limit': scheduler.global_limit, 'model_limit': scheduler.model_limit
+        },
+        'models': [],
+        'results': []
+    }
+    
+    try:
+        for model in models:
+            print(f"Benchmarking {model}...", file=sys.stderr)
+            try:
+                load_seconds = warm_up(client, model, keep_alive)
+            except Exception as e:
+                print(f"  skipped: {e}", file=sys.stderr)
+                continue
+            report['models'].append({
+                'name': model,
+                'size_bytes': model_manager.get_model_bytes(model),
+                'load_seconds': round(load_seconds, 3)
+            })
+            for num_ctx in contexts:
+                for concurrency in levels:
+                    result = run_level(client, scheduler, model, num_ctx, concurrency,
+                                       args.rounds, args.max_tokens, keep_alive)
+                    print(f"  ctx={num_ctx} concurrency={concurrency}: ttft p50 {result['ttft_p50']} s, "
+                          f"decode {result['decode_tps']} tok/s", file=sys.stderr)
+                    report['results'].append(result)
+            # Free the memory for the next model
+            try:
+                client.set_keep_alive(model, 0)
+            except Exception as e:
+                print(f"  could not unload {model}: {e}", file=sys.stderr)
+    finally:
+        if fake is not None:
+            fake.stop()
+    
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+        return
+    print_table(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark prompt tokens re-evaluated per turn by Ollama.
+
+Plays the same synthetic conversation against a running Ollama twice: once
+with a sliding context window (CONTEXT_BLOCK_FRACTION=0) and once with
+block windowing. Each turn records ``prompt_eval_count`` from Ollama's final
+chunk, i.e. the prompt tokens Ollama actually evaluated rather than took from
+its prompt cache, next to the cached prefix ContextBuilder expected.
+
+A small context window is used so history overflows after a few turns.
+
+Usage:
+    python benchmarks/bench_prefix_cache.py --model llama3.2:1b [--turns 40] [--num-ctx 1024] [--block 0.5]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.context_builder import ContextBuilder
+from utils.ollama_client import OllamaClient
+
+TOPICS = [
+    'sourdough starters', 'binary search trees', 'the history of Lisbon', 'tide pools',
+    'lossless compression', 'alpine hiking gear', 'jazz chord voicings', 'solar inverters'
+]
+
+class FixedSummary:
+    """Summary source for ContextBuilder: a summary that never changes."""
+    
+    def get_summary(self, conversation_id):
+        return "The user has been asking a series of unrelated questions about hobbies and technology."
+
+def user_message(turn):
+    topic = TOPICS[turn % len(TOPICS)]
+    return (f"Question {turn}: in two sentences, tell me one surprising fact about {topic}. "
+            f"Please keep it short and do not repeat earlier answers.")
+
+def play(client, model, turns, num_ctx, reply_tokens, block_fraction):
+    """Play the conversation and collect per-turn prompt stats."""
+    builder = ContextBuilder(FixedSummary())
+    builder.context_window = num_ctx
+    builder.response_reserve = reply_tokens * 2
+    builder.block_fraction = block_fraction
+    conversation_id = f'bench-{block_fraction}'
+    
+    messages = []
+    rows = []
+    for turn in range(turns):
+        messages.append({'role': 'user', 'content': user_message(turn)})
+        context, info = builder.build_context_info(conversation_id, messages, model)
+        stats = {}
+        options = {'num_ctx': num_ctx, 'num_predict': reply_tokens, 'temperature': 0, 'seed': 1}
+        reply = ''.join(client.chat(model, context, stream=True, options=options, stats=stats))
+        messages.append({'role': 'assistant', 'content': reply})
+        rows.append({
+            'turn': turn,
+            'window_start': info['window_start'],
+            'prompt_tokens': info['prompt_tokens'],
+            'expected_cached': info['cached_prefix_tokens'],
+            'prompt_eval_count': stats.get('prompt_eval_count', 0),
+            'prompt_eval_ms': stats.get('prompt_eval_duration', 0) / 1e6
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--num-ctx', type=int, default=1024)
+    parser.add_argument('--reply-tokens', type=int, default=48)
+    parser.add_argument('--block', type=float, default=0.5, help='Fraction of the budget freed per block in the block mode run')
+    parser.add_argument('--base-url', default=None, help='Ollama URL (defaults to OLLAMA_BASE_URL)')
+    args = parser.parse_args()
+    
+    client = OllamaClient(args.base_url)
+    totals = {}
+    for label, block in (('sliding', 0), (f'block={args.block}', args.block)):
+        rows = play(client, args.model, args.turns, args.num_ctx, args.reply_tokens, block)
+        print(f"\n{label}")
+        print(f"{'turn':>4} {'start':>5} {'prompt~':>7} {'cached~':>7} {'evaluated':>9} {'eval ms':>8}")
+        for row in rows:
+            print(f"{row['turn']:>4} {row['window_start']:>5} {row['prompt_tokens']:>7} {row['expected_cached']:>7} "
+                  f"{row['prompt_eval_count']:>9} {row['prompt_eval_ms']:>8.1f}")
+        totals[label] = (sum(r['prompt_eval_count'] for r in rows), sum(r['prompt_eval_ms'] for r in rows))
+    
+    print()
+    for label, (evaluated, ms) in totals.items():
+        print(f"{label:>10}: {evaluated} prompt tokens evaluated, {ms:.0f} ms prompt eval over {args.turns} turns")
+
+if __name__ == '__main__':
+    main()
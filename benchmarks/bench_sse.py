@@ -0,0 +1,77 @@
+"""Benchmark per-request CPU cost of /api/chat SSE framing.
+
+Compares the original pipeline (one json.dumps frame per token and
+``content += chunk`` accumulation) with the coalesced pipeline in
+utils.sse, for a 4k-token reply produced as fast as possible.
+
+Usage:
+    python benchmarks/bench_sse.py [--tokens 4096] [--runs 20]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.sse import coalesce_chunks, content_frame, encode_event
+
+def fake_tokens(count):
+    """Yield tokens shaped like typical model output."""
+    words = ['the', ' model', ' says', ' hello', ',', ' world', '.', '\n', ' ünïcode', ' 42']
+    for i in range(count):
+        yield words[i % len(words)]
+
+def baseline(count):
+    """The original generate(): per-token json.dumps and string concatenation."""
+    assistant_content = ''
+    frames = 0
+    for chunk in fake_tokens(count):
+        assistant_content += chunk
+        frame = f"data: {json.dumps({'content': chunk, 'done': False})}\n\n"
+        frames += 1
+    frame = f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+    return frames + 1, len(assistant_content)
+
+def coalesced(count, window_ms, max_bytes):
+    """The current generate(): coalesced frames, list accumulation, pre-built encoder."""
+    parts = []
+    frames = 0
+    for text in coalesce_chunks(fake_tokens(count), window_ms=window_ms, max_bytes=max_bytes):
+        parts.append(text)
+        frame = content_frame(text)
+        frames += 1
+    frame = encode_event({'content': '', 'done': True})
+    return frames + 1, len(''.join(parts))
+
+def measure(fn, runs, *args):
+    """Return (median CPU ms per request, frames, chars)."""
+    samples = []
+    result = None
+    for _ in range(runs):
+        start = time.process_time()
+        result = fn(*args)
+        samples.append((time.process_time() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], result[0], result[1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=4096)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--window-ms', type=float, default=30)
+    parser.add_argument('--max-bytes', type=int, default=512)
+    args = parser.parse_args()
+    
+    rows = [
+        ('per-token frames (before)',) + measure(baseline, args.runs, args.tokens),
+        ('coalesced frames (after)',) + measure(coalesced, args.runs, args.tokens, args.window_ms, args.max_bytes),
+    ]
+    print(f"{args.tokens}-token reply, median of {args.runs} runs")
+    print(f"{'pipeline':<28}{'CPU ms':>10}{'frames':>10}{'chars':>10}")
+    for name, cpu_ms, frames, chars in rows:
+        print(f"{name:<28}{cpu_ms:>10.2f}{frames:>10}{chars:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,432 @@
+"""In-process fake of the Ollama HTTP API for benchmarks and load tests.
+
+Serves the endpoints the app uses (/api/version, /api/tags, /api/ps,
+/api/chat, /api/generate, /api/pull and /api/delete) with simulated timing:
+each model has a load time, a prefill rate and a decode rate, and only
+``parallel`` requests per model run at once (like OLLAMA_NUM_PARALLEL), so
+queuing behaves like a real server. Timing stats in the final chat chunk are
+the simulated durations, in nanoseconds like Ollama's.
+
+For load tests it can add latency to every request, override the token rate
+of all models and inject failures into chat and pull requests: an HTTP 500,
+an ``error`` line in the middle of the stream, or a dropped connection.
+
+Usage:
+    python -m benchmarks.fake_ollama [--port 11434] [--speed 1] [--latency 0.05] [--failure-rate 0.1]
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+class FakeModel:
+    """Simulated performance of one model."""
+    
+    def __init__(self, name: str, size: int, prefill_tps: float, decode_tps: float, load_seconds: float):
+        """Initialize fake model.
+        
+        Args:
+            name: Model name
+            size: Size in bytes (reported by /api/tags and /api/ps)
+            prefill_tps: Prompt tokens evaluated per second
+            decode_tps: Tokens generated per second
+            load_seconds: Time to load the model when it is not loaded
+        """
+        self.name = name
+        self.size = size
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.load_seconds = load_seconds
+    
+    @classmethod
+    def from_name(cls, name: str) -> 'FakeModel':
+        """Guess plausible numbers from the parameter count in a model name (e.g. 'llama3.2:3b')."""
+        match = re.search(r'(\d+(?:\.\d+)?)b', name.split(':')[-1].lower())
+        params = float(match.group(1)) if match else 3.0
+        return cls(
+            name, size=int(params * 0.6 * 1024 ** 3), prefill_tps=800 / params ** 0.7,
+            decode_tps=60 / params ** 0.8, load_seconds=0.3 + params * 0.15
+        )
+
+DEFAULT_MODELS = ('qwen2:0.5b', 'llama3.2:1b', 'llama3.2:3b')
+
+# How injected failures show up: HTTP 500, an error line mid-stream, or a dropped connection
+FAILURE_MODES = ('error', 'stream_error', 'disconnect')
+
+def _prompt_tokens(messages: List[Dict]) -> int:
+    """Rough token count of a chat prompt (4 characters per token, plus a few per message)."""
+    return sum(len(m.get('content') or '') // 4 + 4 for m in messages)
+
+class FakeOllama:
+    """Threaded HTTP server imitating Ollama."""
+    
+    def __init__(self, models: List[FakeModel] = None, host: str = '127.0.0.1', port: int = 0,
+                 parallel: int = 1, speed: float = 1.0, latency: float = 0.0, token_rate: float = None,
+                 failure_rate: float = 0.0, failure_modes=FAILURE_MODES, seed: int = None,
+                 chunked: bool = True):
+        """Initialize fake server.
+        
+        Args:
+            models: Installed models (defaults to DEFAULT_MODELS)
+            host: Interface to listen on
+            port: Port to listen on (0 = any free port)
+            parallel: Requests per model processed at once
+            speed: Time scale; 10 runs every simulated delay 10 times faster
+            latency: Seconds added before every response
+            token_rate: Decode tokens/s for every model (None = per-model rate)
+            failure_rate: Fraction of chat and pull requests that fail
+            failure_modes: Failure kinds to pick from (see FAILURE_MODES)
+            seed: Random seed for reproducible failure injection
+            chunked: Send streams with chunked transfer encoding, one chunk per line
+                (False = a plain body ended by closing the connection, as some proxies
+                forward it; lines then arrive without any framing)
+        """
+        self.models = {m.name: m for m in (models or [FakeModel.from_name(n) for n in DEFAULT_MODELS])}
+        self.parallel = max(1, parallel)
+        self.speed = speed
+        self.latency = latency
+        self.token_rate = token_rate
+        self.failure_rate = failure_rate
+        self.failure_modes = tuple(failure_modes)
+        self.chunked = chunked
+        self._random = random.Random(seed)
+        self.loaded = {}  # model -> expiry (monotonic, None = forever)
+        self.stats = {'requests': 0, 'chats': 0, 'loads': 0, 'pulls': 0, 'deletes': 0, 'failures': 0, 'disconnects': 0}
+        self.disconnected_at = None  # When a client last closed a stream early (monotonic)
+        self._slots = {}  # model -> semaphore
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self) -> str:
+        """Serve on a background thread.
+        
+        Returns:
+            str: Base URL to point OllamaClient at
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+    
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+    
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+    
+    def pick_failure(self) -> Optional[str]:
+        """Decide whether the current request fails, and how."""
+        if self.failure_rate <= 0 or not self.failure_modes:
+            return None
+        with self._lock:
+            if self._random.random() >= self.failure_rate:
+                return None
+            self.stats['failures'] += 1
+            return self._random.choice(self.failure_modes)
+    
+    def model(self, name: str) -> Optional[FakeModel]:
+        with self._lock:
+            return self.models.get(name)
+    
+    def slot(self, name: str) -> threading.Semaphore:
+        with self._lock:
+            if name not in self._slots:
+                self._slots[name] = threading.Semaphore(self.parallel)
+            return self._slots[name]
+    
+    def load(self, model: FakeModel, keep_alive=None) -> float:
+        """Load a model if needed and set its expiry.
+        
+        Returns:
+            float: Simulated load time in seconds (0 if it was loaded)
+        """
+        now = time.monotonic()
+        with self._lock:
+            expiry = self.loaded.get(model.name, 0)
+            loaded = model.name in self.loaded and (expiry is None or expiry > now)
+            if not loaded:
+                self.stats['loads'] += 1
+        load_seconds = 0.0 if loaded else model.load_seconds
+        self.sleep(load_seconds)
+        self.keep_alive(model.name, keep_alive)
+        return load_seconds
+    
+    def keep_alive(self, name: str, keep_alive=None):
+        """Apply a keep_alive value (seconds, negative = forever, 0 = unload)."""
+        seconds = 300 if keep_alive is None else float(keep_alive)
+        with self._lock:
+            if seconds == 0:
+                self.loaded.pop(name, None)
+            else:
+                self.loaded[name] = None if seconds < 0 else time.monotonic() + seconds / self.speed
+    
+    def running(self) -> List[Dict]:
+        """Loaded models in /api/ps format."""
+        now = time.monotonic()
+        with self._lock:
+            for name, expiry in list(self.loaded.items()):
+                if expiry is not None and expiry <= now:
+                    del self.loaded[name]
+            return [
+                {'name': name, 'model': name, 'size': self.models[name].size, 'size_vram': 0}
+                for name in self.loaded if name in self.models
+            ]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        pass
+    
+    @property
+    def fake(self) -> FakeOllama:
+        return self.server.fake
+    
+    def _body(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+    
+    def _json(self, obj: Dict, status: int = 200):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        if self.fake.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+    
+    def _send_line(self, obj: Dict):
+        line = (json.dumps(obj) + '\n').encode('utf-8')
+        if self.fake.chunked:
+            line = b'%x\r\n%s\r\n' % (len(line), line)
+        self.wfile.write(line)
+        self.wfile.flush()
+    
+    def _end_stream(self):
+        if self.fake.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+    
+    def _drop_connection(self):
+        """Close the socket without finishing the response."""
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def _respond_latency(self):
+        self.fake.sleep(self.fake.latency)
+    
+    def do_GET(self):
+        self.fake.count('requests')
+        self._respond_latency()
+        if self.path == '/api/version':
+            return self._json({'version': '0.0.0-fake'})
+        if self.path == '/api/tags':
+            with self.fake._lock:
+                models = [{'name': m.name, 'model': m.name, 'size': m.size} for m in self.fake.models.values()]
+            return self._json({'models': models})
+        if self.path == '/api/ps':
+            return self._json({'models': self.fake.running()})
+        self._json({'error': 'not found'}, 404)
+    
+    def do_POST(self):
+        self.fake.count('requests')
+        body = self._body()
+        self._respond_latency()
+        try:
+            if self.path == '/api/chat':
+                return self._chat(body)
+            if self.path == '/api/generate':
+                return self._generate(body)
+            if self.path == '/api/pull':
+                return self._pull(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away (e.g. a cancelled generation)
+            with self.fake._lock:
+                self.fake.stats['disconnects'] += 1
+                self.fake.disconnected_at = time.monotonic()
+            return
+        self._json({'error': 'not found'}, 404)
+    
+    def do_DELETE(self):
+        self.fake.count('requests')
+        body = self._body()
+        self._respond_latency()
+        if self.path != '/api/delete':
+            return self._json({'error': 'not found'}, 404)
+        name = body.get('model') or body.get('name')
+        with self.fake._lock:
+            removed = self.fake.models.pop(name, None)
+            self.fake.loaded.pop(name, None)
+            self.fake.stats['deletes'] += 1
+        if removed is None:
+            return self._json({'error': f"model '{name}' not found"}, 404)
+        self._json({})
+    
+    def _chat(self, body: Dict):
+        model = self.fake.model(body.get('model'))
+        if model is None:
+            return self._json({'error': f"model '{body.get('model')}' not found, try pulling it first"}, 404)
+        options = body.get('options') or {}
+        num_predict = int(options.get('num_predict') or 64)
+        if num_predict < 0:
+            num_predict = 256
+        prompt_tokens = _prompt_tokens(body.get('messages') or [])
+        if options.get('num_ctx'):
+            prompt_tokens = min(prompt_tokens, int(options['num_ctx']))
+        stream = body.get('stream', True)
+        failure = self.fake.pick_failure()
+        if failure == 'error' or (failure and not stream):
+            return self._json({'error': 'injected failure'}, 500)
+        fail_at = num_predict // 2 if failure else None
+        
+        with self.fake.slot(model.name):
+            self.fake.count('chats')
+            started = time.perf_counter()
+            load_seconds = self.fake.load(model, body.get('keep_alive'))
+            prefill_seconds = prompt_tokens / model.prefill_tps
+            self.fake.sleep(prefill_seconds)
+            decode_seconds = 1 / (self.fake.token_rate or model.decode_tps)
+            
+            if stream:
+                self._start_stream()
+            words = []
+            for i in range(num_predict):
+                if i == fail_at:
+                    if failure == 'stream_error':
+                        self._send_line({'error': 'injected failure'})
+                        self._end_stream()
+                    else:
+                        self._drop_connection()
+                    return
+                self.fake.sleep(decode_seconds)
+                word = f"token{i} "
+                if stream:
+                    self._send_line({'model': model.name, 'message': {'role': 'assistant', 'content': word}, 'done': False})
+                else:
+                    words.append(word)
+            final = {
+                'model': model.name,
+                'message': {'role': 'assistant', 'content': '' if stream else ''.join(words)},
+                'done': True,
+                'done_reason': 'length',
+                'total_duration': int((time.perf_counter() - started) * 1e9),
+                'load_duration': int(load_seconds * 1e9),
+                'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int(prefill_seconds * 1e9),
+                'eval_count': num_predict,
+                'eval_duration': int(num_predict * decode_seconds * 1e9)
+            }
+            if stream:
+                self._send_line(final)
+                self._end_stream()
+            else:
+                self._json(final)
+    
+    def _generate(self, body: Dict):
+        # Only the load/unload form (no prompt) is used by the app
+        model = self.fake.model(body.get('model'))
+        if model is None:
+            return self._json({'error': f"model '{body.get('model')}' not found"}, 404)
+        if body.get('keep_alive') == 0:
+            self.fake.keep_alive(model.name, 0)
+        else:
+            self.fake.load(model, body.get('keep_alive'))
+        self._json({'model': model.name, 'response': '', 'done': True})
+    
+    def _pull(self, body: Dict):
+        name = body.get('model') or body.get('name')
+        if not name:
+            return self._json({'error': 'model is required'}, 400)
+        model = self.fake.model(name) or FakeModel.from_name(name)
+        self.fake.count('pulls')
+        steps = 20
+        failure = self.fake.pick_failure()
+        if failure == 'error':
+            return self._json({'error': 'injected failure'}, 500)
+        fail_at = steps // 2 if failure else None
+        digest = f"sha256:{abs(hash(name)):064x}"[:71]
+        
+        self._start_stream()
+        self._send_line({'status': 'pulling manifest'})
+        for step in range(steps + 1):
+            if step == fail_at:
+                if failure == 'stream_error':
+                    self._send_line({'error': 'injected failure'})
+                    self._end_stream()
+                else:
+                    self._drop_connection()
+                return
+            self._send_line({
+                'status': f"pulling {digest[7:19]}", 'digest': digest,
+                'total': model.size, 'completed': model.size * step // steps
+            })
+            self.fake.sleep(model.load_seconds / steps)
+        for status in ('verifying sha256 digest', 'writing manifest', 'success'):
+            self._send_line({'status': status})
+        self._end_stream()
+        with self.fake._lock:
+            self.fake.models[name] = model
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Ollama server with simulated model timing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--parallel', type=int, default=1, help='Requests per model processed at once')
+    parser.add_argument('--speed', type=float, default=1.0, help='Run simulated delays this many times faster')
+    parser.add_argument('--models', default=','.join(DEFAULT_MODELS), help='Comma-separated installed model names')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added before every response')
+    parser.add_argument('--token-rate', type=float, default=None, help='Decode tokens/s for every model')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of chat and pull requests that fail')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for failure injection')
+    parser.add_argument('--unchunked', action='store_true', help='Stream plain bodies ended by closing the connection')
+    args = parser.parse_args()
+    
+    models = [FakeModel.from_name(name.strip()) for name in args.models.split(',') if name.strip()]
+    fake = FakeOllama(
+        models, args.host, args.port, args.parallel, args.speed, latency=args.latency,
+        token_rate=args.token_rate, failure_rate=args.failure_rate, seed=args.seed,
+        chunked=not args.unchunked
+    )
+    print(f"Fake Ollama listening on {fake.base_url} with {', '.join(fake.models)}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""Load test the Flask backend against the bundled fake Ollama.
+
+Starts a FakeOllama and ``main.app`` (on a threaded local server, with its
+data in a temporary directory), then runs these workloads at the same time:
+
+- chat: clients each holding a multi-turn conversation over the SSE endpoint,
+  exercising HistoryManager, ContextBuilder, the scheduler and SSE streaming
+- list: clients polling /api/conversations and /api/models
+- pull: clients installing models through /api/models/install and deleting them
+
+It reports latency and throughput per workload, how much time to first token
+the backend adds on top of Ollama's own (from the request trace in the final
+chat event), and the process's memory and file descriptor usage after each
+round, so leaks show up as growth between rounds.
+
+Usage:
+    python benchmarks/load_test.py [--chat-clients 8] [--turns 5] [--rounds 3] [--token-rate 200]
+                                   [--latency 0.01] [--failure-rate 0.02] [--json report.json]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+# Only modules that do not read config: the app's configuration is set up in main()
+from benchmarks.fake_ollama import FakeOllama, FakeModel, DEFAULT_MODELS
+
+CHAT_MODEL = DEFAULT_MODELS[1]
+
+def rss_bytes() -> int:
+    """Resident memory of this process (0 if unknown)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # Peak, not current, outside Linux (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+def open_fds() -> int:
+    """Open file descriptors of this process (-1 if unknown)."""
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return -1
+
+class ResourceSampler:
+    """Sample memory and file descriptors in the background, keeping the peaks."""
+    
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+    
+    def sample(self) -> Dict:
+        rss, fds = rss_bytes(), open_fds()
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_fds = max(self.peak_fds, fds)
+        return {'rss_bytes': rss, 'fds': fds}
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class Recorder:
+    """Thread-safe collection of per-workload measurements."""
+    
+    def __init__(self):
+        self.samples = {}  # name -> list of values
+        self.counts = {}  # name -> int
+        self._lock = threading.Lock()
+    
+    def add(self, name: str, value: float):
+        with self._lock:
+            self.samples.setdefault(name, []).append(value)
+    
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+def _sse_events(response: requests.Response):
+    """Yield the JSON data of each SSE event in a streamed response."""
+    from utils.ollama_client import iter_stream_lines
+    for line in iter_stream_lines(response):
+        if line.startswith('data: '):
+            yield json.loads(line[6:])
+
+def chat_client(base_url: str, index: int, turns: int, recorder: Recorder):
+    """Hold one conversation of several turns."""
+    session = requests.Session()
+    conversation_id = None
+    for turn in range(turns):
+        payload = {'message': f"Client {index}, turn {turn}: tell me something about tide pools.", 'model': CHAT_MODEL}
+        if conversation_id:
+            payload['conversation_id'] = conversation_id
+        started = time.perf_counter()
+        try:
+            with session.post(f"{base_url}/api/chat", json=payload, stream=True, timeout=120) as response:
+                if response.status_code in (429, 503):
+                    recorder.count('chat_rejected')
+                    continue
+                if response.status_code != 200:
+                    recorder.count('chat_backend_errors')
+                    continue
+                first_token = None
+                chars = 0
+                for event in _sse_events(response):
+                    if event.get('conversation_id') and not conversation_id:
+                        conversation_id = event['conversation_id']
+                    if event.get('content'):
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                        chars += len(event['content'])
+                    if event.get('error'):
+                        recorder.count('chat_upstream_errors')
+                        break
+                    if event.get('done'):
+                        ended = time.perf_counter()
+                        recorder.count('chat_ok')
+                        recorder.count('chat_chars', chars)
+                        recorder.add('chat_total', ended - started)
+                        if first_token is not None:
+                            client_ttft = first_token - started
+                            recorder.add('chat_ttft', client_ttft)
+                            _record_backend_overhead(event, client_ttft, recorder)
+                        break
+        except requests.RequestException:
+            recorder.count('chat_backend_errors')
+
+def _record_backend_overhead(done_event: Dict, client_ttft: float, recorder: Recorder):
+    """Split the client's time to first token into Ollama's part and the backend's part."""
+    timing = done_event.get('timing') or {}
+    connect = next((s for s in timing.get('spans', []) if s['name'] == 'connect'), None)
+    first_token_ms = timing.get('marks', {}).get('first_token')
+    if connect is None or first_token_ms is None:
+        return
+    upstream = (first_token_ms - connect['start_ms']) / 1000
+    backend = max(0.0, client_ttft - upstream)
+    recorder.add('chat_backend_ttft', backend)
+    queue_wait = (done_event.get('stats') or {}).get('queue_wait_ms', 0) / 1000
+    recorder.add('chat_queue_wait', queue_wait)
+    # What is left is history, context building and SSE delivery
+    recorder.add('chat_backend_ttft_unqueued', max(0.0, backend - queue_wait))
+
+def list_client(base_url: str, stop: threading.Event, recorder: Recorder):
+    """Poll the list endpoints until the chat workload is done."""
+    session = requests.Session()
+    paths = ('/api/conversations', '/api/models')
+    i = 0
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(f"{base_url}{path}", timeout=30)
+            response.content
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        recorder.add('list_latency', time.perf_counter() - started)
+        recorder.count('list_ok' if ok else 'list_errors')
+
+def pull_client(base_url: str, index: int, round_index: int, pulls: int, recorder: Recorder):
+    """Install and delete models through the backend."""
+    session = requests.Session()
+    for pull in range(pulls):
+        model = f"loadtest{index}-{round_index}-{pull}:0.5b"
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            with session.post(f"{base_url}/api/models/install", json={'model': model}, stream=True, timeout=120) as response:
+                for event in _sse_events(response):
+                    if event.get('status') == 'error' or event.get('error'):
+                        break
+                    if event.get('status') == 'success' and event.get('model'):
+                        succeeded = True
+            if succeeded:
+                session.post(f"{base_url}/api/models/delete", json={'model': model}, timeout=30).close()
+        except requests.RequestException:
+            pass
+        recorder.add('pull_duration', time.perf_counter() - started)
+        recorder.count('pull_ok' if succeeded else 'pull_errors')
+
+def _summary(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    
+    def pct(fraction):
+        return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000, 1)
+    return {
+        'count': len(ordered), 'mean_ms': round(statistics.mean(ordered) * 1000, 1),
+        'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'p99_ms': pct(0.99), 'max_ms': round(ordered[-1] * 1000, 1)
+    }
+
+def run_round(base_url: str, args, round_index: int) -> Dict:
+    """Run the three workloads once, concurrently."""
+    recorder = Recorder()
+    stop_lists = threading.Event()
+    chat_threads = [
+        threading.Thread(target=chat_client, args=(base_url, i, args.turns, recorder), daemon=True)
+        for i in range(args.chat_clients)
+    ]
+    other_threads = [
+        threading.Thread(target=list_client, args=(base_url, stop_lists, recorder), daemon=True)
+        for _ in range(args.list_clients)
+    ] + [
+        threading.Thread(target=pull_client, args=(base_url, i, round_index, args.pulls, recorder), daemon=True)
+        for i in range(args.pull_clients)
+    ]
+    
+    started = time.perf_counter()
+    for thread in chat_threads + other_threads:
+        thread.start()
+    for thread in chat_threads:
+        thread.join()
+    chat_wall = time.perf_counter() - started
+    stop_lists.set()
+    for thread in other_threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    
+    counts = recorder.counts
+    samples = recorder.samples
+    return {
+        'round': round_index,
+        'wall_seconds': round(wall, 2),
+        'chat': {
+            'ok': counts.get('chat_ok', 0),
+            'rejected': counts.get('chat_rejected', 0),
+            'upstream_errors': counts.get('chat_upstream_errors', 0),
+            'backend_errors': counts.get('chat_backend_errors', 0),
+            'replies_per_second': round(counts.get('chat_ok', 0) / chat_wall, 2) if chat_wall else 0,
+            'chars_per_second': round(counts.get('chat_chars', 0) / chat_wall, 1) if chat_wall else 0,
+            'ttft': _summary(samples.get('chat_ttft', [])),
+            'backend_added_ttft': _summary(samples.get('chat_backend_ttft', [])),
+            'queue_wait': _summary(samples.get('chat_queue_wait', [])),
+            'backend_added_ttft_unqueued': _summary(samples.get('chat_backend_ttft_unqueued', [])),
+            'total': _summary(samples.get('chat_total', []))
+        },
+        'list': {
+            'ok': counts.get('list_ok', 0),
+            'errors': counts.get('list_errors', 0),
+            'requests_per_second': round((counts.get('list_ok', 0) + counts.get('list_errors', 0)) / wall, 1) if wall else 0,
+            'latency': _summary(samples.get('list_latency', []))
+        },
+        'pull': {
+            'ok': counts.get('pull_ok', 0),
+            'errors': counts.get('pull_errors', 0),
+            'duration': _summary(samples.get('pull_duration', []))
+        }
+    }
+
+def print_round(result: Dict):
+    chat, listing, pull = result['chat'], result['list'], result['pull']
+    
+    def fmt(summary):
+        return f"p50 {summary.get('p50_ms', '-')} / p95 {summary.get('p95_ms', '-')} / max {summary.get('max_ms', '-')} ms"
+    print(f"Round {result['round']} ({result['wall_seconds']} s)")
+    print(f"  chat  ok {chat['ok']}, rejected {chat['rejected']}, upstream errors {chat['upstream_errors']}, "
+          f"backend errors {chat['backend_errors']}; {chat['replies_per_second']} replies/s, {chat['chars_per_second']} chars/s")
+    print(f"        ttft {fmt(chat['ttft'])}")
+    print(f"        backend-added ttft {fmt(chat['backend_added_ttft'])}")
+    print(f"          of which queue wait {fmt(chat['queue_wait'])}")
+    print(f"          excluding queue wait {fmt(chat['backend_added_ttft_unqueued'])}")
+    print(f"  list  ok {listing['ok']}, errors {listing['errors']}; {listing['requests_per_second']} req/s, {fmt(listing['latency'])}")
+    print(f"  pull  ok {pull['ok']}, errors {pull['errors']}; {fmt(pull['duration'])}")
+    resources = result['resources']
+    print(f"  rss {resources['rss_bytes'] / 1024 ** 2:.1f} MB, open fds {resources['fds']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--chat-clients', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=5, help='Messages per chat client per round')
+    parser.add_argument('--list-clients', type=int, default=2)
+    parser.add_argument('--pull-clients', type=int, default=1)
+    parser.add_argument('--pulls', type=int, default=2, help='Models installed per pull client per round')
+    parser.add_argument('--rounds', type=int, default=3, help='Repeat the workload mix to watch memory and fd growth')
+    parser.add_argument('--token-rate', type=float, default=200, help='Fake decode tokens/s')
+    parser.add_argument('--latency', type=float, default=0.005, help='Fake latency added to every Ollama request (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of fake chat/pull requests that fail')
+    parser.add_argument('--parallel', type=int, default=2, help='Fake requests per model processed at once')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep-data', action='store_true', help='Keep the temporary data directory')
+    parser.add_argument('--json', default=None, help='Write the report as JSON to this file')
+    args = parser.parse_args()
+    
+    fake = FakeOllama(
+        [FakeModel.from_name(name) for name in DEFAULT_MODELS], parallel=args.parallel,
+        latency=args.latency, token_rate=args.token_rate, failure_rate=args.failure_rate, seed=args.seed
+    )
+    data_dir = tempfile.mkdtemp(prefix='chatgpt-ollama-load-')
+    # The app reads its configuration at import time
+    os.environ.update({
+        'OLLAMA_BASE_URL': fake.start(),
+        'CHATGPT_OLLAMA_DATA_DIR': data_dir,
+        'TRACING_ENABLED': 'True',
+        'FLASK_PORT': '0'
+    })
+    os.environ.setdefault('SUMMARY_MODEL', DEFAULT_MODELS[0])
+    
+    from werkzeug.serving import make_server
+    import main as backend
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    
+    sampler = ResourceSampler()
+    report = {'settings': vars(args), 'rounds': []}
+    try:
+        # One request first so imports and connection pools do not count as growth
+        chat_client(base_url, -1, 1, Recorder())
+        report['baseline'] = sampler.sample()
+        sampler.start()
+        for round_index in range(args.rounds):
+            result = run_round(base_url, args, round_index)
+            backend.history_manager.flush()
+            result['resources'] = sampler.sample()
+            report['rounds'].append(result)
+            print_round(result)
+    finally:
+        sampler.stop()
+        server.shutdown()
+        fake.stop()
+        backend.history_manager.flush()
+        save_index_snapshot = getattr(backend.history_manager.storage, 'save_index_snapshot', None)
+        if save_index_snapshot:
+            save_index_snapshot()
+        if args.keep_data:
+            print(f"Data kept in {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    
+    baseline = report['baseline']
+    final = report['rounds'][-1]['resources'] if report['rounds'] else baseline
+    report['resources'] = {
+        'rss_growth_bytes': final['rss_bytes'] - baseline['rss_bytes'],
+        'peak_rss_bytes': sampler.peak_rss,
+        'fd_growth': final['fds'] - baseline['fds'],
+        'peak_fds': sampler.peak_fds
+    }
+    report['fake_ollama'] = dict(fake.stats)
+    print(f"\nMemory growth {report['resources']['rss_growth_bytes'] / 1024 ** 2:+.1f} MB "
+          f"(peak {sampler.peak_rss / 1024 ** 2:.1f} MB), fd growth {report['resources']['fd_growth']:+d} "
+          f"(peak {sampler.peak_fds}); fake Ollama: {report['fake_ollama']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,12 @@ OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.2:1b')
 # For streaming, this is the connection timeout; read timeout is handled per chunk
 OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', '300'))  # 5 minutes default
 OLLAMA_STREAM_READ_TIMEOUT = int(os.getenv('OLLAMA_STREAM_READ_TIMEOUT', '120'))  # 2 minutes per chunk
+# Connection pool shared by all OllamaClient instances (keep-alive)
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', '10'))
+# Per-call (connect, read) timeouts in seconds
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '10'))
+OLLAMA_LIST_TIMEOUT = float(os.getenv('OLLAMA_LIST_TIMEOUT', '30'))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv('OLLAMA_HEALTH_TIMEOUT', '5'))
 
 # Flask Configuration
 FLASK_HOST = os.getenv('FLASK_HOST', '127.0.0.1')
@@ -70,7 +76,77 @@ FLASK_PORT = int(os.getenv('FLASK_PORT', str(get_unique_port())))
 FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 
 # History Configuration
-# Increased to remember more context in conversations
-MAX_RECENT_MESSAGES = int(os.getenv('MAX_RECENT_MESSAGES', '30'))  # Increased from 20 to 30
+# Context is packed by token budget; MAX_RECENT_MESSAGES optionally caps the message count (0 = no cap)
+MAX_RECENT_MESSAGES = int(os.getenv('MAX_RECENT_MESSAGES', '0'))
 SUMMARY_THRESHOLD = int(os.getenv('SUMMARY_THRESHOLD', '40'))  # Lower threshold to summarize earlier
-CONTEXT_WINDOW_SIZE = int(os.getenv('CONTEXT_WINDOW_SIZE', '4096'))
+CONTEXT_WINDOW_SIZE = int(os.getenv('CONTEXT_WINDOW_SIZE', '4096'))  # Also sent to Ollama as num_ctx
+CONTEXT_RESPONSE_RESERVE = int(os.getenv('CONTEXT_RESPONSE_RESERVE', '1024'))  # Tokens kept free for the reply
+# When history overflows, drop enough to free this fraction of the budget at once, so the prompt
+# prefix (and Ollama's prompt cache) stays valid for the next turns (0 = slide every turn)
+CONTEXT_BLOCK_FRACTION = float(os.getenv('CONTEXT_BLOCK_FRACTION', '0.5'))
+
+# Conversation storage backend: 'file' (JSON Lines per conversation) or 'sqlite'
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'file')
+# Number of appended metadata records after which a conversation log is compacted in the background
+HISTORY_COMPACT_THRESHOLD = int(os.getenv('HISTORY_COMPACT_THRESHOLD', '50'))
+# Seconds to wait before writing the conversation index snapshot after a change
+HISTORY_INDEX_SNAPSHOT_DELAY = float(os.getenv('HISTORY_INDEX_SNAPSHOT_DELAY', '5'))
+# In-memory LRU cache of recently used conversations
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', '64'))  # Max cached conversations
+HISTORY_CACHE_MAX_BYTES = int(os.getenv('HISTORY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))  # Approximate memory budget
+# Seconds to coalesce saves before writing them to storage (0 = write immediately)
+HISTORY_WRITE_BEHIND_DELAY = float(os.getenv('HISTORY_WRITE_BEHIND_DELAY', '2'))
+
+# Background summarization
+SUMMARY_MODEL = os.getenv('SUMMARY_MODEL', 'qwen2:0.5b')  # Small model for summaries ('' = heuristic only)
+SUMMARY_QUEUE_SIZE = int(os.getenv('SUMMARY_QUEUE_SIZE', '32'))  # Beyond this, queued jobs use the heuristic summary
+SUMMARY_MIN_BATCH = int(os.getenv('SUMMARY_MIN_BATCH', '6'))  # Evicted messages needed before calling the model
+SUMMARY_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '512'))  # Larger summaries are compressed one level up
+SUMMARY_RETRY_DELAY = float(os.getenv('SUMMARY_RETRY_DELAY', '300'))  # Seconds to use the heuristic after a model failure
+
+# SSE streaming: coalesce tokens into fewer frames
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '30'))  # Time window per frame (0 = one frame per token)
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '512'))  # Flush early once this much text is buffered
+SSE_FLUSH_FIRST = os.getenv('SSE_FLUSH_FIRST', 'True').lower() == 'true'  # Send the first token immediately
+
+# Chat generations run on worker threads; clients attach to their event buffer
+GENERATION_BUFFER_EVENTS = int(os.getenv('GENERATION_BUFFER_EVENTS', '1024'))  # Events kept for reattaching clients
+GENERATION_CHECKPOINT_SECONDS = float(os.getenv('GENERATION_CHECKPOINT_SECONDS', '2'))  # Partial reply save interval (0 = only at the end)
+GENERATION_RETENTION = float(os.getenv('GENERATION_RETENTION', '60'))  # Seconds a finished generation stays attachable
+GENERATION_KEEPALIVE_SECONDS = float(os.getenv('GENERATION_KEEPALIVE_SECONDS', '15'))  # Idle time before an SSE keepalive comment
+GENERATION_DETACH_GRACE = float(os.getenv('GENERATION_DETACH_GRACE', '5'))  # Cancel once no client is attached for this long (-1 = never)
+
+# Scheduling of model work (chat generations and background summaries)
+SCHEDULER_GLOBAL_CONCURRENCY = int(os.getenv('SCHEDULER_GLOBAL_CONCURRENCY', '2'))  # Requests running at once, all models
+SCHEDULER_MODEL_CONCURRENCY = int(os.getenv('SCHEDULER_MODEL_CONCURRENCY', '1'))  # Requests running at once per model
+SCHEDULER_MAX_QUEUE = int(os.getenv('SCHEDULER_MAX_QUEUE', '32'))  # Queued requests beyond this get 503
+SCHEDULER_MAX_QUEUE_PER_MODEL = int(os.getenv('SCHEDULER_MAX_QUEUE_PER_MODEL', '16'))  # Queued requests per model beyond this get 429
+SCHEDULER_AFFINITY_WAIT = float(os.getenv('SCHEDULER_AFFINITY_WAIT', '2'))  # Seconds a request yields to already-loaded models
+
+# Model residency: which models Ollama keeps loaded
+RESIDENCY_RAM_BUDGET_MB = int(os.getenv('RESIDENCY_RAM_BUDGET_MB', '0'))  # Unload LRU models beyond this (0 = no budget)
+RESIDENCY_KEEP_ALIVE_MIN = int(os.getenv('RESIDENCY_KEEP_ALIVE_MIN', '300'))  # keep_alive seconds per recent use
+RESIDENCY_KEEP_ALIVE_MAX = int(os.getenv('RESIDENCY_KEEP_ALIVE_MAX', '3600'))  # Upper bound on keep_alive seconds
+RESIDENCY_USAGE_WINDOW = float(os.getenv('RESIDENCY_USAGE_WINDOW', '3600'))  # Seconds of usage history counted
+RESIDENCY_PS_TTL = float(os.getenv('RESIDENCY_PS_TTL', '5'))  # Seconds to reuse the /api/ps result
+
+# Request tracing: per-request spans returned in Server-Timing headers
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'True').lower() == 'true'
+TRACE_SLOW_REQUEST_MS = float(os.getenv('TRACE_SLOW_REQUEST_MS', '1000'))  # Log requests slower than this (0 = never); excludes token streaming
+TRACE_SLOW_LOG_MAX_BYTES = int(os.getenv('TRACE_SLOW_LOG_MAX_BYTES', str(1024 * 1024)))  # Rotate the slow request log at this size
+TRACE_SLOW_LOG_BACKUPS = int(os.getenv('TRACE_SLOW_LOG_BACKUPS', '3'))  # Rotated slow request logs kept
+
+# Cache of the installed model list (Ollama's /api/tags)
+MODEL_LIST_TTL = float(os.getenv('MODEL_LIST_TTL', '30'))  # Seconds before the list is refreshed in the background
+MODEL_LIST_RETRY_MIN = float(os.getenv('MODEL_LIST_RETRY_MIN', '2'))  # Seconds before retrying after Ollama fails, doubled per failure
+MODEL_LIST_RETRY_MAX = float(os.getenv('MODEL_LIST_RETRY_MAX', '60'))  # Upper bound on the retry delay
+
+# Model downloads run in the background, one per model
+MODEL_PULL_CONCURRENCY = int(os.getenv('MODEL_PULL_CONCURRENCY', '2'))  # Pulls running at once; the rest wait
+MODEL_PULL_RETENTION = float(os.getenv('MODEL_PULL_RETENTION', '300'))  # Seconds a finished download stays listed
+MODEL_PULL_PROGRESS_INTERVAL = float(os.getenv('MODEL_PULL_PROGRESS_INTERVAL', '0.25'))  # Min seconds between byte progress events
+
+# Background monitor of Ollama and dependency status
+STATUS_PROBE_MIN = float(os.getenv('STATUS_PROBE_MIN', '1'))  # Seconds to the next probe after a change
+STATUS_PROBE_MAX = float(os.getenv('STATUS_PROBE_MAX', '15'))  # Probe delay doubles up to this while nothing changes
+STATUS_DEPENDENCY_INTERVAL = float(os.getenv('STATUS_DEPENDENCY_INTERVAL', '300'))  # Seconds between `ollama --version` checks
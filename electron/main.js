@@ -190,6 +190,59 @@ function checkOllamaRunning(callback) {
   req.end();
 }
 
+// Follow Ollama's status from the backend's status monitor instead of polling Ollama
+function watchOllamaStatus() {
+  let retried = false;
+  const retry = () => {
+    if (!retried) {
+      retried = true;
+      setTimeout(watchOllamaStatus, 5000);
+    }
+  };
+
+  const req = http.get({
+    hostname: 'localhost',
+    port: FLASK_PORT,
+    path: '/api/status/stream'
+  }, (res) => {
+    if (res.statusCode !== 200) {
+      res.resume();
+      retry();
+      return;
+    }
+
+    let buffer = '';
+    let wasRunning = null;
+    res.setEncoding('utf8');
+    res.on('data', (chunk) => {
+      buffer += chunk;
+      const frames = buffer.split('\n\n');
+      buffer = frames.pop();
+      for (const frame of frames) {
+        const dataLine = frame.split('\n').find(line => line.startsWith('data: '));
+        if (!dataLine) continue;
+        let status;
+        try {
+          status = JSON.parse(dataLine.slice(6));
+        } catch (err) {
+          continue;
+        }
+        const isRunning = !!(status.ollama && status.ollama.running);
+        if (!isRunning && wasRunning && !ollamaProcess) {
+          console.log('Ollama stopped running, attempting to restart...');
+          showNotification('Ollama Stopped', 'Ollama service stopped. Attempting to restart...');
+          startOllama();
+        }
+        wasRunning = isRunning;
+      }
+    });
+    res.on('close', retry);
+  });
+
+  // The backend may not be up yet; try again shortly
+  req.on('error', retry);
+}
+
 // Start Ollama service
 function startOllama() {
   console.log('Starting Ollama service...');
@@ -556,16 +609,8 @@ app.whenReady().then(() => {
     }
   });
   
-  // Periodically check Ollama health (every 30 seconds)
-  setInterval(() => {
-    checkOllamaRunning((isRunning) => {
-      if (!isRunning && !ollamaProcess) {
-        console.log('Ollama stopped running, attempting to restart...');
-        showNotification('Ollama Stopped', 'Ollama service stopped. Attempting to restart...');
-        startOllama();
-      }
-    });
-  }, 30000);
+  // Restart Ollama if it stops (the backend pushes status changes)
+  watchOllamaStatus();
   
   // Create window immediately - renderer will wait for backend
   createWindow();
@@ -123,6 +123,8 @@ class ChatApp {
         this.models = [];
         this.allModels = [];  // All available models from library
         this.popularModels = [];
+        this.modelsEtag = null;  // ETag of the last /api/models response
+        this.followedDownloads = new Set();  // Models whose download progress this window is following
         this.selectedModels = new Set();
         this.modelFilter = 'all';  // 'all', 'text', 'image', 'multimodal', 'installed'
         this.messageIndices = new Map();  // Map messageId to message index
@@ -157,6 +159,7 @@ class ChatApp {
                             // Silently handle - endpoint might not be ready yet
                             console.log('Dependencies check will be available after backend fully initializes');
                         });
+                        this.watchStatus();
                     }, 3000); // Increased delay to ensure endpoint is ready
                     return;
                 }
@@ -184,6 +187,30 @@ class ChatApp {
         );
     }
     
+    watchStatus() {
+        // The backend pushes Ollama status changes; EventSource reconnects by itself
+        const source = new EventSource(`${API_BASE}/api/status/stream`);
+        let wasRunning = null;
+        source.onmessage = (event) => {
+            let status;
+            try {
+                status = JSON.parse(event.data);
+            } catch (e) {
+                return;
+            }
+            const isRunning = !!(status.ollama && status.ollama.running);
+            if (wasRunning !== null && isRunning !== wasRunning) {
+                console.log(`Ollama is ${isRunning ? 'running again' : 'no longer running'}`);
+                this.checkDependencies();
+                if (isRunning) {
+                    // The backend refetches its model list once Ollama is back
+                    this.loadModels();
+                }
+            }
+            wasRunning = isRunning;
+        };
+    }
+    
     async checkDependencies() {
         try {
             const response = await fetch(`${API_BASE}/api/dependencies`, {
@@ -333,6 +360,7 @@ class ChatApp {
         // Model select
         document.getElementById('modelSelect').addEventListener('change', (e) => {
             this.currentModel = e.target.value;
+            this.warmModel(this.currentModel);
         });
         
         // Install models
@@ -415,10 +443,16 @@ class ChatApp {
     async loadModels(refresh = false) {
         try {
             const url = refresh ? `${API_BASE}/api/models?refresh=true` : `${API_BASE}/api/models`;
-            const response = await fetch(url);
+            // Revalidate ourselves: the server answers 304 when the model list is unchanged
+            const headers = this.modelsEtag ? { 'If-None-Match': this.modelsEtag } : {};
+            const response = await fetch(url, { headers, cache: 'no-store' });
+            if (response.status === 304) {
+                return;
+            }
             const data = await response.json();
             
             if (data.success) {
+                this.modelsEtag = response.headers.get('ETag');
                 this.models = data.models || [];  // Installed models
                 this.allModels = data.all_models || [];  // All available models
                 this.popularModels = data.popular_models || [];
@@ -430,6 +464,7 @@ class ChatApp {
                 if (this.models.length > 0 && !this.currentModel) {
                     this.currentModel = this.models[0].name;
                     document.getElementById('modelSelect').value = this.currentModel;
+                    this.warmModel(this.currentModel);
                 }
             }
         } catch (error) {
@@ -612,6 +647,32 @@ class ChatApp {
         this.populateInstallModal();
         await this.loadModels();
         this.populateInstallModal();
+        
+        this.resumeDownloads();
+    }
+    
+    async resumeDownloads() {
+        // Downloads keep running in the backend; follow ones started before this window opened
+        try {
+            const response = await fetch(`${API_BASE}/api/models/downloads`);
+            const data = await response.json();
+            const running = (data.downloads || []).filter(d =>
+                (d.status === 'queued' || d.status === 'pulling') && !this.followedDownloads.has(d.model)
+            );
+            for (const download of running) {
+                console.log(`Following running download of ${download.model}`);
+                // Installing a model that is already downloading joins that download
+                this.installModel(download.model)
+                    .then(async () => {
+                        await this.loadModels(true);
+                        this.populateModelSelect();
+                        this.populateInstallModal();
+                    })
+                    .catch(error => console.error(`Download of ${download.model} failed:`, error));
+            }
+        } catch (error) {
+            console.error('Error loading downloads:', error);
+        }
     }
     
     closeInstallModal() {
@@ -712,6 +773,15 @@ class ChatApp {
     }
     
     async installModel(modelName) {
+        this.followedDownloads.add(modelName);
+        try {
+            return await this.followInstall(modelName);
+        } finally {
+            this.followedDownloads.delete(modelName);
+        }
+    }
+    
+    followInstall(modelName) {
         return new Promise((resolve, reject) => {
             console.log(`Starting installation of model: ${modelName}`);
             
@@ -779,8 +849,11 @@ class ChatApp {
                                         return;
                                     }
                                     
-                                    // Log progress updates
-                                    if (data.status) {
+                                    // Log progress updates (byte progress arrives a few times per second)
+                                    if (data.percent !== undefined) {
+                                        const eta = data.eta_seconds !== undefined ? `, ${Math.round(data.eta_seconds)}s left` : '';
+                                        console.log(`Progress: ${data.status} ${data.percent}%${eta}`);
+                                    } else if (data.status) {
                                         console.log(`Progress: ${data.status}`);
                                     }
                                 } catch (e) {
@@ -926,8 +999,16 @@ class ChatApp {
             
             if (data.success) {
                 this.currentConversationId = conversationId;
-                this.renderMessages(data.conversation.messages);
+                let messages = data.conversation.messages;
+                if (data.active_generation_id && messages.length && messages[messages.length - 1].partial) {
+                    // The reply is still being generated; it is replayed from the stream below
+                    messages = messages.slice(0, -1);
+                }
+                this.renderMessages(messages);
                 this.renderConversations();
+                if (data.active_generation_id) {
+                    this.followGeneration(data.active_generation_id);
+                }
             }
         } catch (error) {
             console.error('Error loading conversation:', error);
@@ -1025,12 +1106,15 @@ class ChatApp {
             });
             
             if (!response.ok) {
-                throw new Error('Failed to send message');
+                // 429/503 when the model queue is full
+                const errorData = await response.json().catch(() => ({}));
+                throw new Error(errorData.error || 'Failed to send message');
             }
             
             // Stream response
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
+            let buffer = '';
             let assistantMessageId = this.addMessage('assistant', '');
             
             // Hide loading indicator once we start receiving content
@@ -1048,8 +1132,10 @@ class ChatApp {
                     const { done, value } = await reader.read();
                     if (done) break;
                     
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
+                    // Frames can span reads; keep the incomplete line in the buffer
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop() || '';
                     
                     for (const line of lines) {
                         if (line.startsWith('data: ')) {
@@ -1059,7 +1145,13 @@ class ChatApp {
                                     this.updateMessage(assistantMessageId, `Error: ${data.error}`);
                                     break;
                                 }
-                                if (data.content) {
+                                if (data.queued) {
+                                    this.updateMessage(assistantMessageId, `Waiting for the model (position ${data.position} in queue)...`);
+                                } else if (data.queued === false) {
+                                    this.updateMessage(assistantMessageId, '');
+                                } else if (data.replace) {
+                                    this.updateMessage(assistantMessageId, data.content);
+                                } else if (data.content) {
                                     this.appendToMessage(assistantMessageId, data.content);
                                 }
                                 if (data.done) {
@@ -1100,6 +1192,63 @@ class ChatApp {
         }
     }
     
+    warmModel(modelName) {
+        // Load the model in the background so the first message doesn't wait for it
+        if (!modelName) return;
+        fetch(`${API_BASE}/api/models/warm`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ model: modelName })
+        }).catch((error) => console.error('Error warming model:', error));
+    }
+    
+    async followGeneration(generationId) {
+        // Reattach to a reply that is still being generated (e.g. after a reload)
+        const conversationId = this.currentConversationId;
+        const assistantMessageId = this.addMessage('assistant', '');
+        this.isStreaming = true;
+        try {
+            const response = await fetch(`${API_BASE}/api/chat/${generationId}/stream`);
+            if (!response.ok) {
+                return;
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done || this.currentConversationId !== conversationId) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop() || '';
+                
+                for (const line of lines) {
+                    if (!line.startsWith('data: ')) continue;
+                    try {
+                        const data = JSON.parse(line.slice(6));
+                        if (data.error) {
+                            this.updateMessage(assistantMessageId, `Error: ${data.error}`);
+                        } else if (data.replace) {
+                            this.updateMessage(assistantMessageId, data.content);
+                        } else if (data.content) {
+                            this.appendToMessage(assistantMessageId, data.content);
+                        }
+                    } catch (e) {
+                        // Ignore parse errors
+                    }
+                }
+            }
+            reader.cancel();
+        } catch (error) {
+            console.error('Error following generation:', error);
+        } finally {
+            this.isStreaming = false;
+            this.scrollToBottom(false, true);
+        }
+    }
+    
     showLoading() {
         const loadingEl = document.getElementById('messageLoading');
         if (loadingEl) {
@@ -1446,12 +1595,15 @@ class ChatApp {
             });
             
             if (!response.ok) {
-                throw new Error('Failed to send message');
+                // 429/503 when the model queue is full
+                const errorData = await response.json().catch(() => ({}));
+                throw new Error(errorData.error || 'Failed to send message');
             }
             
             // Stream response
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
+            let buffer = '';
             let assistantMessageId = this.addMessage('assistant', '');
             
             // Hide loading indicator once we start receiving content
@@ -1469,14 +1621,22 @@ class ChatApp {
                     const { done, value } = await reader.read();
                     if (done) break;
                     
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
+                    // Frames can span reads; keep the incomplete line in the buffer
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop() || '';
                     
                     for (const line of lines) {
                         if (line.startsWith('data: ')) {
                             try {
                                 const data = JSON.parse(line.slice(6));
-                                if (data.content) {
+                                if (data.queued) {
+                                    this.updateMessage(assistantMessageId, `Waiting for the model (position ${data.position} in queue)...`);
+                                } else if (data.queued === false) {
+                                    this.updateMessage(assistantMessageId, '');
+                                } else if (data.replace) {
+                                    this.updateMessage(assistantMessageId, data.content);
+                                } else if (data.content) {
                                     this.appendToMessage(assistantMessageId, data.content);
                                 }
                                 if (data.done) {
@@ -3,6 +3,8 @@ import os
 import sys
 import json
 import uuid
+import signal
+import threading
 from datetime import datetime
 
 # Add the directory containing this script to Python path
@@ -16,40 +18,144 @@ parent_dir = os.path.dirname(script_dir)
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from config import FLASK_HOST, FLASK_PORT, FLASK_DEBUG, OLLAMA_MODEL, OLLAMA_BASE_URL
+from config import FLASK_HOST, FLASK_PORT, FLASK_DEBUG, OLLAMA_MODEL
 from utils.ollama_client import OllamaClient
 from utils.history_manager import HistoryManager
 from utils.context_builder import ContextBuilder
 from utils.model_manager import ModelManager
-from check_dependencies import check_python, check_ollama
+from utils.summarizer import RollingSummarizer
+from utils.generation import GenerationManager
+from utils.downloads import DownloadManager
+from utils.status_monitor import StatusMonitor
+from utils.scheduler import ModelScheduler, SchedulerFull, PRIORITIES, BATCH
+from utils.residency import ResidencyManager
+from utils.metrics import registry as metrics_registry
+from utils.tracing import start_trace, NULL_TRACE
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
 
 # Initialize services
 ollama_client = OllamaClient()
 history_manager = HistoryManager()
-context_builder = ContextBuilder()
+context_builder = ContextBuilder(history_manager)
 model_manager = ModelManager()
+scheduler = ModelScheduler()
+residency = ResidencyManager(ollama_client, model_manager, scheduler)
+scheduler.is_loaded = residency.is_loaded
+summarizer = RollingSummarizer(history_manager, context_builder, scheduler=scheduler)
+generation_manager = GenerationManager(ollama_client, history_manager, summarizer, scheduler, residency)
+download_manager = DownloadManager(ollama_client, model_manager)
+status_monitor = StatusMonitor(ollama_client, residency)
+
+def _on_status_change(old, new):
+    # The cached model list may be from before Ollama went away
+    if new['ollama']['running'] and not old.get('ollama', {}).get('running'):
+        model_manager.invalidate()
+
+def _on_ollama_error(error):
+    # A failed chat, pull or model list fetch may mean Ollama went away: probe now
+    status_monitor.poke()
+
+status_monitor.add_listener(_on_status_change)
+generation_manager.add_error_listener(_on_ollama_error)
+download_manager.add_error_listener(_on_ollama_error)
+model_manager.add_error_listener(_on_ollama_error)
+status_monitor.start()
+
+metrics_registry.gauge(
+    'scheduler_running', 'Requests holding a model slot.',
+    lambda: {(model,): count for model, count in scheduler.stats()['running'].items()}, ('model',)
+)
+metrics_registry.gauge(
+    'scheduler_queued', 'Requests waiting for a model slot.',
+    lambda: {(model,): count for model, count in scheduler.stats()['queued_by_model'].items()}, ('model',)
+)
+
+@app.before_request
+def _start_request_trace():
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace = start_trace(f"{request.method} {rule}")
+
+@app.after_request
+def _finish_request_trace(response):
+    """Add the request's timings as a Server-Timing header and finish its trace.
+    
+    Chat requests hand their trace to the generation, which finishes it.
+    """
+    trace = g.pop('trace', NULL_TRACE)
+    if trace.enabled:
+        response.headers.setdefault('Server-Timing', trace.server_timing())
+        response.headers['Timing-Allow-Origin'] = '*'
+        trace.finish()
+    return response
+
+def _trace():
+    """Get the current request's trace."""
+    return g.get('trace', NULL_TRACE)
+
+def _flush_and_exit(signum, frame):
+    """Write pending conversation saves before the process is terminated."""
+    history_manager.flush()
+    sys.exit(0)
+
+for _signal_name in ('SIGTERM', 'SIGINT', 'SIGBREAK'):
+    if hasattr(signal, _signal_name):
+        try:
+            signal.signal(getattr(signal, _signal_name), _flush_and_exit)
+        except ValueError:
+            # Not in the main thread (e.g. imported by a test runner)
+            pass
+
+def _ollama_running() -> bool:
+    """Whether Ollama is up, probing again first if the last probe found it down."""
+    if status_monitor.ollama_running():
+        return True
+    return status_monitor.check(max_age=1.0)['ollama']['running']
 
 @app.route('/api/health')
 def health():
-    """Health check endpoint."""
-    ollama_connected = ollama_client.check_health()
+    """Health check endpoint (reads the status monitor, no call to Ollama)."""
     return jsonify({
         'status': 'ok',
-        'ollama_connected': ollama_connected
+        'ollama_connected': status_monitor.ollama_running()
+    })
+
+@app.route('/api/status')
+def status():
+    """Get the status monitor's latest snapshot of Ollama and the dependencies."""
+    return jsonify({
+        'success': True,
+        **status_monitor.snapshot()
     })
 
+@app.route('/api/status/stream')
+def status_stream():
+    """Stream the status snapshot as SSE: the current one, then one per change."""
+    return Response(
+        stream_with_context(status_monitor.subscribe()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @app.route('/api/dependencies')
 def check_dependencies():
     """Check Python and Ollama installation status."""
     try:
-        python_installed, python_version = check_python()
-        ollama_installed, ollama_version = check_ollama()
-        ollama_running = ollama_client.check_health()
+        # Right after startup the first probe may still be running
+        state = status_monitor.wait_ready(timeout=3.0)
+        if not state['checked']:
+            raise Exception('Status check has not finished yet')
+        python_installed = state['python']['installed']
+        python_version = state['python']['version']
+        ollama_installed = state['ollama']['installed']
+        ollama_version = state['ollama']['cli_version']
+        ollama_running = state['ollama']['running']
         
         return jsonify({
             'success': True,
@@ -89,41 +195,65 @@ def check_dependencies():
 
 @app.route('/api/models')
 def get_models():
-    """Get available models, popular models, and all available models from Ollama library."""
+    """Get available models, popular models, and all available models from Ollama library.
+    
+    The payload is serialized once per change of the installed models and sent
+    with an ETag; a request with a matching If-None-Match gets 304.
+    """
     refresh = request.args.get('refresh', 'false').lower() == 'true'
     
     try:
-        # Get installed models
-        installed_models = model_manager.get_available_models(refresh=refresh)
-        installed_names = {m.get('name') for m in installed_models}
-        
-        # Get all available models from Ollama library
-        all_models_list = model_manager.get_all_available_models_from_ollama()
-        
-        # Categorize and format all models
-        all_models_formatted = []
-        for model_name in all_models_list:
-            is_installed = model_name in installed_names
-            category = model_manager.categorize_model(model_name)
-            size = model_manager.get_model_size(model_name)
-            
-            all_models_formatted.append({
-                'name': model_name,
-                'installed': is_installed,
-                'category': category,
-                'size': size,
-                'verified': True  # All models in the list are verified
-            })
-        
-        popular_models = model_manager.get_popular_models()
-        
+        with _trace().span('models_snapshot'):
+            snapshot = model_manager.get_models_snapshot(refresh=refresh)
+        response = Response(snapshot.body, mimetype='application/json')
+        response.set_etag(snapshot.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/models/cache', methods=['GET'])
+def model_cache_stats():
+    """Get installed model list cache counters."""
+    return jsonify({
+        'success': True,
+        'cache': model_manager.cache_stats()
+    })
+
+@app.route('/api/models/warm', methods=['POST'])
+def warm_model():
+    """Load a model in the background ahead of its first message."""
+    data = request.get_json() or {}
+    model_name = data.get('model', '').strip()
+    if not model_name:
+        return jsonify({'success': False, 'error': 'Model name required'}), 400
+    if not model_manager.is_model_installed(model_name):
+        return jsonify({'success': False, 'error': 'Model not installed'}), 404
+    
+    if residency.is_loaded(model_name):
+        return jsonify({'success': True, 'status': 'loaded'})
+    
+    def warm():
+        try:
+            # Loading competes with chats for memory, so it waits for a slot like batch work
+            with scheduler.slot(model_name, BATCH, key='warm'):
+                residency.warm(model_name)
+        except Exception as e:
+            print(f"Error warming model {model_name}: {e}")
+    
+    threading.Thread(target=warm, daemon=True).start()
+    return jsonify({'success': True, 'status': 'warming'}), 202
+
+@app.route('/api/ps')
+def running_models():
+    """Get the models Ollama has loaded, with recent usage and the memory budget."""
+    try:
         return jsonify({
             'success': True,
-            'models': installed_models,  # Currently installed models
-            'all_models': all_models_formatted,  # All available models from library
-            'popular_models': popular_models,
-            'total_installed': len(installed_models),
-            'total_available': len(all_models_formatted)
+            **residency.snapshot()
         })
     except Exception as e:
         return jsonify({
@@ -159,17 +289,18 @@ def delete_model():
         return jsonify({'success': False, 'error': 'Model name required'}), 400
     
     # Check if Ollama is running
-    if not ollama_client.check_health():
+    if not _ollama_running():
         return jsonify({
             'success': False,
             'error': 'Ollama service is not running. Please start Ollama and try again.'
         }), 503
     
     try:
-        # Clear model cache to force refresh after deletion
-        model_manager._cached_models = None
-        
-        ollama_client.delete_model(model)
+        try:
+            ollama_client.delete_model(model)
+        finally:
+            # Refetch the installed models even if the delete failed partway
+            model_manager.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({
@@ -179,7 +310,11 @@ def delete_model():
 
 @app.route('/api/models/install', methods=['POST'])
 def install_model():
-    """Install an Ollama model (streaming)."""
+    """Install an Ollama model (streaming).
+    
+    The download runs in the background; if the model is already being
+    downloaded, this follows the running download instead of starting another.
+    """
     data = request.get_json()
     model = data.get('model')
     
@@ -191,7 +326,7 @@ def install_model():
         yield f"data: {json.dumps({'error': error_msg, 'status': 'error'})}\n\n"
     
     # Check if Ollama is running
-    if not ollama_client.check_health():
+    if not _ollama_running():
         return Response(
             stream_with_context(generate_error_response('Ollama service is not running. Please start Ollama and try again.')),
             mimetype='text/event-stream',
@@ -201,45 +336,12 @@ def install_model():
             }
         )
     
-    def generate():
-        try:
-            error_occurred = False
-            for progress in ollama_client.pull_model(model):
-                # Check if Ollama returned an error in the progress update
-                if isinstance(progress, dict):
-                    if 'error' in progress:
-                        error_occurred = True
-                        error_msg = progress.get('error', 'Unknown error')
-                        # Provide more helpful error messages
-                        if 'manifest' in error_msg.lower() or 'file does not exist' in error_msg.lower():
-                            error_msg = f"Model '{model}' not found in Ollama registry. Please check:\n1. The model name is correct (e.g., 'llama3:8b', 'mistral:7b')\n2. Your internet connection is working\n3. Ollama can access the model registry"
-                        yield f"data: {json.dumps({'error': error_msg, 'status': 'error'})}\n\n"
-                        return
-                    elif 'status' in progress and progress.get('status') == 'error':
-                        error_occurred = True
-                        error_msg = progress.get('error', 'Unknown error occurred during model installation')
-                        yield f"data: {json.dumps({'error': error_msg, 'status': 'error'})}\n\n"
-                        return
-                
-                yield f"data: {json.dumps(progress)}\n\n"
-            
-            if not error_occurred:
-                # Clear model cache to force refresh after installation
-                model_manager._cached_models = None
-                
-                # Send completion message
-                yield f"data: {json.dumps({'status': 'success', 'model': model})}\n\n"
-        except Exception as e:
-            error_msg = str(e)
-            # Provide more helpful error messages
-            if 'connection' in error_msg.lower() or 'timeout' in error_msg.lower():
-                error_msg = f"Failed to connect to Ollama service. Please ensure:\n1. Ollama is running\n2. Ollama is accessible at {OLLAMA_BASE_URL}\n3. Your firewall is not blocking the connection"
-            elif 'manifest' in error_msg.lower() or 'file does not exist' in error_msg.lower():
-                error_msg = f"Model '{model}' not found in Ollama registry. Please verify the model name is correct."
-            yield f"data: {json.dumps({'error': error_msg, 'status': 'error'})}\n\n"
-    
+    return _download_response(download_manager.start(model))
+
+def _download_response(download, last_event_id: int = 0):
+    """Stream a download's progress as SSE."""
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(download.subscribe(last_event_id)),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
@@ -247,20 +349,61 @@ def install_model():
         }
     )
 
+@app.route('/api/models/downloads', methods=['GET'])
+def list_downloads():
+    """List running and recently finished model downloads."""
+    return jsonify({
+        'success': True,
+        'downloads': download_manager.list()
+    })
+
+@app.route('/api/models/downloads/<path:model_name>/stream', methods=['GET'])
+def download_stream(model_name):
+    """Follow a model download.
+    
+    Starts with the download's current state, or resumes after the
+    Last-Event-ID header (or last_event_id query parameter) when given.
+    """
+    download = download_manager.get(model_name)
+    if not download:
+        return jsonify({'success': False, 'error': 'Download not found'}), 404
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Last-Event-ID must be an integer'}), 400
+    
+    return _download_response(download, last_event_id)
+
+@app.route('/api/models/downloads/<path:model_name>/cancel', methods=['POST'])
+def cancel_download(model_name):
+    """Stop a model download."""
+    cancelled = download_manager.cancel(model_name)
+    if cancelled is None:
+        return jsonify({'success': False, 'error': 'Download not found'}), 404
+    return jsonify({'success': True, 'cancelled': cancelled})
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Send message and get streaming response."""
-    data = request.get_json()
-    message = data.get('message', '').strip()
-    conversation_id = data.get('conversation_id')
-    model = data.get('model', OLLAMA_MODEL)
+    trace = _trace()
+    with trace.span('parse'):
+        data = request.get_json()
+        message = data.get('message', '').strip()
+        conversation_id = data.get('conversation_id')
+        model = data.get('model', OLLAMA_MODEL)
+        priority = data.get('priority', 'interactive')
+    trace.set('model', model)
     
     if not message:
         return jsonify({'success': False, 'error': 'Message required'}), 400
+    if priority not in PRIORITIES:
+        return jsonify({'success': False, 'error': f"priority must be one of: {', '.join(PRIORITIES)}"}), 400
     
     # Get or create conversation
     if conversation_id:
-        conversation = history_manager.get_conversation(conversation_id)
+        with trace.span('get_conversation'):
+            conversation = history_manager.get_conversation(conversation_id)
         if not conversation:
             return jsonify({'success': False, 'error': 'Conversation not found'}), 404
     else:
@@ -288,52 +431,87 @@ def chat():
         conversation['title'] = message[:50] + ('...' if len(message) > 50 else '')
     
     # Build context
-    context_messages = context_builder.build_context(conversation_id, conversation['messages'])
+    with trace.span('build_context'):
+        context_messages, context_info = context_builder.build_context_info(conversation_id, conversation['messages'], model)
     
-    # Stream response
-    def generate():
-        assistant_content = ''
-        try:
-            for chunk in ollama_client.chat(model, context_messages, stream=True):
-                assistant_content += chunk
-                yield f"data: {json.dumps({'content': chunk, 'done': False})}\n\n"
-            
-            # Save assistant message
-            assistant_message = {
-                'role': 'assistant',
-                'content': assistant_content,
-                'timestamp': datetime.now().isoformat()
-            }
-            conversation['messages'].append(assistant_message)
-            conversation['updated_at'] = datetime.now().isoformat()
-            
-            # Save conversation
-            history_manager.save_conversation(conversation)
-            
-            # Create summary if needed
-            if context_builder.should_summarize(conversation['messages']):
-                summary = context_builder.create_summary(conversation['messages'])
-                history_manager.save_summary(conversation_id, summary)
-            
-            # Send final update with conversation_id
-            yield f"data: {json.dumps({'content': '', 'done': True, 'conversation_id': conversation_id, 'title': conversation['title']})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
+    # Generate on a worker thread; this response is just the first subscriber.
+    # The generation continues the trace; streaming time does not count as slow.
+    trace.slow_exclude = ('stream',)
+    try:
+        generation = generation_manager.start(
+            conversation, context_messages, model, PRIORITIES[priority], context_info, trace
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except SchedulerFull as e:
+        response = jsonify({'success': False, 'error': str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status_code
     
+    g.pop('trace', None)
+    response = _generation_response(generation)
+    if trace.enabled:
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+def _generation_response(generation, last_event_id=0):
+    """Stream a generation's events as SSE."""
     return Response(
-        stream_with_context(generate()),
+        stream_with_context(generation.subscribe(last_event_id)),
         mimetype='text/event-stream',
         headers={
             'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no'
+            'X-Accel-Buffering': 'no',
+            'X-Generation-Id': generation.id
         }
     )
 
+@app.route('/api/chat/<generation_id>/stream', methods=['GET'])
+def chat_stream(generation_id):
+    """Attach to a running (or just finished) generation.
+    
+    Resumes after the Last-Event-ID header (or last_event_id query parameter)
+    when given, otherwise replays the generation from the start.
+    """
+    generation = generation_manager.get(generation_id)
+    if not generation:
+        return jsonify({'success': False, 'error': 'Generation not found'}), 404
+    
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Last-Event-ID must be an integer'}), 400
+    
+    return _generation_response(generation, last_event_id)
+
+@app.route('/api/chat/<generation_id>/cancel', methods=['POST'])
+def cancel_chat(generation_id):
+    """Stop a running generation; the partial reply is kept and marked cancelled."""
+    cancelled = generation_manager.cancel(generation_id)
+    if cancelled is None:
+        return jsonify({'success': False, 'error': 'Generation not found'}), 404
+    return jsonify({'success': True, 'cancelled': cancelled})
+
+@app.route('/api/scheduler', methods=['GET'])
+def scheduler_stats():
+    """Get model slot usage and queue lengths."""
+    return jsonify({
+        'success': True,
+        'scheduler': scheduler.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Get latency and throughput metrics in Prometheus text format."""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/conversations', methods=['GET'])
 def list_conversations():
     """List all conversations."""
     try:
-        conversations = history_manager.list_conversations()
+        with _trace().span('list_conversations'):
+            conversations = history_manager.list_conversations()
         return jsonify({
             'success': True,
             'conversations': conversations
@@ -344,6 +522,43 @@ def list_conversations():
             'error': str(e)
         }), 500
 
+@app.route('/api/conversations/search', methods=['GET'])
+def search_conversations():
+    """Full-text search over conversation messages."""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit and offset must be integers'}), 400
+    
+    if not query:
+        return jsonify({'success': False, 'error': 'Query required'}), 400
+    
+    try:
+        found = history_manager.search(query, limit=limit, offset=offset)
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': found['results'],
+            'total': found['total'],
+            'limit': limit,
+            'offset': offset
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/conversations/cache', methods=['GET'])
+def conversation_cache_stats():
+    """Get conversation cache hit/miss counters."""
+    return jsonify({
+        'success': True,
+        'cache': history_manager.cache_stats()
+    })
+
 @app.route('/api/conversations/new', methods=['POST'])
 def new_conversation():
     """Create a new conversation."""
@@ -372,7 +587,8 @@ def new_conversation():
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     """Get a conversation by ID."""
-    conversation = history_manager.get_conversation(conversation_id)
+    with _trace().span('get_conversation'):
+        conversation = history_manager.get_conversation(conversation_id)
     
     if not conversation:
         return jsonify({
@@ -380,14 +596,18 @@ def get_conversation(conversation_id):
             'error': 'Conversation not found'
         }), 404
     
+    generation = generation_manager.active_for(conversation_id)
     return jsonify({
         'success': True,
-        'conversation': conversation
+        'conversation': conversation,
+        'active_generation_id': generation.id if generation else None
     })
 
 @app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
     """Delete a conversation."""
+    if not generation_manager.discard(conversation_id):
+        return jsonify({'success': False, 'error': 'A reply is still being generated for this conversation'}), 409
     success = history_manager.delete_conversation(conversation_id)
     
     if success:
@@ -410,6 +630,8 @@ def truncate_conversation(conversation_id):
             'error': 'message_index required'
         }), 400
     
+    if not generation_manager.discard(conversation_id):
+        return jsonify({'success': False, 'error': 'A reply is still being generated for this conversation'}), 409
     success = history_manager.truncate_conversation(conversation_id, message_index)
     
     if success:
@@ -0,0 +1,15 @@
+"""Shared test setup.
+
+Data goes to a temporary directory, set before config (and the paths derived
+from it) is imported by any test module.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault('CHATGPT_OLLAMA_DATA_DIR', tempfile.mkdtemp(prefix='chatgpt-ollama-tests-'))
+os.environ.setdefault('FLASK_PORT', '5001')
@@ -0,0 +1,136 @@
+"""Tests for utils.downloads (pulls run against the fake Ollama server)."""
+import json
+import threading
+import time
+import pytest
+from benchmarks.fake_ollama import FakeOllama, FakeModel
+from utils.downloads import DownloadManager, PullProgress
+from utils.ollama_client import OllamaClient
+
+LAYER_A = 'sha256:aaa'
+LAYER_B = 'sha256:bbb'
+
+def _layer(digest, completed, total=1000):
+    return {'status': f"pulling {digest[7:]}", 'digest': digest, 'completed': completed, 'total': total}
+
+@pytest.mark.parametrize('lines, emitted', [
+    # (seconds, line) -> whether update() returns an event; interval is 1 s
+    ([(0.0, {'status': 'pulling manifest'}), (0.1, _layer(LAYER_A, 0)), (0.2, _layer(LAYER_A, 10)),
+      (0.9, _layer(LAYER_A, 20)), (1.1, _layer(LAYER_A, 30))],
+     [True, True, False, False, True]),
+    # A new layer is a new status, so it passes at once
+    ([(0.0, _layer(LAYER_A, 0)), (0.1, _layer(LAYER_B, 0)), (0.2, _layer(LAYER_B, 5))],
+     [True, True, False]),
+    # Status changes after the bytes are done pass through at once
+    ([(0.0, _layer(LAYER_A, 1000)), (0.1, {'status': 'verifying sha256 digest'}),
+      (0.2, {'status': 'writing manifest'}), (0.3, {'status': 'success'})],
+     [True, True, True, True]),
+])
+def test_byte_progress_is_throttled_and_statuses_pass(lines, emitted):
+    progress = PullProgress(interval=1.0)
+    
+    results = [progress.update(line, now=now) is not None for now, line in lines]
+    
+    assert results == emitted
+
+def test_layers_are_summed():
+    progress = PullProgress(interval=0)
+    progress.update(_layer(LAYER_A, 500, 1000), now=0.0)
+    
+    event = progress.update(_layer(LAYER_B, 100, 3000), now=1.0)
+    
+    assert event['completed'] == 600
+    assert event['total'] == 4000
+    assert event['layers'] == 2
+    assert event['percent'] == 15.0
+
+@pytest.mark.parametrize('samples, rate, eta', [
+    # (seconds, completed of 1000) -> bytes_per_second, eta_seconds
+    ([(0.0, 0)], None, None),
+    ([(0.0, 0), (1.0, 100), (2.0, 200)], 100, 8.0),
+    # Averaged over the window: a stall and a burst even out
+    ([(0.0, 0), (1.0, 100), (2.0, 100), (3.0, 400)], 133, 4.5),
+    # Samples older than RATE_WINDOW (5 s) are dropped
+    ([(0.0, 0), (1.0, 500), (10.0, 590)], 10, 41.0),
+    # Stalled: no ETA
+    ([(0.0, 300), (1.0, 300)], 0, None),
+])
+def test_rate_and_eta(samples, rate, eta):
+    progress = PullProgress(interval=0)
+    for now, completed in samples:
+        event = progress.update(_layer(LAYER_A, completed), now=now)
+    
+    assert event.get('bytes_per_second') == rate
+    assert event.get('eta_seconds') == eta
+
+def _frame_data(frame):
+    return json.loads(frame.split('data: ', 1)[1])
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def fake():
+    # Each pull takes about a second (20 steps)
+    models = [FakeModel(name, size=1000, prefill_tps=1e6, decode_tps=1e3, load_seconds=1.0) for name in ('a:1b', 'b:1b')]
+    fake = FakeOllama(models)
+    fake.start()
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def manager(fake):
+    return DownloadManager(OllamaClient(fake.base_url), max_concurrent=1)
+
+def test_pulls_of_one_model_share_a_download(manager, fake):
+    first = manager.start('a:1b')
+    second = manager.start('a:1b')
+    
+    assert second is first
+    _wait_until(lambda: first.finished)
+    assert first.status == 'success'
+    assert fake.stats['pulls'] == 1
+
+def test_concurrent_pulls_are_limited(manager, fake):
+    first = manager.start('a:1b')
+    second = manager.start('b:1b')
+    _wait_until(lambda: first.progress)
+    
+    assert second.status == 'queued'
+    assert fake.stats['pulls'] == 1
+    _wait_until(lambda: second.finished)
+    assert first.status == second.status == 'success'
+    assert fake.stats['pulls'] == 2
+
+def test_late_subscriber_starts_with_current_progress(manager):
+    download = manager.start('a:1b')
+    _wait_until(lambda: download.progress.get('completed'))
+    
+    frames = download.subscribe(keepalive=0.1)
+    snapshot = _frame_data(next(frames))
+    frames.close()
+    
+    assert snapshot['snapshot'] is True
+    assert snapshot['status'] == 'pulling'
+    assert 0 < snapshot['progress']['completed'] < snapshot['progress']['total']
+    download.cancel()
+
+def test_cancel_closes_the_pull_and_tells_subscribers(manager, fake):
+    download = manager.start('a:1b')
+    _wait_until(lambda: download.progress.get('completed'))
+    received = []
+    follower = threading.Thread(target=lambda: received.extend(download.subscribe(keepalive=0.1)))
+    follower.start()
+    
+    cancelled_at = time.monotonic()
+    assert manager.cancel('a:1b')
+    follower.join(2.0)
+    
+    assert not follower.is_alive()
+    assert _frame_data(received[-1])['status'] == 'cancelled'
+    assert download.status == 'cancelled'
+    _wait_until(lambda: fake.stats['disconnects'] == 1, timeout=1.0)
+    assert fake.disconnected_at - cancelled_at < 1.0
@@ -0,0 +1,104 @@
+"""Tests for utils.generation against the fake Ollama server."""
+import time
+import pytest
+from benchmarks.fake_ollama import FakeOllama, FakeModel
+from utils.generation import GenerationManager
+from utils.history_manager import HistoryManager
+from utils.history_storage import SQLiteHistoryStorage
+from utils.ollama_client import OllamaClient
+
+MODEL = 'fake:1b'
+
+def _fake(**kwargs):
+    fake = FakeOllama([FakeModel(MODEL, size=1, prefill_tps=1e6, decode_tps=1000, load_seconds=0)], **kwargs)
+    fake.start()
+    return fake
+
+def _manager(fake, tmp_path):
+    client = OllamaClient(fake.base_url)
+    history = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=0)
+    return GenerationManager(client, history)
+
+def _conversation(contents):
+    return {
+        'id': 'c1', 'title': 'Test', 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00',
+        'messages': [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': c} for i, c in enumerate(contents)]
+    }
+
+def _wait_for_content(generation, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not generation.content():
+        assert time.monotonic() < deadline, "no reply text arrived"
+        time.sleep(0.01)
+
+@pytest.fixture
+def failing_fake():
+    fake = _fake(failure_rate=1.0, failure_modes=('error',))
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def slow_fake():
+    fake = _fake(token_rate=20)
+    yield fake
+    fake.stop()
+
+def test_failure_before_any_content_removes_user_message(failing_fake, tmp_path):
+    manager = _manager(failing_fake, tmp_path)
+    errors = []
+    manager.add_error_listener(errors.append)
+    conversation = _conversation(['hi', 'hello', 'again?'])
+    
+    generation = manager.start(conversation, conversation['messages'], MODEL)
+    assert generation.wait(5.0)
+    
+    assert generation.status == 'error'
+    deadline = time.monotonic() + 1.0
+    while not errors and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(errors) == 1
+    stored = manager.history_manager.get_conversation('c1')
+    assert [m['content'] for m in stored['messages']] == ['hi', 'hello']
+
+def test_failure_of_first_message_removes_conversation(failing_fake, tmp_path):
+    manager = _manager(failing_fake, tmp_path)
+    conversation = _conversation(['hi'])
+    
+    generation = manager.start(conversation, conversation['messages'], MODEL)
+    assert generation.wait(5.0)
+    
+    assert manager.history_manager.get_conversation('c1') is None
+
+def test_cancel_closes_upstream_and_keeps_partial_reply(slow_fake, tmp_path):
+    manager = _manager(slow_fake, tmp_path)
+    conversation = _conversation(['hi'])
+    generation = manager.start(conversation, conversation['messages'], MODEL)
+    _wait_for_content(generation)
+    
+    cancelled_at = time.monotonic()
+    assert manager.cancel(generation.id)
+    deadline = cancelled_at + 1.0
+    while slow_fake.stats['disconnects'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert slow_fake.stats['disconnects'] == 1
+    assert slow_fake.disconnected_at - cancelled_at < 1.0
+    assert generation.wait(1.0) and generation.status == 'cancelled'
+    reply = manager.history_manager.get_conversation('c1')['messages'][-1]
+    assert reply['role'] == 'assistant' and reply['cancelled'] is True
+    assert reply['content'] and reply['content'] == generation.content()
+
+def test_discard_stops_saving_before_delete(slow_fake, tmp_path):
+    manager = _manager(slow_fake, tmp_path)
+    manager.checkpoint_interval = 0.01
+    conversation = _conversation(['hi'])
+    generation = manager.start(conversation, conversation['messages'], MODEL)
+    _wait_for_content(generation)
+    
+    assert manager.discard('c1', timeout=2.0)
+    assert manager.history_manager.delete_conversation('c1')
+    time.sleep(0.2)
+    
+    assert generation.status == 'cancelled'
+    assert manager.active_for('c1') is None
+    assert manager.history_manager.get_conversation('c1') is None
@@ -0,0 +1,80 @@
+"""Tests for utils.history_manager."""
+from utils.history_manager import HistoryManager, _CachedConversation
+from utils.history_storage import SQLiteHistoryStorage
+
+def _conversation(conversation_id, contents):
+    return {
+        'id': conversation_id, 'title': 'Test', 'created_at': '2024-01-01T00:00:00',
+        'updated_at': '2024-01-01T00:00:00',
+        'messages': [{'role': 'user', 'content': content} for content in contents]
+    }
+
+def _capture(manager):
+    # What the flusher takes under the cache lock before it writes
+    with manager._lock:
+        return [manager._pending(conversation_id, entry) for conversation_id, entry in manager._cache.items()]
+
+def test_delete_after_capture_is_not_undone(tmp_path):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=3600)
+    manager.save_conversation(_conversation('c1', ['one']))
+    pending = _capture(manager)
+    
+    manager.delete_conversation('c1')
+    manager._write(pending)
+    
+    assert manager.storage.get_conversation('c1') is None
+    assert manager.get_conversation('c1') is None
+
+def test_truncate_after_capture_is_not_undone(tmp_path):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=3600)
+    manager.save_conversation(_conversation('c1', ['one', 'two', 'three']))
+    pending = _capture(manager)
+    
+    assert manager.truncate_conversation('c1', 0)
+    manager._write(pending)
+    
+    assert [m['content'] for m in manager.storage.get_conversation('c1')['messages']] == ['one']
+
+def test_save_after_delete_is_written(tmp_path):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=3600)
+    manager.save_conversation(_conversation('c1', ['one']))
+    manager.flush()
+    manager.delete_conversation('c1')
+    
+    manager.save_conversation(_conversation('c1', ['again']))
+    manager.flush()
+    
+    assert [m['content'] for m in manager.storage.get_conversation('c1')['messages']] == ['again']
+
+def test_save_message_updates_one_message(tmp_path, monkeypatch):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=3600)
+    manager.save_conversation(_conversation('c1', ['one', 'two']))
+    unpacked = []
+    original = _CachedConversation.to_conversation
+    monkeypatch.setattr(_CachedConversation, 'to_conversation', lambda self: unpacked.append(1) or original(self))
+    
+    assert manager.save_message('c1', 2, {'role': 'assistant', 'content': 'par'}, {'updated_at': 'now'})
+    assert manager.save_message('c1', 2, {'role': 'assistant', 'content': 'partial reply'})
+    assert not unpacked  # The conversation is not rebuilt for a checkpoint
+    
+    manager.flush()
+    stored = manager.storage.get_conversation('c1')
+    assert [m['content'] for m in stored['messages']] == ['one', 'two', 'partial reply']
+    assert stored['updated_at'] == 'now'
+
+def test_save_message_write_through(tmp_path):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=0)
+    manager.save_conversation(_conversation('c1', ['one']))
+    
+    assert manager.save_message('c1', 1, {'role': 'assistant', 'content': 'reply'})
+    
+    assert [m['content'] for m in manager.storage.get_conversation('c1')['messages']] == ['one', 'reply']
+
+def test_save_message_to_deleted_conversation_fails(tmp_path):
+    manager = HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=3600)
+    manager.save_conversation(_conversation('c1', ['one']))
+    manager.delete_conversation('c1')
+    
+    assert not manager.save_message('c1', 1, {'role': 'assistant', 'content': 'reply'})
+    manager.flush()
+    assert manager.storage.get_conversation('c1') is None
@@ -0,0 +1,62 @@
+"""Tests for utils.history_storage."""
+import json
+from utils.history_storage import FileHistoryStorage, SQLiteHistoryStorage, _encode_record
+
+def _tree(path):
+    return {p.relative_to(path).as_posix(): p.read_bytes() for p in sorted(path.rglob('*')) if p.is_file()}
+
+def test_migration_leaves_source_files_untouched(tmp_path):
+    conversations = tmp_path / 'source' / 'conversations'
+    summaries = tmp_path / 'source' / 'summaries'
+    conversations.mkdir(parents=True)
+    summaries.mkdir(parents=True)
+    
+    # A legacy .json conversation and a JSON Lines log
+    (conversations / 'legacy.json').write_text(json.dumps({
+        'id': 'legacy', 'title': 'Old', 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00',
+        'messages': [{'role': 'user', 'content': 'hi'}, {'role': 'assistant', 'content': 'hello'}]
+    }), encoding='utf-8')
+    (conversations / 'log.jsonl').write_bytes(
+        _encode_record('meta', {'id': 'log', 'title': 'New', 'created_at': '2024-02-01T00:00:00',
+                                'updated_at': '2024-02-01T00:00:00'})
+        + _encode_record('message', {'message': {'role': 'user', 'content': 'question'}})
+        + _encode_record('meta', {'title': 'Renamed'})
+    )
+    (summaries / 'legacy.json').write_text(json.dumps({'summary': 'greetings', 'covered': 2}), encoding='utf-8')
+    before = _tree(tmp_path / 'source')
+    
+    storage = SQLiteHistoryStorage(tmp_path / 'history.db')
+    imported = storage.migrate_from_files(conversations, summaries)
+    
+    assert imported == 2
+    assert _tree(tmp_path / 'source') == before
+    assert [m['content'] for m in storage.get_conversation('legacy')['messages']] == ['hi', 'hello']
+    assert storage.get_conversation('log')['title'] == 'Renamed'
+    assert storage.get_summary_state('legacy') == {'summary': 'greetings', 'covered': 2}
+    assert storage.migrate_from_files(conversations, summaries) == 0
+
+def _meta_records(storage, conversation_id):
+    return FileHistoryStorage._scan_log(storage._log_path(conversation_id))['meta_records']
+
+def test_cut_meta_records_are_not_counted():
+    storage = FileHistoryStorage()
+    storage.compact_threshold = 1000
+    conversation = {
+        'id': 'meta-count', 'title': 'Start', 'created_at': '2024-01-01T00:00:00',
+        'messages': [{'role': 'user', 'content': 'one'}, {'role': 'assistant', 'content': 'two'}]
+    }
+    storage.save_conversation(conversation)
+    for i in range(3):
+        conversation['title'] = f"Title {i}"
+        storage.save_conversation(conversation)
+    
+    # Replacing the last message cuts the meta records written after it
+    conversation['messages'][1] = {'role': 'assistant', 'content': 'two, edited'}
+    storage.save_conversation(conversation, changed_from=1)
+    assert storage._log_state['meta-count']['meta_records'] == _meta_records(storage, 'meta-count')
+    
+    conversation['title'] = 'Renamed'
+    storage.save_conversation(conversation)
+    assert storage.truncate_conversation('meta-count', 0)
+    assert storage._log_state['meta-count']['meta_records'] == _meta_records(storage, 'meta-count')
+    assert storage.get_conversation('meta-count')['title'] == 'Renamed'
@@ -0,0 +1,41 @@
+"""Tests for utils.metrics."""
+import threading
+from utils.metrics import Histogram, SHARDS, shard_index
+
+def test_threads_use_different_shards():
+    indexes = []
+    lock = threading.Lock()
+    
+    def record():
+        with lock:
+            indexes.append(shard_index())
+    
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(set(indexes)) == 8
+    assert all(0 <= index < SHARDS for index in indexes)
+
+def test_shard_index_is_stable_per_thread():
+    assert shard_index() == shard_index()
+
+def test_observations_from_many_threads_are_merged():
+    histogram = Histogram('test_seconds', 'Test.', buckets=(0.1, 1.0), labelnames=('model',))
+    
+    def observe():
+        for _ in range(100):
+            histogram.observe(0.5, 'a')
+    
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    state = histogram.collect()[('a',)]
+    assert state[-1] == 800
+    assert state[1] == 800
+    assert state[-2] == 400.0
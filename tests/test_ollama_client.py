@@ -0,0 +1,30 @@
+"""Tests for utils.ollama_client against the fake Ollama server."""
+import time
+import pytest
+from benchmarks.fake_ollama import FakeOllama, FakeModel
+from utils.ollama_client import OllamaClient
+
+MODEL = 'fake:1b'
+
+@pytest.mark.parametrize('chunked', [True, False])
+def test_stream_yields_each_line_as_it_arrives(chunked):
+    # 10 tokens/s: a client that waits for a full read buffer (iter_lines)
+    # would hand over several lines of an unchunked body at once, ~0.5 s apart
+    token_rate = 10
+    fake = FakeOllama(
+        [FakeModel(MODEL, size=1, prefill_tps=1e6, decode_tps=token_rate, load_seconds=0)], chunked=chunked
+    )
+    client = OllamaClient(fake.start())
+    try:
+        arrivals = []
+        started = time.perf_counter()
+        for text in client.chat(MODEL, [{'role': 'user', 'content': 'hi'}], options={'num_predict': 8}):
+            if text:
+                arrivals.append(time.perf_counter())
+    finally:
+        client.session.close()
+        fake.stop()
+    
+    assert len(arrivals) == 8
+    gaps = [later - earlier for earlier, later in zip([started] + arrivals, arrivals)]
+    assert max(gaps) < 2.5 / token_rate, gaps
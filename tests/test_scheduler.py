@@ -0,0 +1,115 @@
+"""Tests for utils.scheduler."""
+import pytest
+import utils.scheduler as scheduler_module
+from utils.scheduler import ModelScheduler, SchedulerFull, INTERACTIVE, BATCH
+
+class FakeClock:
+    """Stands in for the time module so queue ages are deterministic."""
+    
+    def __init__(self):
+        self.now = 1000.0
+    
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler_module, 'time', clock)
+    return clock
+
+def _busy(scheduler, model='a', key='busy'):
+    """Take the only slot so that later tickets queue."""
+    ticket = scheduler.submit(model, INTERACTIVE, key)
+    assert ticket.granted
+    return ticket
+
+def test_interactive_runs_before_batch(clock):
+    scheduler = ModelScheduler(global_limit=1, affinity_wait=60)
+    running = _busy(scheduler)
+    batch = scheduler.submit('a', BATCH, 'c1')
+    interactive = scheduler.submit('a', INTERACTIVE, 'c2')
+    assert scheduler.position(interactive) == 1 and scheduler.position(batch) == 2
+    
+    scheduler.release(running)
+    
+    assert interactive.granted and not batch.granted
+    scheduler.release(interactive)
+    assert batch.granted
+
+def test_loaded_model_goes_first_until_affinity_wait(clock):
+    scheduler = ModelScheduler(global_limit=1, affinity_wait=5)
+    running = _busy(scheduler, 'a')
+    other_model = scheduler.submit('b', INTERACTIVE, 'c1')
+    loaded_model = scheduler.submit('a', INTERACTIVE, 'c2')
+    
+    scheduler.release(running)
+    
+    assert loaded_model.granted and not other_model.granted
+    assert scheduler.stats()['reordered'] == 1
+    
+    # Once it has waited affinity_wait, the other model's request is no longer passed over
+    late = scheduler.submit('a', INTERACTIVE, 'c3')
+    clock.now += 5
+    scheduler.release(loaded_model)
+    assert other_model.granted and not late.granted
+
+def test_conversation_served_least_recently_goes_first(clock):
+    scheduler = ModelScheduler(global_limit=1, affinity_wait=60)
+    running = _busy(scheduler, key='c1')
+    again = scheduler.submit('a', INTERACTIVE, 'c1')
+    other = scheduler.submit('a', INTERACTIVE, 'c2')
+    
+    scheduler.release(running)
+    
+    assert other.granted and not again.granted
+    scheduler.release(other)
+    assert again.granted
+
+def test_model_limit_lets_other_models_run(clock):
+    scheduler = ModelScheduler(global_limit=2, model_limit=1, affinity_wait=60)
+    first = scheduler.submit('a', INTERACTIVE, 'c1')
+    second = scheduler.submit('a', INTERACTIVE, 'c2')
+    other = scheduler.submit('b', INTERACTIVE, 'c3')
+    
+    assert first.granted and other.granted and not second.granted
+    scheduler.release(first)
+    assert second.granted
+    assert scheduler.stats()['running'] == {'a': 1, 'b': 1}
+
+def test_full_model_queue_is_rejected_with_429(clock):
+    scheduler = ModelScheduler(global_limit=1, max_queue=10, max_queue_per_model=1)
+    _busy(scheduler)
+    scheduler.submit('a', INTERACTIVE, 'c1')
+    
+    with pytest.raises(SchedulerFull) as rejected:
+        scheduler.submit('a', INTERACTIVE, 'c2')
+    
+    assert rejected.value.status_code == 429
+    assert not scheduler.submit('b', INTERACTIVE, 'c3').granted  # Other models still queue
+
+def test_full_server_queue_is_rejected_with_503(clock):
+    scheduler = ModelScheduler(global_limit=1, max_queue=2, max_queue_per_model=10)
+    _busy(scheduler)
+    scheduler.submit('a', INTERACTIVE, 'c1')
+    scheduler.submit('b', INTERACTIVE, 'c2')
+    
+    with pytest.raises(SchedulerFull) as rejected:
+        scheduler.submit('c', INTERACTIVE, 'c3')
+    
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after >= 1
+    assert scheduler.stats()['rejected'] == 1
+
+def test_released_waiting_ticket_leaves_the_queue(clock):
+    scheduler = ModelScheduler(global_limit=1)
+    running = _busy(scheduler)
+    abandoned = scheduler.submit('a', INTERACTIVE, 'c1')
+    waiting = scheduler.submit('a', INTERACTIVE, 'c2')
+    
+    scheduler.release(abandoned)
+    scheduler.release(running)
+    
+    assert waiting.granted and not abandoned.granted
+    assert scheduler.stats()['cancelled'] == 1
+    assert scheduler.stats()['queued'] == 0
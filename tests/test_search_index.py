@@ -0,0 +1,17 @@
+"""Tests for utils.search_index."""
+from utils.search_index import SearchIndex
+
+def test_snippet_escapes_message_html(tmp_path):
+    index = SearchIndex(tmp_path / 'search.db')
+    index.index_messages('c1', 0, [
+        {'role': 'user', 'content': 'hello <img src=x onerror="alert(1)"> & <mark>world</mark>'}
+    ])
+    
+    results, total = index.search('hello')
+    
+    assert total == 1
+    snippet = results[0]['snippet']
+    assert '<img' not in snippet
+    assert '&lt;img src=x onerror=&quot;alert(1)&quot;&gt;' in snippet
+    assert '&lt;mark&gt;world&lt;/mark&gt;' in snippet
+    assert snippet.startswith('<mark>hello</mark>')
@@ -0,0 +1,163 @@
+"""Tests for utils.summarizer (model summaries run against the fake Ollama server)."""
+import time
+import pytest
+from benchmarks.fake_ollama import FakeOllama, FakeModel
+from utils.context_builder import ContextBuilder
+from utils.history_manager import HistoryManager
+from utils.history_storage import SQLiteHistoryStorage
+from utils.ollama_client import OllamaClient
+from utils.scheduler import ModelScheduler, INTERACTIVE
+from utils.summarizer import RollingSummarizer
+
+CHAT_MODEL = 'llama3.2:1b'
+
+@pytest.fixture
+def history(tmp_path):
+    return HistoryManager(SQLiteHistoryStorage(tmp_path / 'history.db'), write_behind_delay=0)
+
+def test_block_mode_summary_follows_the_window(history):
+    builder = ContextBuilder(history)
+    builder.context_window = 1200
+    builder.response_reserve = 200
+    builder.block_fraction = 0.5
+    summarizer = RollingSummarizer(history, builder, model='')
+    summarizer.max_tokens = 100
+    
+    messages = []
+    previous = None  # (window start, summary, context) of the previous turn
+    moves = misses = 0
+    for turn in range(40):
+        messages.append({'role': 'user', 'content': f"Question {turn}. " + 'x' * 150})
+        context, info = builder.build_context_info('c1', messages, CHAT_MODEL)
+        summary = history.get_summary('c1')
+        if previous is not None:
+            if info['window_start'] != previous[0]:
+                moves += 1
+            if info['cached_prefix_messages'] == 0:
+                misses += 1
+            if info['window_start'] == previous[0] and summary == previous[1]:
+                # Within a block the whole previous prompt is reused
+                assert info['cached_prefix_messages'] == len(previous[2]), turn
+        previous = (info['window_start'], summary, context)
+        
+        messages.append({'role': 'assistant', 'content': f"Answer {turn} " + 'y' * 250})
+        summarizer.update('c1', messages, CHAT_MODEL)
+        state = history.get_summary_state('c1')
+        if state:
+            # Never summarizes messages the window still sends verbatim
+            assert state['covered'] <= info['window_start'], turn
+    
+    assert moves >= 5
+    # The prefix changes when the window moves and once more when the summary catches up
+    assert misses <= 2 * moves
+
+SUMMARY_MODEL = 'qwen2:0.5b'
+
+def _messages(count):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f"Message {i} about topic {i}. " + 'z' * 200}
+        for i in range(count)
+    ]
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+@pytest.fixture
+def fake():
+    fake = FakeOllama([FakeModel(SUMMARY_MODEL, size=1, prefill_tps=1e6, decode_tps=1e4, load_seconds=0)])
+    fake.start()
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def summarizer(fake, history):
+    builder = ContextBuilder(history)
+    builder.context_window = 600
+    builder.response_reserve = 100
+    builder.block_fraction = 0
+    summarizer = RollingSummarizer(history, builder, OllamaClient(fake.base_url), SUMMARY_MODEL, ModelScheduler())
+    summarizer.max_tokens = 200  # Fits one fake reply, so no compression call
+    summarizer.min_batch = 2
+    return summarizer
+
+def test_summary_comes_from_the_summary_model(summarizer, fake, history):
+    assert summarizer.update('c1', _messages(50), CHAT_MODEL)
+    
+    state = history.get_summary_state('c1')
+    assert state['summary'].startswith('token0 token1')
+    assert state['covered'] > 0
+    assert summarizer.stats['model_summaries'] == 1
+    assert fake.stats['chats'] == 1
+
+def test_saturated_queue_falls_back_to_heuristic(summarizer, fake, history):
+    summarizer.queue_size = 1
+    with summarizer.interactive():
+        # Model jobs wait for interactive work; c1 fills the queue
+        summarizer.schedule('c1', _messages(50), CHAT_MODEL)
+        summarizer.schedule('c2', _messages(50), CHAT_MODEL)
+        _wait_until(lambda: history.get_summary('c2') is not None)
+        
+        assert summarizer.stats['saturated'] == 1
+        assert summarizer.stats['heuristic_summaries'] == 1
+        assert history.get_summary('c2').startswith('Message 0 about topic 0')
+        assert summarizer.pending_count() == 1
+    _wait_until(lambda: history.get_summary('c1') is not None)
+    assert fake.stats['chats'] == 1
+
+def test_model_failure_falls_back_until_retry_delay(summarizer, fake, history):
+    summarizer.retry_delay = 0.3
+    fake.failure_rate = 1.0
+    fake.failure_modes = ('error',)
+    
+    assert summarizer.update('c1', _messages(50), CHAT_MODEL)
+    assert summarizer.stats['model_failures'] == 1
+    assert summarizer.stats['heuristic_summaries'] == 1
+    
+    # Within the retry delay the model is not called at all
+    requests = fake.stats['requests']
+    assert summarizer.update('c1', _messages(60), CHAT_MODEL)
+    assert fake.stats['requests'] == requests
+    assert summarizer.stats['heuristic_summaries'] == 2
+    
+    fake.failure_rate = 0.0
+    time.sleep(0.35)
+    assert summarizer.update('c1', _messages(70), CHAT_MODEL)
+    assert summarizer.stats['model_summaries'] == 1
+    assert fake.stats['chats'] == 1
+
+def test_jobs_for_one_conversation_are_merged(summarizer, fake, history):
+    with summarizer.interactive():
+        summarizer.schedule('c1', _messages(50), CHAT_MODEL)
+        summarizer.schedule('c1', _messages(60), CHAT_MODEL)
+        assert summarizer.pending_count() == 1
+    _wait_until(lambda: history.get_summary('c1') is not None)
+    
+    assert fake.stats['chats'] == 1
+    assert history.get_summary_state('c1')['covered'] == summarizer.context_builder.evicted_count(
+        _messages(60), CHAT_MODEL, reserve=summarizer.max_tokens
+    )
+
+def test_summaries_yield_to_interactive_chat(summarizer, fake, history):
+    scheduler = summarizer.scheduler = ModelScheduler(global_limit=1)
+    with summarizer.interactive():
+        summarizer.schedule('c1', _messages(50), CHAT_MODEL)
+        time.sleep(0.2)
+        assert fake.stats['requests'] == 0
+    _wait_until(lambda: history.get_summary('c1') is not None)
+    
+    # With the only slot taken, the summary's batch request queues behind interactive work
+    chat = scheduler.submit(CHAT_MODEL, INTERACTIVE, 'chat')
+    assert chat.granted
+    summarizer.schedule('c2', _messages(50), CHAT_MODEL)
+    _wait_until(lambda: scheduler.stats()['queued'] == 1)
+    waiting_chat = scheduler.submit(CHAT_MODEL, INTERACTIVE, 'chat2')
+    scheduler.release(chat)
+    assert waiting_chat.granted
+    assert fake.stats['chats'] == 1
+    
+    scheduler.release(waiting_chat)
+    _wait_until(lambda: history.get_summary('c2') is not None)
+    assert fake.stats['chats'] == 2
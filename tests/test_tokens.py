@@ -0,0 +1,28 @@
+"""Tests for utils.tokens."""
+from utils.tokens import MESSAGE_OVERHEAD_TOKENS, message_tokens, register_estimator, _content_tokens
+
+def test_message_tokens_leaves_message_unchanged():
+    message = {'role': 'user', 'content': 'hello there'}
+    
+    count = message_tokens(message, 'llama3.2:1b')
+    
+    assert count == 3 + MESSAGE_OVERHEAD_TOKENS
+    assert message == {'role': 'user', 'content': 'hello there'}
+
+def test_counts_are_cached_per_family():
+    _content_tokens.cache_clear()
+    message = {'role': 'user', 'content': 'a' * 40}
+    
+    assert message_tokens(message, 'llama3.2:1b') == 10 + MESSAGE_OVERHEAD_TOKENS
+    assert message_tokens(dict(message), 'llama3:8b') == 10 + MESSAGE_OVERHEAD_TOKENS
+    assert _content_tokens.cache_info().hits == 1
+    assert message_tokens(message, 'codellama:7b') == 13 + MESSAGE_OVERHEAD_TOKENS
+
+def test_registering_an_estimator_drops_cached_counts():
+    message = {'role': 'user', 'content': 'some text'}
+    before = message_tokens(message, 'testfamily:1b')
+    
+    register_estimator('testfamily', lambda text: 100)
+    
+    assert before != 100 + MESSAGE_OVERHEAD_TOKENS
+    assert message_tokens(message, 'testfamily:1b') == 100 + MESSAGE_OVERHEAD_TOKENS
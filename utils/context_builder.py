@@ -1,41 +1,207 @@
 """Intelligent context building for conversations."""
-from typing import List, Dict
-from config import MAX_RECENT_MESSAGES, SUMMARY_THRESHOLD, CONTEXT_WINDOW_SIZE
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+from config import (
+    MAX_RECENT_MESSAGES, SUMMARY_THRESHOLD, CONTEXT_WINDOW_SIZE, CONTEXT_RESPONSE_RESERVE, CONTEXT_BLOCK_FRACTION
+)
 from utils.history_manager import HistoryManager
+from utils.tokens import message_tokens
+
+# Heuristic summaries keep at most this many topic fragments
+SUMMARY_MAX_PARTS = 5
+MESSAGE_COUNT_SUFFIX_RE = re.compile(r' \(\d+ messages\)$')
+# Conversations whose last context is remembered for the cached-prefix estimate
+PREVIOUS_CONTEXTS_KEPT = 256
 
 class ContextBuilder:
     """Build intelligent context for AI conversations."""
     
-    def __init__(self):
-        """Initialize context builder."""
-        self.history_manager = HistoryManager()
+    def __init__(self, history_manager: HistoryManager = None):
+        """Initialize context builder.
+        
+        Args:
+            history_manager: History manager to read summaries from (defaults to a new one)
+        """
+        self.history_manager = history_manager or HistoryManager()
+        self.context_window = CONTEXT_WINDOW_SIZE
+        self.response_reserve = CONTEXT_RESPONSE_RESERVE
+        self.max_messages = MAX_RECENT_MESSAGES
+        self.block_fraction = CONTEXT_BLOCK_FRACTION
+        
+        self._previous = OrderedDict()  # conversation_id -> (model, window start, [(message hash, tokens), ...])
+        self._previous_lock = threading.Lock()
     
-    def build_context(self, conversation_id: str, messages: List[Dict]) -> List[Dict]:
-        """Build context for a conversation.
+    def build_context(self, conversation_id: str, messages: List[Dict], model: str = None) -> List[Dict]:
+        """Build context for a conversation within the token budget.
+        
+        The budget is CONTEXT_WINDOW_SIZE minus CONTEXT_RESPONSE_RESERVE. Messages
+        are packed newest first until the budget is used up; if older messages
+        had to be dropped and a summary exists, the summary is prepended and its
+        tokens are reserved as well. The newest message is always included.
+        
+        With CONTEXT_BLOCK_FRACTION set, history is dropped in blocks and the
+        window start stays put between overflows (see _window_start), so the
+        prompt prefix is identical between turns and Ollama can reuse its
+        prompt cache.
         
         Args:
             conversation_id: Conversation ID
             messages: Current messages in conversation
+            model: Model name (selects the token estimator)
             
         Returns:
             List of message dicts with context
         """
-        # Get recent messages (last N messages)
-        recent_messages = messages[-MAX_RECENT_MESSAGES:] if len(messages) > MAX_RECENT_MESSAGES else messages
+        return self.build_context_info(conversation_id, messages, model)[0]
+    
+    def build_context_info(self, conversation_id: str, messages: List[Dict],
+                           model: str = None) -> Tuple[List[Dict], Dict]:
+        """Build context like build_context, and describe the result.
+        
+        Returns:
+            (context, info) where info has window_start, prompt_tokens (estimated),
+            and cached_prefix_messages / cached_prefix_tokens: how much of the
+            context matches the start of this conversation's previous context,
+            i.e. what Ollama's prompt cache is expected to reuse
+        """
+        budget = self.context_window - self.response_reserve
+        previous_start = self._previous_start(conversation_id, model)
+        start = self._window_start(messages, budget, model, previous_start)
+        prefix = []
         
-        # If conversation is long, include summary
-        if len(messages) > SUMMARY_THRESHOLD:
+        if start > 0:
             summary = self.history_manager.get_summary(conversation_id)
             if summary:
-                # Prepend summary as a system message
-                context = [{
+                summary_message = {
                     'role': 'system',
                     'content': f"Previous conversation summary: {summary}"
-                }]
-                context.extend(recent_messages)
-                return context
+                }
+                prefix.append(summary_message)
+                start = self._window_start(messages, budget - message_tokens(summary_message, model), model,
+                                           previous_start)
         
-        return recent_messages
+        included = prefix + messages[start:]
+        context = [{'role': m.get('role'), 'content': m.get('content', '')} for m in included]
+        tokens = [message_tokens(m, model) for m in included]
+        cached_messages, cached_tokens = self._cached_prefix(conversation_id, model, start, context, tokens)
+        return context, {
+            'window_start': start,
+            'block_fraction': self.block_fraction,
+            'prompt_tokens': sum(tokens),
+            'cached_prefix_messages': cached_messages,
+            'cached_prefix_tokens': cached_tokens
+        }
+    
+    def _window_start(self, messages: List[Dict], budget: int, model: str = None,
+                      previous_start: int = None) -> int:
+        """Index of the first message in the context window.
+        
+        In sliding mode (CONTEXT_BLOCK_FRACTION = 0) this is the first message
+        that fits, so the window moves every turn once history overflows. In
+        block mode the previous start is kept while everything after it still
+        fits; on overflow, messages are dropped until block_fraction of the
+        budget is free, leaving room for the next turns at a fixed prefix.
+        
+        Args:
+            messages: Conversation messages
+            budget: Token budget
+            model: Model name
+            previous_start: Window start of the conversation's previous context, if known
+        """
+        start = len(messages) - len(self._pack(messages, budget, model))
+        if self.block_fraction <= 0 or start == 0:
+            return start
+        if previous_start is not None and start <= previous_start < len(messages):
+            return previous_start
+        
+        target = budget * (1 - self.block_fraction)
+        used = sum(message_tokens(m, model) for m in messages[start:])
+        while start < len(messages) - 1 and used > target:
+            used -= message_tokens(messages[start], model)
+            start += 1
+        return start
+    
+    def _previous_start(self, conversation_id: Optional[str], model: Optional[str]) -> Optional[int]:
+        """Window start of the conversation's last context for the same model, if remembered."""
+        with self._previous_lock:
+            previous = self._previous.get(conversation_id)
+        if previous is None or previous[0] != model:
+            return None
+        return previous[1]
+    
+    def _cached_prefix(self, conversation_id: str, model: Optional[str], start: int, context: List[Dict],
+                       tokens: List[int]) -> Tuple[int, int]:
+        """Compare a context with the conversation's previous one and remember it.
+        
+        Returns:
+            (messages, tokens) of the leading messages shared with the previous context
+        """
+        signature = [(hash((m['role'], m['content'])), t) for m, t in zip(context, tokens)]
+        with self._previous_lock:
+            previous = self._previous.pop(conversation_id, None)
+            self._previous[conversation_id] = (model, start, signature)
+            while len(self._previous) > PREVIOUS_CONTEXTS_KEPT:
+                self._previous.popitem(last=False)
+        
+        if previous is None or previous[0] != model:
+            return 0, 0
+        shared_messages = shared_tokens = 0
+        for (current_hash, count), (previous_hash, _) in zip(signature, previous[2]):
+            if current_hash != previous_hash:
+                break
+            shared_messages += 1
+            shared_tokens += count
+        return shared_messages, shared_tokens
+    
+    def _pack(self, messages: List[Dict], budget: int, model: str = None) -> List[Dict]:
+        """Select the most recent messages whose estimated tokens fit in the budget.
+        
+        Args:
+            messages: Conversation messages, oldest first
+            budget: Token budget
+            model: Model name
+            
+        Returns:
+            List of {'role', 'content'} dicts, oldest first
+        """
+        candidates = messages[-self.max_messages:] if self.max_messages > 0 else messages
+        selected = []
+        used = 0
+        for message in reversed(candidates):
+            tokens = message_tokens(message, model)
+            if selected and used + tokens > budget:
+                break
+            used += tokens
+            selected.append({'role': message.get('role'), 'content': message.get('content', '')})
+        selected.reverse()
+        return selected
+    
+    def evicted_count(self, messages: List[Dict], model: str = None, reserve: int = 0,
+                      conversation_id: str = None) -> int:
+        """Get how many leading messages no longer fit in the context window.
+        
+        In block mode this never runs ahead of the window start build_context
+        last used for the conversation: summarizing messages that are still
+        sent verbatim would repeat them, and would change the summary (the
+        start of the prompt) in the middle of a block.
+        
+        Args:
+            messages: Conversation messages
+            model: Model name
+            reserve: Extra tokens to keep free (e.g. for a summary)
+            conversation_id: Conversation ID (lets block mode follow the window actually used)
+            
+        Returns:
+            int: Number of messages dropped from the front by build_context
+        """
+        budget = self.context_window - self.response_reserve - reserve
+        previous_start = self._previous_start(conversation_id, model)
+        start = self._window_start(messages, budget, model, previous_start)
+        if self.block_fraction > 0 and previous_start is not None:
+            start = min(start, previous_start)
+        return start
     
     def should_summarize(self, messages: List[Dict]) -> bool:
         """Check if conversation should be summarized.
@@ -87,3 +253,44 @@ class ContextBuilder:
             summary += f' ({len(messages)} messages)'
         
         return summary
+    
+    def fold_summary(self, previous: Optional[str], new_messages: List[Dict], total_messages: int) -> str:
+        """Fold newly covered messages into an existing heuristic summary.
+        
+        Produces the same kind of summary as create_summary, but only looks at
+        the messages added since the previous summary was made.
+        
+        Args:
+            previous: Previous summary text (None if there is none)
+            new_messages: Messages not yet covered by the previous summary
+            total_messages: Total messages covered after folding
+            
+        Returns:
+            Summary string
+        """
+        parts = []
+        if previous:
+            previous = MESSAGE_COUNT_SUFFIX_RE.sub('', previous)
+            if previous != 'Conversation summary':
+                parts = previous.split(' | ')
+        
+        for msg in new_messages:
+            if len(parts) >= SUMMARY_MAX_PARTS:
+                break
+            if msg.get('role') != 'user':
+                continue
+            content = msg.get('content', '').strip()
+            if content and len(content) > 10:
+                first_sentence = content.split('.')[0] if '.' in content else content[:80]
+                parts.append(first_sentence[:100])
+        
+        if len(parts) < 3:
+            for msg in [m for m in new_messages if m.get('role') == 'assistant'][:2]:
+                content = msg.get('content', '').strip()
+                if content and len(content) > 20:
+                    parts.append(content.split('\n')[0][:80])
+        
+        summary = ' | '.join(parts[:SUMMARY_MAX_PARTS]) if parts else 'Conversation summary'
+        if total_messages > 10:
+            summary += f' ({total_messages} messages)'
+        return summary
@@ -0,0 +1,412 @@
+"""Model downloads that run independently of the HTTP response.
+
+Each pull runs on its own worker thread and is registered under the model
+name, so installing a model that is already downloading joins the running
+download instead of starting a second pull. At most MODEL_PULL_CONCURRENCY
+pulls talk to Ollama at once; the rest wait in the ``queued`` state.
+
+Ollama reports progress per layer, several times per megabyte. PullProgress
+folds those lines into overall bytes, a transfer rate and an ETA, published
+at most every MODEL_PULL_PROGRESS_INTERVAL seconds; status transitions
+(``pulling manifest``, a new layer, ``verifying sha256 digest``, ...) are
+published as soon as they arrive.
+
+Progress is published as SSE frames into a small ring buffer. A subscriber
+first gets a frame with the download's current state, then every later
+event, so a client that reconnects (or opens the window after the download
+started) sees the progress right away. Closing a stream does not stop the
+download; only cancel() does.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from config import (
+    MODEL_PULL_CONCURRENCY, MODEL_PULL_RETENTION, MODEL_PULL_PROGRESS_INTERVAL, GENERATION_KEEPALIVE_SECONDS
+)
+from utils.model_manager import ModelManager
+from utils.ollama_client import OllamaClient, CancelToken, RequestCancelled
+from utils.sse import encode_event
+
+def describe_pull_error(model: str, error: str, base_url: str) -> str:
+    """Turn a pull error into a message with hints for the user."""
+    lowered = error.lower()
+    if 'manifest' in lowered or 'file does not exist' in lowered:
+        return (
+            f"Model '{model}' not found in Ollama registry. Please check:\n"
+            "1. The model name is correct (e.g., 'llama3:8b', 'mistral:7b')\n"
+            "2. Your internet connection is working\n"
+            "3. Ollama can access the model registry"
+        )
+    if 'connect' in lowered or 'timeout' in lowered or 'timed out' in lowered:
+        return (
+            "Failed to connect to Ollama service. Please ensure:\n"
+            "1. Ollama is running\n"
+            f"2. Ollama is accessible at {base_url}\n"
+            "3. Your firewall is not blocking the connection"
+        )
+    return error
+
+class PullProgress:
+    """Overall progress of one pull, built from Ollama's per-layer progress lines."""
+    
+    # Seconds of samples the transfer rate is averaged over
+    RATE_WINDOW = 5.0
+    
+    def __init__(self, interval: float = None):
+        """Initialize pull progress.
+        
+        Args:
+            interval: Minimum seconds between byte progress events (defaults to MODEL_PULL_PROGRESS_INTERVAL)
+        """
+        self.interval = MODEL_PULL_PROGRESS_INTERVAL if interval is None else interval
+        self.status = None  # Status of the last line
+        self._layers = {}  # digest -> [completed, total]
+        self._completed = 0  # Sum of completed over all layers
+        self._total = 0  # Sum of total over all layers
+        self._statuses = set()  # Statuses seen so far
+        self._samples = deque()  # (monotonic time, completed bytes)
+        self._emitted_at = 0.0
+    
+    def update(self, line: Dict, now: float = None) -> Optional[Dict]:
+        """Fold a progress line into the totals.
+        
+        Args:
+            line: Progress line from OllamaClient.pull_model
+            now: time.monotonic() (defaults to now)
+        
+        Returns:
+            The event to publish (see state()), or None if only bytes changed
+            and the last event is more recent than the interval
+        """
+        now = time.monotonic() if now is None else now
+        status = line.get('status', '')
+        digest = line.get('digest')
+        transition = status not in self._statuses
+        self._statuses.add(status)
+        self.status = status
+        if digest:
+            completed = line.get('completed') or 0
+            total = line.get('total') or 0
+            layer = self._layers.setdefault(digest, [0, 0])
+            self._completed += completed - layer[0]
+            self._total += total - layer[1]
+            layer[0], layer[1] = completed, total
+            self._samples.append((now, self._completed))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self.RATE_WINDOW:
+                self._samples.popleft()
+            if not transition and now - self._emitted_at < self.interval:
+                return None
+        self._emitted_at = now
+        return self.state()
+    
+    def rate(self) -> Optional[float]:
+        """Bytes per second over the last RATE_WINDOW seconds (None until there are two samples)."""
+        if len(self._samples) < 2:
+            return None
+        (started, first), (ended, last) = self._samples[0], self._samples[-1]
+        if ended <= started:
+            return None
+        return max(0.0, (last - first) / (ended - started))
+    
+    def state(self) -> Dict:
+        """Get the current progress.
+        
+        Returns:
+            Dict with 'status' and, once layers are downloading, 'completed' and
+            'total' bytes over all layers, 'layers', 'percent', 'bytes_per_second'
+            and 'eta_seconds' (the last three when they can be computed)
+        """
+        event = {'status': self.status}
+        if not self._layers:
+            return event
+        event['completed'] = self._completed
+        event['total'] = self._total
+        event['layers'] = len(self._layers)
+        if self._total:
+            event['percent'] = round(min(100.0, self._completed * 100 / self._total), 1)
+        rate = self.rate()
+        if rate is not None:
+            event['bytes_per_second'] = int(rate)
+            if rate > 0 and self._total:
+                event['eta_seconds'] = round(max(0, self._total - self._completed) / rate, 1)
+        return event
+
+class Download:
+    """One model pull, with its latest progress and a replayable event buffer."""
+    
+    # Events kept for subscribers that fall behind; older ones are replaced by a state frame
+    BUFFER_EVENTS = 64
+    
+    def __init__(self, model: str):
+        """Initialize download.
+        
+        Args:
+            model: Model being pulled
+        """
+        self.model = model
+        self.status = 'queued'  # queued, pulling, success, error or cancelled
+        self.error = None
+        self.progress = {}  # Last published progress
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None  # When the pull started (monotonic)
+        self.finished_at = None  # When the download finished (monotonic)
+        self.cancel_token = CancelToken()
+        
+        self._events = deque(maxlen=self.BUFFER_EVENTS)  # (event_id, frame)
+        self._last_event_id = 0
+        self._subscribers = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ('success', 'error', 'cancelled')
+    
+    def info(self) -> Dict:
+        """Get the download's state (as listed by /api/models/downloads)."""
+        with self._cond:
+            return self._info()
+    
+    def _info(self) -> Dict:
+        """Build the state dict. Must be called with the lock held."""
+        info = {
+            'model': self.model,
+            'status': self.status,
+            'created_at': self.created_at,
+            'subscribers': self._subscribers
+        }
+        if self.progress:
+            info['progress'] = dict(self.progress)
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            info['elapsed_seconds'] = round(end - self.started_at, 1)
+        if self.error:
+            info['error'] = self.error
+        return info
+    
+    def _publish(self, data: Dict, status: str = None, progress: Dict = None, error: str = None):
+        with self._cond:
+            if self.finished:
+                return
+            if status is not None:
+                self.status = status
+                if status == 'pulling':
+                    self.started_at = time.monotonic()
+                elif self.finished:
+                    self.finished_at = time.monotonic()
+            if progress is not None:
+                self.progress = progress
+            if error is not None:
+                self.error = error
+            self._last_event_id += 1
+            self._events.append((self._last_event_id, encode_event(data)))
+            self._cond.notify_all()
+    
+    def publish_progress(self, progress: Dict):
+        """Publish the pull's progress (see PullProgress.state())."""
+        self._publish(progress, progress=progress)
+    
+    def publish_status(self, status: str, data: Dict = None):
+        """Move to a new state and publish it."""
+        self._publish(data or {'status': status, 'model': self.model}, status=status)
+    
+    def fail(self, error: str, status: str = 'error'):
+        """Publish the error and mark the download finished."""
+        self._publish({'error': error, 'status': status, 'model': self.model}, status=status, error=error)
+    
+    def cancel(self) -> bool:
+        """Stop the download and close its connection to Ollama.
+        
+        Returns:
+            bool: False if the download had already finished
+        """
+        if self.finished:
+            return False
+        self.cancel_token.cancel()
+        return True
+    
+    def subscribe(self, last_event_id: int = 0, keepalive: float = None) -> Iterator[str]:
+        """Follow the download as SSE frames.
+        
+        Events after last_event_id are replayed if they are still buffered;
+        otherwise (including for new subscribers) a frame with the current
+        state comes first (``snapshot: true``, shaped like info()).
+        
+        Args:
+            last_event_id: Last event the client has seen (0 = none)
+            keepalive: Seconds between keepalive comments
+        
+        Yields:
+            str: SSE frames, each with an ``id:`` line
+        """
+        keepalive = GENERATION_KEEPALIVE_SECONDS if keepalive is None else keepalive
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield from self._follow(last_event_id, keepalive)
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+    
+    def _state_frames(self) -> List[str]:
+        """Frames bringing a subscriber up to date. Must be called with the lock held."""
+        frames = [f"id: {self._last_event_id}\n" + encode_event({**self._info(), 'snapshot': True})]
+        if self.finished and self._events:
+            # The last event says how it ended (success or the error)
+            event_id, frame = self._events[-1]
+            frames.append(f"id: {event_id}\n{frame}")
+        return frames
+    
+    def _follow(self, position: int, keepalive: float) -> Iterator[str]:
+        resync = position <= 0
+        while True:
+            with self._cond:
+                if resync or (self._events and self._events[0][0] > position + 1):
+                    # New subscriber, or missed events fell out of the ring buffer
+                    frames = self._state_frames()
+                    resync = False
+                else:
+                    frames = [f"id: {event_id}\n{frame}" for event_id, frame in self._events if event_id > position]
+                if frames:
+                    position = self._last_event_id
+                    finished = self.finished
+                elif self.finished:
+                    return
+                else:
+                    self._cond.wait(keepalive)
+                    if self._last_event_id == position and not self.finished:
+                        frames = [': keepalive\n\n']
+                    finished = False
+            
+            for frame in frames:
+                yield frame
+            if finished:
+                return
+
+class DownloadManager:
+    """Pull models on worker threads, one download per model."""
+    
+    # Seconds between cancellation checks while waiting for a pull slot
+    QUEUE_POLL_INTERVAL = 0.25
+    
+    def __init__(self, ollama_client: OllamaClient, model_manager: ModelManager = None,
+                 max_concurrent: int = None, retention: float = None):
+        """Initialize download manager.
+        
+        Args:
+            ollama_client: Client used for the pulls
+            model_manager: Invalidated when a model finishes installing
+            max_concurrent: Pulls running at once (defaults to MODEL_PULL_CONCURRENCY)
+            retention: Seconds a finished download stays listed (defaults to MODEL_PULL_RETENTION)
+        """
+        self.ollama_client = ollama_client
+        self.model_manager = model_manager
+        self.max_concurrent = max(1, MODEL_PULL_CONCURRENCY if max_concurrent is None else max_concurrent)
+        self.retention = MODEL_PULL_RETENTION if retention is None else retention
+        
+        self._downloads = {}  # model -> Download (running or recently finished)
+        self._slots = threading.Semaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._error_listeners = []
+    
+    def add_error_listener(self, callback: Callable[[Exception], None]):
+        """Call callback(error) when a pull fails (e.g. to check on Ollama sooner)."""
+        self._error_listeners.append(callback)
+    
+    def _notify_error(self, error: Exception):
+        for listener in list(self._error_listeners):
+            try:
+                listener(error)
+            except Exception as e:
+                print(f"Error in error listener: {e}")
+    
+    def _purge(self):
+        """Forget downloads finished longer than the retention period ago. Must be called with the lock held."""
+        now = time.monotonic()
+        expired = [
+            model for model, download in self._downloads.items()
+            if download.finished and now - download.finished_at > self.retention
+        ]
+        for model in expired:
+            del self._downloads[model]
+    
+    def get(self, model: str) -> Optional[Download]:
+        """Get a running or recently finished download."""
+        with self._lock:
+            self._purge()
+            return self._downloads.get(model)
+    
+    def list(self) -> List[Dict]:
+        """Get the state of every running and recently finished download."""
+        with self._lock:
+            self._purge()
+            downloads = list(self._downloads.values())
+        return [download.info() for download in downloads]
+    
+    def cancel(self, model: str) -> Optional[bool]:
+        """Cancel a model's download.
+        
+        Returns:
+            True if cancelled, False if it had already finished, None if unknown
+        """
+        download = self.get(model)
+        if download is None:
+            return None
+        return download.cancel()
+    
+    def start(self, model: str) -> Download:
+        """Start pulling a model, or join its download if one is running.
+        
+        Args:
+            model: Model name
+        
+        Returns:
+            Download: The new or already running download
+        """
+        with self._lock:
+            self._purge()
+            download = self._downloads.get(model)
+            if download is not None and not download.finished:
+                return download
+            download = Download(model)
+            self._downloads[model] = download
+        download.publish_status('queued', {'status': 'queued', 'model': model})
+        threading.Thread(target=self._run, args=(download,), daemon=True).start()
+        return download
+    
+    def _run(self, download: Download):
+        acquired = False
+        try:
+            while not self._slots.acquire(timeout=self.QUEUE_POLL_INTERVAL):
+                if download.cancel_token.cancelled:
+                    raise RequestCancelled("Download cancelled while queued")
+            acquired = True
+            if download.cancel_token.cancelled:
+                raise RequestCancelled("Download cancelled")
+            
+            download.publish_status('pulling', {'status': 'pulling', 'model': download.model})
+            progress = PullProgress()
+            installed = False
+            for line in self.ollama_client.pull_model(download.model, cancel=download.cancel_token):
+                if line.get('status') == 'success':
+                    installed = True
+                    break
+                event = progress.update(line)
+                if event is not None:
+                    download.publish_progress(event)
+            if not installed:
+                raise Exception("Download ended before the model was installed")
+            
+            if self.model_manager is not None:
+                # Refetch the installed models on the next request
+                self.model_manager.invalidate()
+            download.publish_status('success', {'status': 'success', 'model': download.model})
+        except RequestCancelled:
+            download.fail('Download cancelled', status='cancelled')
+        except Exception as e:
+            download.fail(describe_pull_error(download.model, str(e), self.ollama_client.base_url))
+            self._notify_error(e)
+        finally:
+            if acquired:
+                self._slots.release()
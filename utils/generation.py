@@ -0,0 +1,511 @@
+"""Chat generations that run independently of the HTTP response.
+
+Each generation streams from Ollama on its own worker thread and publishes
+SSE frames into a bounded ring buffer. Clients subscribe to the buffer and
+can detach and reattach (resuming after ``Last-Event-ID``); any number of
+clients can follow one generation without a second Ollama call. The partial
+reply is checkpointed to history every GENERATION_CHECKPOINT_SECONDS so a
+reload shows what has been generated so far.
+
+Before calling Ollama a generation waits for a slot from the ModelScheduler;
+its queue position is published to subscribers while it waits.
+
+A generation is cancelled explicitly, or once its last client has been gone
+for GENERATION_DETACH_GRACE seconds. Cancelling closes the Ollama connection
+so the model stops generating, and the partial reply is saved as cancelled.
+If it ends before any reply text arrived, the user message is taken back out
+of the history so a retry does not repeat it. A generation discarded because
+its conversation is deleted or truncated saves nothing more.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+from config import (
+    CONTEXT_WINDOW_SIZE, GENERATION_BUFFER_EVENTS, GENERATION_CHECKPOINT_SECONDS,
+    GENERATION_RETENTION, GENERATION_KEEPALIVE_SECONDS, GENERATION_DETACH_GRACE
+)
+from utils.history_manager import HistoryManager
+from utils.metrics import TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND, QUEUE_WAIT, MODEL_LOAD
+from utils.tracing import NULL_TRACE
+from utils.ollama_client import OllamaClient, CancelToken, RequestCancelled
+from utils.residency import ResidencyManager
+from utils.scheduler import ModelScheduler, Ticket, INTERACTIVE
+from utils.summarizer import RollingSummarizer
+from utils.sse import coalesce_chunks, content_frame, encode_event
+
+class Generation:
+    """One assistant reply being generated, with a replayable event buffer."""
+    
+    def __init__(self, conversation_id: str, model: str, buffer_size: int = None):
+        """Initialize generation.
+        
+        Args:
+            conversation_id: Conversation the reply belongs to
+            model: Model generating the reply
+            buffer_size: Number of recent events kept for reattaching clients
+        """
+        self.id = str(uuid.uuid4())
+        self.conversation_id = conversation_id
+        self.model = model
+        self.status = 'running'  # running, done, cancelled or error
+        self.finished_at = None
+        self.cancel_token = CancelToken()
+        self.detach_grace = GENERATION_DETACH_GRACE
+        self.queue_wait = 0.0  # Seconds spent waiting for a scheduler slot
+        self.accepted_at = time.monotonic()
+        self.first_token_at = None
+        self.trace = NULL_TRACE  # Trace of the request that started the generation
+        self.discarded = False  # Set when the conversation is deleted or truncated; nothing more is saved
+        
+        self._events = deque(maxlen=buffer_size or GENERATION_BUFFER_EVENTS)  # (event_id, frame)
+        self._last_event_id = 0
+        self._content_parts = []
+        self._content_event_id = 0  # Event ID of the last content frame
+        self._subscribers = 0
+        self._cond = threading.Condition()
+    
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+    
+    def content(self) -> str:
+        """Get the reply generated so far."""
+        with self._cond:
+            return ''.join(self._content_parts)
+    
+    def _publish(self, frame: str, content: str = None, status: str = None):
+        with self._cond:
+            self._last_event_id += 1
+            self._events.append((self._last_event_id, frame))
+            if content is not None:
+                self._content_parts.append(content)
+                self._content_event_id = self._last_event_id
+            if status is not None:
+                self.status = status
+                self.finished_at = time.monotonic()
+            self._cond.notify_all()
+    
+    def publish_content(self, text: str):
+        """Publish a chunk of reply text."""
+        self._publish(content_frame(text), content=text)
+    
+    def publish_event(self, data: Dict):
+        """Publish a control event (start, progress, ...)."""
+        self._publish(encode_event(data))
+    
+    def finish(self, data: Dict, status: str = 'done'):
+        """Publish the final event and mark the generation finished."""
+        self._publish(encode_event(data), status=status)
+    
+    def cancel(self) -> bool:
+        """Stop the generation and close its upstream request.
+        
+        Returns:
+            bool: False if the generation had already finished
+        """
+        if self.finished:
+            return False
+        self.cancel_token.cancel()
+        return True
+    
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the generation to finish.
+        
+        Returns:
+            bool: False if it was still running after timeout seconds
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+    
+    def _detached(self):
+        """Called when a subscriber leaves; cancel if nobody reattaches within the grace period."""
+        with self._cond:
+            self._subscribers -= 1
+            if self._subscribers > 0 or self.finished or self.detach_grace < 0:
+                return
+        if self.detach_grace == 0:
+            self.cancel()
+            return
+        timer = threading.Timer(self.detach_grace, self._cancel_if_detached)
+        timer.daemon = True
+        timer.start()
+    
+    def _cancel_if_detached(self):
+        with self._cond:
+            if self._subscribers > 0:
+                return
+        self.cancel()
+    
+    def subscribe(self, last_event_id: int = 0, keepalive: float = None) -> Iterator[str]:
+        """Follow the generation as SSE frames, starting after last_event_id.
+        
+        If the buffer no longer holds every event after last_event_id, a single
+        snapshot frame (``replace: true``) with the full reply so far is sent
+        first. Comment frames are sent while idle so proxies keep the connection.
+        
+        Args:
+            last_event_id: Last event the client has seen (0 = from the start)
+            keepalive: Seconds between keepalive comments
+        
+        Yields:
+            str: SSE frames, each with an ``id:`` line
+        """
+        keepalive = GENERATION_KEEPALIVE_SECONDS if keepalive is None else keepalive
+        with self._cond:
+            self._subscribers += 1
+        try:
+            yield from self._follow(last_event_id, keepalive)
+        finally:
+            # Also runs when the client disconnects and the response is closed
+            self._detached()
+    
+    def _follow(self, position: int, keepalive: float) -> Iterator[str]:
+        while True:
+            with self._cond:
+                if self._events and self._events[0][0] > position + 1:
+                    # Missed events fell out of the ring buffer; resync with a snapshot
+                    position = self._content_event_id
+                    snapshot = encode_event({
+                        'content': ''.join(self._content_parts), 'replace': True, 'done': False
+                    })
+                    frames = [f"id: {position}\n{snapshot}"]
+                else:
+                    frames = []
+                frames.extend(f"id: {event_id}\n{frame}" for event_id, frame in self._events if event_id > position)
+                if frames:
+                    position = self._last_event_id
+                    finished = self.finished
+                elif self.finished:
+                    return
+                else:
+                    self._cond.wait(keepalive)
+                    if self._last_event_id == position and not self.finished:
+                        frames = [': keepalive\n\n']
+                    finished = False
+            
+            for frame in frames:
+                yield frame
+            if finished:
+                return
+
+class GenerationManager:
+    """Run chat generations on worker threads and keep them attachable."""
+    
+    # Seconds between queue position checks while waiting for a slot
+    QUEUE_POLL_INTERVAL = 0.25
+    # Seconds to wait for a discarded generation to stop
+    DISCARD_TIMEOUT = 5.0
+    
+    def __init__(self, ollama_client: OllamaClient, history_manager: HistoryManager,
+                 summarizer: RollingSummarizer = None, scheduler: ModelScheduler = None,
+                 residency: ResidencyManager = None):
+        """Initialize generation manager.
+        
+        Args:
+            ollama_client: Client used for the chat streams
+            history_manager: Where partial and final replies are saved
+            summarizer: Summarizer notified of interactive work and new messages
+            scheduler: Scheduler granting model slots (None = no queuing)
+            residency: Picks keep_alive and makes room for the model (None = Ollama defaults)
+        """
+        self.ollama_client = ollama_client
+        self.history_manager = history_manager
+        self.summarizer = summarizer
+        self.scheduler = scheduler
+        self.residency = residency
+        self.checkpoint_interval = GENERATION_CHECKPOINT_SECONDS
+        self.retention = GENERATION_RETENTION
+        
+        self._generations = {}  # generation_id -> Generation
+        self._by_conversation = {}  # conversation_id -> running Generation
+        self._lock = threading.Lock()
+        self._error_listeners = []
+    
+    def add_error_listener(self, callback: Callable[[Exception], None]):
+        """Call callback(error) when a generation fails (e.g. to check on Ollama sooner)."""
+        self._error_listeners.append(callback)
+    
+    def _notify_error(self, error: Exception):
+        for listener in list(self._error_listeners):
+            try:
+                listener(error)
+            except Exception as e:
+                print(f"Error in error listener: {e}")
+    
+    def _purge(self):
+        """Forget generations finished longer than the retention period ago. Must be called with the lock held."""
+        now = time.monotonic()
+        expired = [
+            generation_id for generation_id, generation in self._generations.items()
+            if generation.finished and now - generation.finished_at > self.retention
+        ]
+        for generation_id in expired:
+            del self._generations[generation_id]
+    
+    def get(self, generation_id: str) -> Optional[Generation]:
+        """Get a running or recently finished generation."""
+        with self._lock:
+            self._purge()
+            return self._generations.get(generation_id)
+    
+    def cancel(self, generation_id: str) -> Optional[bool]:
+        """Cancel a generation.
+        
+        Returns:
+            True if cancelled, False if it had already finished, None if unknown
+        """
+        generation = self.get(generation_id)
+        if generation is None:
+            return None
+        return generation.cancel()
+    
+    def active_for(self, conversation_id: str) -> Optional[Generation]:
+        """Get the running generation of a conversation, if any."""
+        with self._lock:
+            return self._by_conversation.get(conversation_id)
+    
+    def discard(self, conversation_id: str, timeout: float = None) -> bool:
+        """Cancel the running generation of a conversation without saving its reply.
+        
+        Called before the conversation is deleted or truncated, so that no
+        checkpoint or final save writes it back afterwards.
+        
+        Args:
+            conversation_id: Conversation ID
+            timeout: Seconds to wait for the generation to stop (default DISCARD_TIMEOUT)
+        
+        Returns:
+            bool: False if the generation was still running after the timeout
+        """
+        generation = self.active_for(conversation_id)
+        if generation is None:
+            return True
+        generation.discarded = True
+        generation.cancel()
+        return generation.wait(self.DISCARD_TIMEOUT if timeout is None else timeout)
+    
+    def start(self, conversation: Dict, context_messages: List[Dict], model: str,
+              priority: int = INTERACTIVE, context_info: Dict = None, trace=NULL_TRACE) -> Generation:
+        """Start generating the assistant reply for a conversation.
+        
+        The conversation (ending with the new user message) is saved right away;
+        the worker owns it from then on, and removes the message again if no
+        reply text arrives.
+        
+        Args:
+            conversation: Conversation dict
+            context_messages: Messages to send to the model
+            model: Model name
+            priority: Scheduler priority class
+            context_info: Description of the context (from ContextBuilder.build_context_info),
+                passed on to clients in the start event
+            trace: Request trace, continued on the worker and finished with the generation
+        
+        Returns:
+            Generation: The started generation
+        
+        Raises:
+            ValueError: If the conversation already has a generation running
+            SchedulerFull: If the scheduler queue is full
+        """
+        conversation_id = conversation['id']
+        generation = Generation(conversation_id, model)
+        generation.trace = trace
+        with self._lock:
+            if conversation_id in self._by_conversation:
+                raise ValueError("A reply is already being generated for this conversation")
+            self._purge()
+            ticket = self.scheduler.submit(model, priority, conversation_id) if self.scheduler else None
+            self._generations[generation.id] = generation
+            self._by_conversation[conversation_id] = generation
+        
+        with trace.span('save_user_message'):
+            self.history_manager.save_conversation(conversation)
+        start_event = {'generation_id': generation.id, 'conversation_id': conversation_id, 'done': False}
+        if context_info:
+            start_event['context'] = context_info
+        generation.publish_event(start_event)
+        threading.Thread(
+            target=self._run, args=(generation, conversation, context_messages, ticket), daemon=True
+        ).start()
+        return generation
+    
+    def _save_reply(self, generation: Generation, conversation: Dict, index: int, message: Dict):
+        """Save the assistant reply at messages[index], replacing an earlier checkpoint.
+        
+        Only that message is written to the history, so checkpoints cost the
+        same however long the conversation is. Once the conversation is gone
+        (deleted without discard()), the generation saves nothing more.
+        """
+        if generation.discarded:
+            return
+        messages = conversation['messages']
+        if index < len(messages):
+            messages[index] = message
+        else:
+            messages.append(message)
+        conversation['updated_at'] = datetime.now().isoformat()
+        if not self.history_manager.save_message(conversation['id'], index, message,
+                                                 {'updated_at': conversation['updated_at']}):
+            generation.discarded = True
+    
+    def _remove_user_message(self, generation: Generation, conversation: Dict, index: int):
+        """Take back the user message at messages[index] of a generation that produced nothing."""
+        if generation.discarded or self.history_manager.get_conversation(conversation['id']) is None:
+            return
+        del conversation['messages'][index:]
+        if conversation['messages']:
+            self.history_manager.save_conversation(conversation)
+        else:
+            # The conversation was created for this message
+            self.history_manager.delete_conversation(conversation['id'])
+    
+    def _reply_stats(self, generation: Generation, stats: Dict) -> Dict:
+        """Record the metrics of a finished reply and build the stats stored with it.
+        
+        Args:
+            generation: The generation
+            stats: STAT_FIELDS from Ollama's final chunk (durations in nanoseconds)
+        
+        Returns:
+            Dict: Ollama's stats plus queue_wait_ms, time_to_first_token_ms and tokens_per_second
+        """
+        model = generation.model
+        reply_stats = dict(stats)
+        reply_stats['queue_wait_ms'] = round(generation.queue_wait * 1000, 1)
+        if generation.first_token_at is not None:
+            reply_stats['time_to_first_token_ms'] = round((generation.first_token_at - generation.accepted_at) * 1000, 1)
+        if stats.get('eval_count') and stats.get('eval_duration'):
+            tokens_per_second = stats['eval_count'] / (stats['eval_duration'] / 1e9)
+            reply_stats['tokens_per_second'] = round(tokens_per_second, 2)
+            TOKENS_PER_SECOND.observe(tokens_per_second, model)
+        if stats.get('load_duration') is not None:
+            MODEL_LOAD.observe(stats['load_duration'] / 1e9, model)
+        return reply_stats
+    
+    def _wait_for_slot(self, generation: Generation, ticket: Ticket):
+        """Wait for the scheduler to grant the slot, publishing queue position changes."""
+        last_position = 0
+        while True:
+            position = self.scheduler.position(ticket)
+            if position != last_position:
+                generation.publish_event({'queued': position > 0, 'position': position, 'done': False})
+                last_position = position
+            if ticket.wait(self.QUEUE_POLL_INTERVAL):
+                break
+            if generation.cancel_token.cancelled:
+                raise RequestCancelled("Request cancelled while queued")
+        generation.queue_wait = ticket.queue_wait
+        QUEUE_WAIT.observe(generation.queue_wait, generation.model)
+        if last_position:
+            generation.publish_event({'queued': False, 'position': 0, 'done': False})
+    
+    def _run(self, generation: Generation, conversation: Dict, context_messages: List[Dict],
+             ticket: Optional[Ticket] = None):
+        reply_index = len(conversation['messages'])
+        started_at = datetime.now().isoformat()
+        trace = generation.trace
+        try:
+            if ticket is not None:
+                with trace.span('queue'):
+                    self._wait_for_slot(generation, ticket)
+            with trace.span('prepare_model'):
+                keep_alive = self.residency.prepare(generation.model) if self.residency else None
+            next_checkpoint = time.monotonic() + self.checkpoint_interval
+            stats = {}
+            # Background summaries hold off while this generation runs
+            with self.summarizer.interactive() if self.summarizer else nullcontext():
+                chunks = self.ollama_client.chat(
+                    generation.model, context_messages, stream=True,
+                    options={'num_ctx': CONTEXT_WINDOW_SIZE}, cancel=generation.cancel_token,
+                    keep_alive=keep_alive, stats=stats, trace=trace
+                )
+                stream_started = None
+                for text in coalesce_chunks(chunks):
+                    if generation.first_token_at is None:
+                        generation.first_token_at = time.monotonic()
+                        TIME_TO_FIRST_TOKEN.observe(generation.first_token_at - generation.accepted_at, generation.model)
+                        trace.mark('first_token')
+                        stream_started = time.perf_counter()
+                    generation.publish_content(text)
+                    if self.checkpoint_interval > 0 and time.monotonic() >= next_checkpoint:
+                        self._save_reply(generation, conversation, reply_index, {
+                            'role': 'assistant', 'content': generation.content(),
+                            'timestamp': started_at, 'partial': True
+                        })
+                        next_checkpoint = time.monotonic() + self.checkpoint_interval
+                if stream_started is not None:
+                    trace.add('stream', stream_started)
+                trace.mark('stream_end')
+            
+            reply_stats = self._reply_stats(generation, stats)
+            with trace.span('save_reply'):
+                self._save_reply(generation, conversation, reply_index, {
+                    'role': 'assistant',
+                    'content': generation.content(),
+                    'timestamp': datetime.now().isoformat(),
+                    'stats': reply_stats
+                })
+            
+            # Fold new messages into the summary in the background
+            if self.summarizer and not generation.discarded:
+                with trace.span('schedule_summary'):
+                    self.summarizer.schedule(conversation['id'], conversation['messages'], generation.model)
+            
+            done_event = {
+                'content': '', 'done': True, 'stats': reply_stats,
+                'conversation_id': conversation['id'], 'title': conversation.get('title')
+            }
+            if trace.enabled:
+                trace.set('status', 'done')
+                done_event['timing'] = trace.finish()
+            generation.finish(done_event)
+        except RequestCancelled:
+            content = generation.content()
+            if content:
+                try:
+                    self._save_reply(generation, conversation, reply_index, {
+                        'role': 'assistant', 'content': content,
+                        'timestamp': started_at, 'cancelled': True
+                    })
+                except Exception as save_error:
+                    print(f"Error saving cancelled reply {conversation['id']}: {save_error}")
+            else:
+                try:
+                    self._remove_user_message(generation, conversation, reply_index - 1)
+                except Exception as save_error:
+                    print(f"Error removing unanswered message {conversation['id']}: {save_error}")
+            generation.finish({
+                'content': '', 'done': True, 'cancelled': True,
+                'conversation_id': conversation['id'], 'title': conversation.get('title')
+            }, status='cancelled')
+        except Exception as e:
+            # Keep whatever was generated before the failure
+            content = generation.content()
+            if content:
+                try:
+                    self._save_reply(generation, conversation, reply_index, {
+                        'role': 'assistant', 'content': content,
+                        'timestamp': started_at, 'partial': True, 'error': str(e)
+                    })
+                except Exception as save_error:
+                    print(f"Error saving partial reply {conversation['id']}: {save_error}")
+            else:
+                try:
+                    self._remove_user_message(generation, conversation, reply_index - 1)
+                except Exception as save_error:
+                    print(f"Error removing unanswered message {conversation['id']}: {save_error}")
+            generation.finish({'error': str(e), 'done': True}, status='error')
+            self._notify_error(e)
+        finally:
+            trace.set('status', generation.status)
+            trace.finish()
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            with self._lock:
+                if self._by_conversation.get(conversation['id']) is generation:
+                    del self._by_conversation[conversation['id']]
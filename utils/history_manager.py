@@ -1,77 +1,397 @@
-"""Conversation history storage and retrieval."""
-import json
-from pathlib import Path
-from typing import Dict, List, Optional
-from datetime import datetime
-from utils.paths import get_conversations_path, get_summaries_path
+"""Conversation history storage and retrieval.
+
+HistoryManager fronts the storage backend with a bounded LRU cache of
+recently used conversations and optional write-behind: saves update the
+cache immediately and are coalesced into a single storage write after
+HISTORY_WRITE_BEHIND_DELAY seconds (and on flush/shutdown).
+"""
+import atexit
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from config import HISTORY_CACHE_SIZE, HISTORY_CACHE_MAX_BYTES, HISTORY_WRITE_BEHIND_DELAY
+from utils.history_storage import HistoryStorage, create_storage
+from utils.metrics import HISTORY_READ, HISTORY_WRITE
+
+# Fixed per-message overhead used when estimating cache memory
+MESSAGE_OVERHEAD_BYTES = 120
+
+def _pack_message(message: Dict) -> tuple:
+    """Pack a message dict into a compact tuple (role, content, timestamp, extra)."""
+    extra = {k: v for k, v in message.items() if k not in ('role', 'content', 'timestamp')} or None
+    return (message.get('role'), message.get('content'), message.get('timestamp'), extra)
+
+def _unpack_message(packed: tuple) -> Dict:
+    """Rebuild a message dict from its packed tuple."""
+    role, content, timestamp, extra = packed
+    message = {'role': role, 'content': content}
+    if timestamp is not None:
+        message['timestamp'] = timestamp
+    if extra:
+        message.update(extra)
+    return message
+
+class _PendingWrite(NamedTuple):
+    """A dirty cache entry captured for writing to storage."""
+    conversation_id: str
+    conversation: Dict
+    version: int  # Entry version captured
+    changed_from: Optional[int]
+    epoch: int  # Delete/truncate count of the conversation when captured
+
+class _CachedConversation:
+    """A conversation held in the cache."""
+    
+    __slots__ = ('meta', 'messages', 'size', 'dirty_since', 'version', 'changed_from')
+    
+    def __init__(self, conversation: Dict):
+        self.dirty_since = None
+        self.version = 0
+        self.changed_from = None  # Lowest message index rewritten in place since the last write
+        self.update(conversation)
+    
+    def update(self, conversation: Dict):
+        self.meta = {k: v for k, v in conversation.items() if k != 'messages'}
+        self.messages = [_pack_message(m) for m in conversation.get('messages', [])]
+        self.size = sum(MESSAGE_OVERHEAD_BYTES + len(m[1] or '') for m in self.messages) + MESSAGE_OVERHEAD_BYTES
+    
+    def to_conversation(self) -> Dict:
+        conversation = dict(self.meta)
+        conversation['messages'] = [_unpack_message(m) for m in self.messages]
+        return conversation
 
 class HistoryManager:
     """Manage conversation history storage."""
     
-    def __init__(self):
-        """Initialize history manager."""
-        self.conversations_path = get_conversations_path()
-        self.summaries_path = get_summaries_path()
+    def __init__(self, storage: HistoryStorage = None, cache_size: int = None,
+                 cache_max_bytes: int = None, write_behind_delay: float = None):
+        """Initialize history manager.
+        
+        Args:
+            storage: Storage backend (defaults to the one selected by HISTORY_BACKEND)
+            cache_size: Maximum number of cached conversations (0 disables the cache)
+            cache_max_bytes: Approximate memory budget for cached conversations
+            write_behind_delay: Seconds to coalesce saves before writing (0 = write-through)
+        """
+        self.storage = storage or create_storage()
+        self.cache_size = HISTORY_CACHE_SIZE if cache_size is None else cache_size
+        self.cache_max_bytes = HISTORY_CACHE_MAX_BYTES if cache_max_bytes is None else cache_max_bytes
+        self.write_behind_delay = HISTORY_WRITE_BEHIND_DELAY if write_behind_delay is None else write_behind_delay
+        
+        self._cache = OrderedDict()  # conversation_id -> _CachedConversation, oldest first
+        self._cache_bytes = 0
+        self._versions = itertools.count(1)  # Entry versions, unique across entries
+        self._epochs = {}  # conversation_id -> number of deletes/truncates (tombstones for pending writes)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Serializes storage writes from the cache
+        self._flush_wakeup = threading.Condition(self._lock)
+        self._flusher = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'writes': 0, 'coalesced_saves': 0}
+        
+        atexit.register(self.flush)
+    
+    def _read_storage(self, conversation_id: str) -> Optional[Dict]:
+        """Read a conversation from storage, recording the read time."""
+        started = time.perf_counter()
+        try:
+            return self.storage.get_conversation(conversation_id)
+        finally:
+            HISTORY_READ.observe(time.perf_counter() - started, self.storage.backend)
+    
+    def _write_storage(self, conversation: Dict, changed_from: int = None):
+        """Write a conversation to storage, recording the write time."""
+        started = time.perf_counter()
+        try:
+            self.storage.save_conversation(conversation, changed_from)
+        finally:
+            HISTORY_WRITE.observe(time.perf_counter() - started, self.storage.backend)
+    
+    def _write_behind_enabled(self) -> bool:
+        return self.cache_size > 0 and self.write_behind_delay > 0
+    
+    def _cache_put(self, conversation_id: str, conversation: Dict) -> _CachedConversation:
+        """Insert or refresh a cache entry. Must be called with the lock held."""
+        entry = self._cache.get(conversation_id)
+        if entry is None:
+            entry = _CachedConversation(conversation)
+            self._cache[conversation_id] = entry
+        else:
+            self._cache_bytes -= entry.size
+            entry.update(conversation)
+            self._cache.move_to_end(conversation_id)
+        self._cache_bytes += entry.size
+        return entry
+    
+    def _set_message(self, entry: _CachedConversation, index: int, message: Dict, meta: Dict = None):
+        """Replace or append one message of a cache entry. Must be called with the lock held."""
+        packed = _pack_message(message)
+        self._cache_bytes -= entry.size
+        if index < len(entry.messages):
+            entry.size -= len(entry.messages[index][1] or '')
+            entry.messages[index] = packed
+            if entry.changed_from is None or index < entry.changed_from:
+                entry.changed_from = index
+        else:
+            entry.size += MESSAGE_OVERHEAD_BYTES
+            entry.messages.append(packed)
+        entry.size += len(packed[1] or '')
+        self._cache_bytes += entry.size
+        if meta:
+            entry.meta.update(meta)
+    
+    def _pending(self, conversation_id: str, entry: _CachedConversation) -> _PendingWrite:
+        """Capture a dirty entry for writing. Must be called with the lock held."""
+        return _PendingWrite(
+            conversation_id, entry.to_conversation(), entry.version, entry.changed_from,
+            self._epochs.get(conversation_id, 0)
+        )
+    
+    def _evict(self) -> List[_PendingWrite]:
+        """Drop least recently used entries over budget. Must be called with the lock held.
+        
+        Returns:
+            Pending writes of the evicted dirty entries
+        """
+        to_flush = []
+        while self._cache and (len(self._cache) > self.cache_size or self._cache_bytes > self.cache_max_bytes):
+            conversation_id, entry = self._cache.popitem(last=False)
+            self._cache_bytes -= entry.size
+            self._stats['evictions'] += 1
+            if entry.dirty_since is not None:
+                to_flush.append(self._pending(conversation_id, entry))
+        return to_flush
+    
+    def _write(self, pending: List[_PendingWrite]):
+        """Write captured entries to storage and mark them clean.
+        
+        Entries are captured before the flush lock is taken, so each one is
+        checked again under it: a conversation deleted or truncated since
+        its capture is skipped (it would otherwise come back), as is one
+        with a newer save still pending (that save supersedes it).
+        """
+        with self._flush_lock:
+            for item in pending:
+                with self._lock:
+                    if self._epochs.get(item.conversation_id, 0) != item.epoch:
+                        continue
+                    entry = self._cache.get(item.conversation_id)
+                    if entry is not None and entry.version > item.version and entry.dirty_since is not None:
+                        continue
+                self._write_storage(item.conversation, item.changed_from)
+                with self._lock:
+                    self._stats['writes'] += 1
+                    entry = self._cache.get(item.conversation_id)
+                    if entry is not None and entry.version == item.version:
+                        entry.dirty_since = None
+                        entry.changed_from = None
+    
+    def _ensure_flusher(self):
+        """Start the write-behind thread. Must be called with the lock held."""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self):
+        """Background loop writing dirty entries once they are older than the delay."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = []
+                next_due = None
+                for conversation_id, entry in self._cache.items():
+                    if entry.dirty_since is None:
+                        continue
+                    deadline = entry.dirty_since + self.write_behind_delay
+                    if deadline <= now:
+                        due.append(self._pending(conversation_id, entry))
+                    elif next_due is None or deadline < next_due:
+                        next_due = deadline
+                if not due:
+                    self._flush_wakeup.wait(None if next_due is None else next_due - now)
+                    continue
+            try:
+                self._write(due)
+            except Exception as e:
+                print(f"Error writing conversations: {e}")
+    
+    def flush(self):
+        """Write all pending conversation saves to storage now."""
+        with self._lock:
+            pending = [
+                self._pending(conversation_id, entry)
+                for conversation_id, entry in self._cache.items()
+                if entry.dirty_since is not None
+            ]
+        if pending:
+            self._write(pending)
+    
+    def cache_stats(self) -> Dict:
+        """Get cache counters.
+        
+        Returns:
+            Dict with hits, misses, evictions, writes, coalesced_saves and current usage
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._cache)
+            stats['bytes'] = self._cache_bytes
+            stats['dirty'] = sum(1 for entry in self._cache.values() if entry.dirty_since is not None)
+        return stats
     
     def get_conversation(self, conversation_id: str) -> Optional[Dict]:
         """Get a conversation by ID.
         
         Args:
             conversation_id: Conversation ID
-            
+        
         Returns:
             Conversation dict or None if not found
         """
-        file_path = self.conversations_path / f"{conversation_id}.json"
-        if not file_path.exists():
-            return None
+        with self._lock:
+            entry = self._cache.get(conversation_id)
+            if entry is not None:
+                self._cache.move_to_end(conversation_id)
+                self._stats['hits'] += 1
+                return entry.to_conversation()
+            self._stats['misses'] += 1
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error reading conversation {conversation_id}: {e}")
-            return None
+        conversation = self._read_storage(conversation_id)
+        if conversation is not None and self.cache_size > 0:
+            with self._lock:
+                if conversation_id not in self._cache:
+                    self._cache_put(conversation_id, conversation)
+                    evicted = self._evict()
+                else:
+                    evicted = []
+            if evicted:
+                self._write(evicted)
+        return conversation
     
-    def save_conversation(self, conversation: Dict):
-        """Save a conversation to disk.
+    def save_conversation(self, conversation: Dict, changed_from: int = None):
+        """Save a conversation.
+        
+        With write-behind enabled the cache is updated immediately and the
+        storage write happens later, coalesced with any further saves.
         
         Args:
             conversation: Conversation dict with id, title, messages, etc.
+            changed_from: Index of the first message changed in place (e.g. a partial
+                reply that was extended); None if existing messages are unchanged
         """
         conversation_id = conversation.get('id')
         if not conversation_id:
             return
         
-        file_path = self.conversations_path / f"{conversation_id}.json"
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving conversation {conversation_id}: {e}")
+        if not self._write_behind_enabled():
+            self._write_storage(conversation, changed_from)
+            if self.cache_size > 0:
+                with self._lock:
+                    self._cache_put(conversation_id, conversation)
+                    evicted = self._evict()
+                if evicted:
+                    self._write(evicted)
+            return
+        
+        with self._lock:
+            entry = self._cache_put(conversation_id, conversation)
+            entry.version = next(self._versions)
+            if changed_from is not None and (entry.changed_from is None or changed_from < entry.changed_from):
+                entry.changed_from = changed_from
+            if entry.dirty_since is None:
+                entry.dirty_since = time.monotonic()
+            else:
+                self._stats['coalesced_saves'] += 1
+            evicted = self._evict()
+            self._ensure_flusher()
+            self._flush_wakeup.notify()
+        if evicted:
+            self._write(evicted)
+    
+    def save_message(self, conversation_id: str, index: int, message: Dict, meta: Dict = None) -> bool:
+        """Set one message of a stored conversation, e.g. a reply being streamed.
+        
+        Only that message is packed into the cached entry, so repeated saves
+        (checkpoints) do not cost more as the conversation grows.
+        
+        Args:
+            conversation_id: Conversation ID
+            index: Message index; an existing message is replaced, len(messages) appends
+            message: Message dict
+            meta: Metadata fields to update along with it (e.g. updated_at)
+        
+        Returns:
+            bool: False if the conversation does not exist (e.g. it was deleted)
+        """
+        if self.cache_size > 0:
+            with self._lock:
+                cached = conversation_id in self._cache
+            if not cached and self.get_conversation(conversation_id) is None:
+                return False
+            with self._lock:
+                entry = self._cache.get(conversation_id)
+                updated = entry is not None and index <= len(entry.messages)
+                if updated:
+                    self._set_message(entry, index, message, meta)
+                    self._cache.move_to_end(conversation_id)
+                    if self._write_behind_enabled():
+                        entry.version = next(self._versions)
+                        if entry.dirty_since is None:
+                            entry.dirty_since = time.monotonic()
+                        else:
+                            self._stats['coalesced_saves'] += 1
+                        self._ensure_flusher()
+                        self._flush_wakeup.notify()
+                        pending = []
+                    else:
+                        pending = [self._pending(conversation_id, entry)]
+                    pending.extend(self._evict())
+            if updated:
+                if pending:
+                    self._write(pending)
+                return True
+        
+        # Not cached (or evicted meanwhile): update the stored conversation
+        conversation = self._read_storage(conversation_id)
+        if conversation is None or index > len(conversation['messages']):
+            return False
+        changed_from = None
+        if index < len(conversation['messages']):
+            conversation['messages'][index] = message
+            changed_from = index
+        else:
+            conversation['messages'].append(message)
+        conversation.update(meta or {})
+        self.save_conversation(conversation, changed_from)
+        return True
     
     def list_conversations(self) -> List[Dict]:
         """List all conversations.
         
+        Saves that have not been written yet are reflected in the listing.
+        
         Returns:
             List of conversation dicts (id, title, updated_at)
         """
-        conversations = []
+        conversations = self.storage.list_conversations()
+        with self._lock:
+            pending = {
+                conversation_id: entry.meta
+                for conversation_id, entry in self._cache.items()
+                if entry.dirty_since is not None
+            }
+        if not pending:
+            return conversations
         
-        for file_path in self.conversations_path.glob('*.json'):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    conv = json.load(f)
-                    conversations.append({
-                        'id': conv.get('id'),
-                        'title': conv.get('title', 'Untitled'),
-                        'updated_at': conv.get('updated_at', ''),
-                        'created_at': conv.get('created_at', '')
-                    })
-            except Exception as e:
-                print(f"Error reading conversation file {file_path}: {e}")
-        
-        # Sort by updated_at (most recent first)
+        conversations = [c for c in conversations if c.get('id') not in pending]
+        for conversation_id, meta in pending.items():
+            conversations.append({
+                'id': conversation_id,
+                'title': meta.get('title', 'Untitled'),
+                'updated_at': meta.get('updated_at', ''),
+                'created_at': meta.get('created_at', '')
+            })
         conversations.sort(key=lambda x: x.get('updated_at', ''), reverse=True)
         return conversations
     
@@ -80,57 +400,65 @@ class HistoryManager:
         
         Args:
             conversation_id: Conversation ID to delete
-            
+        
         Returns:
             bool: True if deleted successfully
         """
-        file_path = self.conversations_path / f"{conversation_id}.json"
-        summary_path = self.summaries_path / f"{conversation_id}.json"
-        
-        try:
-            if file_path.exists():
-                file_path.unlink()
-            if summary_path.exists():
-                summary_path.unlink()
-            return True
-        except Exception as e:
-            print(f"Error deleting conversation {conversation_id}: {e}")
-            return False
+        with self._flush_lock:
+            with self._lock:
+                entry = self._cache.pop(conversation_id, None)
+                if entry is not None:
+                    self._cache_bytes -= entry.size
+                # Writes captured before this point must not recreate the conversation
+                self._epochs[conversation_id] = self._epochs.get(conversation_id, 0) + 1
+            return self.storage.delete_conversation(conversation_id)
     
     def get_summary(self, conversation_id: str) -> Optional[str]:
         """Get conversation summary.
         
         Args:
             conversation_id: Conversation ID
-            
+        
         Returns:
             Summary string or None
         """
-        file_path = self.summaries_path / f"{conversation_id}.json"
-        if not file_path.exists():
-            return None
+        return self.storage.get_summary(conversation_id)
+    
+    def get_summary_state(self, conversation_id: str) -> Optional[Dict]:
+        """Get conversation summary together with its watermark.
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('summary', '')
-        except Exception as e:
-            print(f"Error reading summary {conversation_id}: {e}")
-            return None
-    
-    def save_summary(self, conversation_id: str, summary: str):
+        Args:
+            conversation_id: Conversation ID
+        
+        Returns:
+            Dict with 'summary' and 'covered' (number of leading messages folded in) or None
+        """
+        return self.storage.get_summary_state(conversation_id)
+    
+    def save_summary(self, conversation_id: str, summary: str, covered: int = None):
         """Save conversation summary.
         
         Args:
             conversation_id: Conversation ID
             summary: Summary text
+            covered: Number of leading messages the summary covers
         """
-        file_path = self.summaries_path / f"{conversation_id}.json"
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump({'summary': summary, 'conversation_id': conversation_id}, f, indent=2)
-        except Exception as e:
-            print(f"Error saving summary {conversation_id}: {e}")
+        self.storage.save_summary(conversation_id, summary, covered)
+    
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """Full-text search over conversation messages.
+        
+        Saves still waiting in the write-behind queue become searchable once written.
+        
+        Args:
+            query: Search text
+            limit: Maximum results to return
+            offset: Number of results to skip
+        
+        Returns:
+            Dict with 'results' and 'total'
+        """
+        return self.storage.search(query, limit, offset)
     
     def truncate_conversation(self, conversation_id: str, message_index: int) -> bool:
         """Truncate conversation at a specific message index (remove all messages after that index).
@@ -138,31 +466,18 @@ class HistoryManager:
         Args:
             conversation_id: Conversation ID
             message_index: Index of the message to keep (0-based). All messages after this will be removed.
-            
+        
         Returns:
             bool: True if truncated successfully
         """
-        conversation = self.get_conversation(conversation_id)
-        if not conversation:
-            return False
-        
-        messages = conversation.get('messages', [])
-        if message_index < 0 or message_index >= len(messages):
-            return False
-        
-        # Truncate messages
-        conversation['messages'] = messages[:message_index + 1]
-        conversation['updated_at'] = datetime.now().isoformat()
-        
-        # Save updated conversation
-        self.save_conversation(conversation)
-        
-        # Delete summary if exists (since conversation changed)
-        summary_path = self.summaries_path / f"{conversation_id}.json"
-        if summary_path.exists():
-            try:
-                summary_path.unlink()
-            except Exception as e:
-                print(f"Error deleting summary {conversation_id}: {e}")
-        
-        return True
+        with self._flush_lock:
+            with self._lock:
+                entry = self._cache.pop(conversation_id, None)
+                if entry is not None:
+                    self._cache_bytes -= entry.size
+                # Writes captured before this point must not bring truncated messages back
+                self._epochs[conversation_id] = self._epochs.get(conversation_id, 0) + 1
+            # Write a pending save first so the truncation applies to the latest messages
+            if entry is not None and entry.dirty_since is not None:
+                self._write_storage(entry.to_conversation(), entry.changed_from)
+            return self.storage.truncate_conversation(conversation_id, message_index)
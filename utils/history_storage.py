@@ -0,0 +1,1002 @@
+"""Storage backends for conversation history.
+
+``FileHistoryStorage`` keeps each conversation as an append-only JSON Lines
+log (``<id>.jsonl``) and keeps an in-memory metadata index (persisted as a
+sidecar snapshot) so listing never has to open conversation files.
+The first record is a metadata header; new messages are appended as
+``message`` records and metadata changes (title, updated_at, ...) as further
+``meta`` records, so saving a turn costs O(new data) instead of rewriting the
+whole history. Logs that accumulate many stale ``meta`` records are compacted
+in the background. Legacy ``<id>.json`` files are migrated on first read.
+
+``SQLiteHistoryStorage`` keeps conversations, messages and summaries in a
+single stdlib ``sqlite3`` database in WAL mode, with an index on
+``updated_at`` so listing does not touch message data.
+
+Both backends keep an incremental full-text index (see utils.search_index).
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
+from config import HISTORY_BACKEND, HISTORY_COMPACT_THRESHOLD, HISTORY_INDEX_SNAPSHOT_DELAY
+from utils.paths import (
+    get_conversations_path, get_summaries_path, get_history_db_path,
+    get_conversation_index_path, get_search_index_path
+)
+from utils.search_index import SearchIndex
+
+# Records are written with compact separators and 'type' first, so the kind of
+# a line can be told from its prefix without parsing it
+META_PREFIX = b'{"type":"meta"'
+MESSAGE_PREFIX = b'{"type":"message"'
+
+# Per-file locks shared by every storage instance
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def _get_file_lock(file_path: Path) -> threading.RLock:
+    """Get the lock guarding a conversation log."""
+    key = str(file_path)
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = threading.RLock()
+            _file_locks[key] = lock
+        return lock
+
+def _encode_record(record_type: str, data: Dict) -> bytes:
+    """Encode a single log record as one JSON line."""
+    record = {'type': record_type}
+    record.update(data)
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _split_conversation(conversation: Dict):
+    """Split a conversation dict into (metadata, messages)."""
+    meta = {k: v for k, v in conversation.items() if k != 'messages'}
+    return meta, conversation.get('messages', [])
+
+class HistoryStorage:
+    """Interface implemented by conversation storage backends."""
+    
+    backend = 'custom'  # Label used in metrics
+    
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Get a conversation (metadata plus 'messages') or None if not found."""
+        raise NotImplementedError
+    
+    def save_conversation(self, conversation: Dict, changed_from: int = None):
+        """Persist a conversation, storing only what changed where possible.
+        
+        Messages before changed_from (all stored messages if None) are assumed
+        unchanged; only the ones after them are written.
+        """
+        raise NotImplementedError
+    
+    def list_conversations(self) -> List[Dict]:
+        """List conversation metadata (id, title, updated_at, created_at), most recent first."""
+        raise NotImplementedError
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """Delete a conversation and its summary."""
+        raise NotImplementedError
+    
+    def truncate_conversation(self, conversation_id: str, message_index: int) -> bool:
+        """Keep messages up to and including message_index and drop the summary."""
+        raise NotImplementedError
+    
+    def get_summary(self, conversation_id: str) -> Optional[str]:
+        """Get the stored summary for a conversation."""
+        state = self.get_summary_state(conversation_id)
+        return state['summary'] if state else None
+    
+    def get_summary_state(self, conversation_id: str) -> Optional[Dict]:
+        """Get the stored summary with its watermark: {'summary', 'covered'}."""
+        raise NotImplementedError
+    
+    def save_summary(self, conversation_id: str, summary: str, covered: int = None):
+        """Store the summary for a conversation and how many messages it covers."""
+        raise NotImplementedError
+    
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        """Full-text search over message contents.
+        
+        Returns:
+            Dict with 'results' (conversation_id, title, message_index, role,
+            snippet, score) and 'total'
+        """
+        raise NotImplementedError
+
+class FileHistoryStorage(HistoryStorage):
+    """Conversation storage backed by append-only JSON Lines files."""
+    
+    backend = 'file'
+    INDEX_VERSION = 1
+    
+    def __init__(self):
+        """Initialize file storage and build the metadata index."""
+        self.conversations_path = get_conversations_path()
+        self.summaries_path = get_summaries_path()
+        self.index_path = get_conversation_index_path()
+        self.compact_threshold = HISTORY_COMPACT_THRESHOLD
+        self.index_snapshot_delay = HISTORY_INDEX_SNAPSHOT_DELAY
+        # conversation_id -> last known log state (size, meta, message offsets, ...)
+        self._log_state = {}
+        self._pending_compactions = set()
+        self._compaction_lock = threading.Lock()
+        # conversation_id -> {id, title, created_at, updated_at, message_count, mtime_ns, size}
+        self._index = {}
+        self._index_lock = threading.Lock()
+        self._sorted_listing = None
+        self._index_dirty = False
+        self._snapshot_timer = None
+        self.search_index = SearchIndex(get_search_index_path())
+        self.refresh_index()
+        atexit.register(self.save_index_snapshot)
+        
+        if not self.search_index.is_built():
+            threading.Thread(target=self._build_search_index, daemon=True).start()
+    
+    def _log_path(self, conversation_id: str) -> Path:
+        return self.conversations_path / f"{conversation_id}.jsonl"
+    
+    def _legacy_path(self, conversation_id: str) -> Path:
+        return self.conversations_path / f"{conversation_id}.json"
+    
+    @staticmethod
+    def _scan_log(file_path: Path, parse_messages: bool = True) -> Dict:
+        """Read a conversation log.
+        
+        Args:
+            file_path: Path to the .jsonl log
+            parse_messages: Decode message records (False only records their offsets)
+        
+        Returns:
+            Log state dict: meta, messages, offsets, meta_records, size
+        """
+        meta = {}
+        messages = []
+        offsets = []
+        meta_records = 0
+        size = 0
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Torn write from a crash; everything before it is intact
+                    break
+                if line.startswith(MESSAGE_PREFIX):
+                    offsets.append(size)
+                    if parse_messages:
+                        messages.append(json.loads(line)['message'])
+                elif line.startswith(META_PREFIX):
+                    record = json.loads(line)
+                    record.pop('type', None)
+                    meta.update(record)
+                    meta_records += 1
+                size += len(line)
+        return {
+            'meta': meta,
+            'messages': messages,
+            'offsets': offsets,
+            'meta_records': meta_records,
+            'size': size
+        }
+    
+    @staticmethod
+    def _count_meta_records(file_path: Path, start: int, end: int) -> int:
+        """Count the meta records between two offsets of a log (e.g. the part about to be cut off)."""
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            tail = f.read(end - start)
+        return sum(1 for line in tail.splitlines() if line.startswith(META_PREFIX))
+    
+    @classmethod
+    def read_all(cls, conversations_path: Path = None,
+                 summaries_path: Path = None) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+        """Read every conversation and its summary without changing anything on disk.
+        
+        Unlike creating a FileHistoryStorage, this does not migrate legacy
+        .json files or create the metadata snapshot and search index; it is
+        used to import the files into another backend.
+        
+        Args:
+            conversations_path: Conversations directory (defaults to the standard one)
+            summaries_path: Summaries directory (defaults to the standard one)
+        
+        Yields:
+            (conversation, summary state with 'summary' and 'covered', or None)
+        """
+        conversations_path = Path(conversations_path) if conversations_path else get_conversations_path()
+        summaries_path = Path(summaries_path) if summaries_path else get_summaries_path()
+        
+        for file_path in sorted(conversations_path.iterdir()):
+            conversation_id = file_path.stem
+            try:
+                if file_path.suffix == '.jsonl':
+                    state = cls._scan_log(file_path)
+                    conversation = dict(state['meta'])
+                    conversation['messages'] = state['messages']
+                elif file_path.suffix == '.json' and not file_path.with_suffix('.jsonl').exists():
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        conversation = json.load(f)
+                else:
+                    continue
+            except Exception as e:
+                print(f"Error reading conversation file {file_path}: {e}")
+                continue
+            conversation.setdefault('id', conversation_id)
+            
+            summary_state = None
+            summary_path = summaries_path / f"{conversation_id}.json"
+            if summary_path.exists():
+                try:
+                    with open(summary_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    summary_state = {'summary': data.get('summary', ''), 'covered': data.get('covered') or 0}
+                except Exception as e:
+                    print(f"Error reading summary {conversation_id}: {e}")
+            yield conversation, summary_state
+    
+    def _current_state(self, conversation_id: str) -> Optional[Dict]:
+        """Get the log state, re-scanning only if the file changed behind our back.
+        
+        Must be called with the file lock held.
+        """
+        file_path = self._log_path(conversation_id)
+        try:
+            actual_size = file_path.stat().st_size
+        except FileNotFoundError:
+            self._log_state.pop(conversation_id, None)
+            self._remove_index_entry(conversation_id)
+            return None
+        
+        state = self._log_state.get(conversation_id)
+        if state is not None and state['size'] == actual_size:
+            return state
+        
+        state = self._scan_log(file_path, parse_messages=False)
+        state.pop('messages')
+        if state['size'] != actual_size:
+            # Drop a torn trailing record so appends start on a clean line
+            with open(file_path, 'r+b') as f:
+                f.truncate(state['size'])
+        self._set_state(conversation_id, state)
+        return state
+    
+    def _write_log(self, conversation_id: str, meta: Dict, messages: List[Dict]):
+        """Write a complete, compacted log atomically. Must be called with the file lock held."""
+        file_path = self._log_path(conversation_id)
+        tmp_path = file_path.with_suffix('.jsonl.tmp')
+        offsets = []
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            header = _encode_record('meta', meta)
+            f.write(header)
+            size += len(header)
+            for message in messages:
+                record = _encode_record('message', {'message': message})
+                offsets.append(size)
+                f.write(record)
+                size += len(record)
+        os.replace(tmp_path, file_path)
+        self._set_state(conversation_id, {
+            'meta': dict(meta),
+            'offsets': offsets,
+            'meta_records': 1,
+            'size': size
+        })
+    
+    def _migrate_legacy(self, conversation_id: str) -> Optional[Dict]:
+        """Convert a legacy .json conversation file into a log. Must be called with the file lock held."""
+        legacy_path = self._legacy_path(conversation_id)
+        if not legacy_path.exists():
+            return None
+        
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            conversation = json.load(f)
+        meta, messages = _split_conversation(conversation)
+        self._write_log(conversation_id, meta, messages)
+        legacy_path.unlink()
+        self._index_messages(conversation_id, 0, messages)
+        return conversation
+    
+    def _schedule_compaction(self, conversation_id: str):
+        """Compact a conversation log on a background thread."""
+        with self._compaction_lock:
+            if conversation_id in self._pending_compactions:
+                return
+            self._pending_compactions.add(conversation_id)
+        
+        thread = threading.Thread(target=self._compact, args=(conversation_id,), daemon=True)
+        thread.start()
+    
+    def _compact(self, conversation_id: str):
+        """Rewrite a log as a single header followed by its messages."""
+        file_path = self._log_path(conversation_id)
+        try:
+            with _get_file_lock(file_path):
+                if not file_path.exists():
+                    return
+                state = self._scan_log(file_path)
+                self._write_log(conversation_id, state['meta'], state['messages'])
+        except Exception as e:
+            print(f"Error compacting conversation {conversation_id}: {e}")
+        finally:
+            with self._compaction_lock:
+                self._pending_compactions.discard(conversation_id)
+    
+    def _set_state(self, conversation_id: str, state: Dict):
+        """Record the log state and update the metadata index to match."""
+        self._log_state[conversation_id] = state
+        try:
+            stat = self._log_path(conversation_id).stat()
+        except FileNotFoundError:
+            return
+        meta = state['meta']
+        entry = {
+            'id': meta.get('id', conversation_id),
+            'title': meta.get('title', 'Untitled'),
+            'created_at': meta.get('created_at', ''),
+            'updated_at': meta.get('updated_at', ''),
+            'message_count': len(state['offsets']),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size
+        }
+        with self._index_lock:
+            self._index[conversation_id] = entry
+            self._sorted_listing = None
+        self._mark_index_dirty()
+    
+    def _remove_index_entry(self, conversation_id: str):
+        with self._index_lock:
+            if self._index.pop(conversation_id, None) is None:
+                return
+            self._sorted_listing = None
+        self._mark_index_dirty()
+    
+    def _mark_index_dirty(self):
+        """Schedule a (debounced) write of the index snapshot."""
+        with self._index_lock:
+            self._index_dirty = True
+            if self._snapshot_timer is not None:
+                return
+            self._snapshot_timer = threading.Timer(self.index_snapshot_delay, self.save_index_snapshot)
+            self._snapshot_timer.daemon = True
+            self._snapshot_timer.start()
+    
+    def _load_index_snapshot(self) -> Dict:
+        """Read the sidecar index snapshot, or {} if missing or unreadable."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.INDEX_VERSION:
+                return data.get('entries', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading conversation index snapshot: {e}")
+        return {}
+    
+    def save_index_snapshot(self):
+        """Persist the metadata index if it changed since the last snapshot."""
+        with self._index_lock:
+            self._snapshot_timer = None
+            if not self._index_dirty:
+                return
+            entries = dict(self._index)
+            self._index_dirty = False
+        
+        tmp_path = self.index_path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.INDEX_VERSION, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"Error saving conversation index snapshot: {e}")
+    
+    def refresh_index(self):
+        """Bring the metadata index up to date with the conversations directory.
+        
+        Entries from the snapshot are reused when the file's mtime and size
+        are unchanged; only new or modified logs are re-read. Legacy .json
+        files are migrated on the way.
+        """
+        known = self._index or self._load_index_snapshot()
+        entries = {}
+        changed = False
+        
+        with os.scandir(self.conversations_path) as it:
+            dir_entries = list(it)
+        
+        for dir_entry in dir_entries:
+            if dir_entry.name.endswith('.json') and dir_entry.is_file():
+                conversation_id = dir_entry.name[:-len('.json')]
+                try:
+                    with _get_file_lock(self._log_path(conversation_id)):
+                        self._migrate_legacy(conversation_id)
+                except Exception as e:
+                    print(f"Error migrating conversation file {dir_entry.path}: {e}")
+        
+        for file_path in self.conversations_path.glob('*.jsonl'):
+            conversation_id = file_path.stem
+            try:
+                stat = file_path.stat()
+                entry = known.get(conversation_id)
+                if entry and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+                    entries[conversation_id] = entry
+                    continue
+                
+                state = self._scan_log(file_path, parse_messages=False)
+                meta = state['meta']
+                entries[conversation_id] = {
+                    'id': meta.get('id', conversation_id),
+                    'title': meta.get('title', 'Untitled'),
+                    'created_at': meta.get('created_at', ''),
+                    'updated_at': meta.get('updated_at', ''),
+                    'message_count': len(state['offsets']),
+                    'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size
+                }
+                changed = True
+            except Exception as e:
+                print(f"Error reading conversation file {file_path}: {e}")
+        
+        changed = changed or set(entries) != set(known)
+        with self._index_lock:
+            # Entries written concurrently while we were scanning win
+            for conversation_id, entry in self._index.items():
+                if conversation_id in entries and entry.get('mtime_ns', 0) >= entries[conversation_id].get('mtime_ns', 0):
+                    entries[conversation_id] = entry
+            self._index = entries
+            self._sorted_listing = None
+        if changed:
+            self._mark_index_dirty()
+    
+    def _index_messages(self, conversation_id: str, start: int, messages: List[Dict]):
+        """Update the search index; failures never affect the conversation write."""
+        try:
+            self.search_index.index_messages(conversation_id, start, messages)
+        except Exception as e:
+            print(f"Error updating search index for {conversation_id}: {e}")
+    
+    def _build_search_index(self):
+        """Index conversations that existed before the search index did."""
+        try:
+            with self._index_lock:
+                conversation_ids = list(self._index)
+            for conversation_id in conversation_ids:
+                file_path = self._log_path(conversation_id)
+                with _get_file_lock(file_path):
+                    if not file_path.exists():
+                        continue
+                    messages = self._scan_log(file_path)['messages']
+                    self.search_index.index_messages(conversation_id, 0, messages)
+            self.search_index.mark_built()
+        except Exception as e:
+            print(f"Error building search index: {e}")
+    
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        results, total = self.search_index.search(query, limit, offset)
+        with self._index_lock:
+            for result in results:
+                entry = self._index.get(result['conversation_id'])
+                result['title'] = entry['title'] if entry else 'Untitled'
+        return {'results': results, 'total': total}
+    
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        """Get a conversation by ID.
+        
+        Args:
+            conversation_id: Conversation ID
+        
+        Returns:
+            Conversation dict or None if not found
+        """
+        file_path = self._log_path(conversation_id)
+        try:
+            with _get_file_lock(file_path):
+                if not file_path.exists():
+                    return self._migrate_legacy(conversation_id)
+                
+                state = self._scan_log(file_path)
+                messages = state.pop('messages')
+                self._set_state(conversation_id, state)
+                conversation = dict(state['meta'])
+                conversation['messages'] = messages
+                return conversation
+        except Exception as e:
+            print(f"Error reading conversation {conversation_id}: {e}")
+            return None
+    
+    def save_conversation(self, conversation: Dict, changed_from: int = None):
+        """Save a conversation to disk.
+        
+        Only messages that are not yet in the log are appended, plus a metadata
+        record if the metadata changed. A conversation with fewer messages than
+        the log is rewritten.
+        
+        Args:
+            conversation: Conversation dict with id, title, messages, etc.
+            changed_from: Index of the first message that may have changed in place;
+                the log is cut there and the rest re-appended
+        """
+        conversation_id = conversation.get('id')
+        if not conversation_id:
+            return
+        
+        file_path = self._log_path(conversation_id)
+        meta, messages = _split_conversation(conversation)
+        try:
+            with _get_file_lock(file_path):
+                state = self._current_state(conversation_id)
+                if state is None and self._legacy_path(conversation_id).exists():
+                    self._migrate_legacy(conversation_id)
+                    state = self._current_state(conversation_id)
+                
+                if state is None or len(messages) < len(state['offsets']):
+                    self._write_log(conversation_id, meta, messages)
+                    self._index_messages(conversation_id, 0, messages)
+                    return
+                
+                meta_changed = meta != state['meta']
+                if changed_from is not None and changed_from < len(state['offsets']):
+                    # Cut the log before the first changed message; the metadata is
+                    # re-appended since later meta records are cut with it
+                    cut = state['offsets'][changed_from]
+                    state['meta_records'] -= self._count_meta_records(file_path, cut, state['size'])
+                    with open(file_path, 'r+b') as f:
+                        f.truncate(cut)
+                    del state['offsets'][changed_from:]
+                    state['size'] = cut
+                    meta_changed = True
+                
+                first_new = len(state['offsets'])
+                data = bytearray()
+                new_offsets = []
+                for message in messages[len(state['offsets']):]:
+                    new_offsets.append(state['size'] + len(data))
+                    data += _encode_record('message', {'message': message})
+                if meta_changed:
+                    data += _encode_record('meta', meta)
+                if not data:
+                    return
+                
+                with open(file_path, 'ab') as f:
+                    f.write(data)
+                
+                state['offsets'].extend(new_offsets)
+                state['size'] += len(data)
+                if meta_changed:
+                    state['meta'] = dict(meta)
+                    state['meta_records'] += 1
+                self._set_state(conversation_id, state)
+                if first_new < len(messages):
+                    self._index_messages(conversation_id, first_new, messages[first_new:])
+                needs_compaction = state['meta_records'] > self.compact_threshold
+            
+            if needs_compaction:
+                self._schedule_compaction(conversation_id)
+        except Exception as e:
+            print(f"Error saving conversation {conversation_id}: {e}")
+    
+    def list_conversations(self) -> List[Dict]:
+        """List all conversations from the metadata index.
+        
+        Returns:
+            List of conversation dicts (id, title, updated_at)
+        """
+        with self._index_lock:
+            if self._sorted_listing is None:
+                listing = [{
+                    'id': entry['id'],
+                    'title': entry['title'],
+                    'updated_at': entry['updated_at'],
+                    'created_at': entry['created_at']
+                } for entry in self._index.values()]
+                # Sort by updated_at (most recent first)
+                listing.sort(key=lambda x: x.get('updated_at', ''), reverse=True)
+                self._sorted_listing = listing
+            return [dict(item) for item in self._sorted_listing]
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """Delete a conversation.
+        
+        Args:
+            conversation_id: Conversation ID to delete
+        
+        Returns:
+            bool: True if deleted successfully
+        """
+        file_path = self._log_path(conversation_id)
+        legacy_path = self._legacy_path(conversation_id)
+        summary_path = self.summaries_path / f"{conversation_id}.json"
+        
+        try:
+            with _get_file_lock(file_path):
+                if file_path.exists():
+                    file_path.unlink()
+                if legacy_path.exists():
+                    legacy_path.unlink()
+                self._log_state.pop(conversation_id, None)
+                self._remove_index_entry(conversation_id)
+                self._index_messages(conversation_id, 0, [])
+            if summary_path.exists():
+                summary_path.unlink()
+            return True
+        except Exception as e:
+            print(f"Error deleting conversation {conversation_id}: {e}")
+            return False
+    
+    def get_summary_state(self, conversation_id: str) -> Optional[Dict]:
+        """Get conversation summary and its watermark.
+        
+        Args:
+            conversation_id: Conversation ID
+        
+        Returns:
+            Dict with 'summary' and 'covered' (messages folded in; 0 if unknown) or None
+        """
+        file_path = self.summaries_path / f"{conversation_id}.json"
+        if not file_path.exists():
+            return None
+        
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                return {'summary': data.get('summary', ''), 'covered': data.get('covered') or 0}
+        except Exception as e:
+            print(f"Error reading summary {conversation_id}: {e}")
+            return None
+    
+    def save_summary(self, conversation_id: str, summary: str, covered: int = None):
+        """Save conversation summary.
+        
+        Args:
+            conversation_id: Conversation ID
+            summary: Summary text
+            covered: Number of leading messages the summary covers
+        """
+        file_path = self.summaries_path / f"{conversation_id}.json"
+        data = {'summary': summary, 'conversation_id': conversation_id}
+        if covered is not None:
+            data['covered'] = covered
+        try:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+        except Exception as e:
+            print(f"Error saving summary {conversation_id}: {e}")
+    
+    def truncate_conversation(self, conversation_id: str, message_index: int) -> bool:
+        """Truncate conversation at a specific message index (remove all messages after that index).
+        
+        The log is cut at the byte offset of the first removed message and a
+        fresh metadata record is appended, so nothing is rewritten.
+        
+        Args:
+            conversation_id: Conversation ID
+            message_index: Index of the message to keep (0-based). All messages after this will be removed.
+        
+        Returns:
+            bool: True if truncated successfully
+        """
+        file_path = self._log_path(conversation_id)
+        try:
+            with _get_file_lock(file_path):
+                state = self._current_state(conversation_id)
+                if state is None:
+                    if self._migrate_legacy(conversation_id) is None:
+                        return False
+                    state = self._current_state(conversation_id)
+                
+                offsets = state['offsets']
+                if message_index < 0 or message_index >= len(offsets):
+                    return False
+                
+                cut = offsets[message_index + 1] if message_index + 1 < len(offsets) else state['size']
+                meta = dict(state['meta'])
+                meta['updated_at'] = datetime.now().isoformat()
+                record = _encode_record('meta', meta)
+                state['meta_records'] -= self._count_meta_records(file_path, cut, state['size'])
+                with open(file_path, 'r+b') as f:
+                    f.truncate(cut)
+                    f.seek(cut)
+                    f.write(record)
+                
+                del offsets[message_index + 1:]
+                state['size'] = cut + len(record)
+                state['meta'] = meta
+                state['meta_records'] += 1
+                self._set_state(conversation_id, state)
+                self._index_messages(conversation_id, message_index + 1, [])
+        except Exception as e:
+            print(f"Error truncating conversation {conversation_id}: {e}")
+            return False
+        
+        # Delete summary if exists (since conversation changed)
+        summary_path = self.summaries_path / f"{conversation_id}.json"
+        if summary_path.exists():
+            try:
+                summary_path.unlink()
+            except Exception as e:
+                print(f"Error deleting summary {conversation_id}: {e}")
+        
+        return True
+
+class SQLiteHistoryStorage(HistoryStorage):
+    """Conversation storage backed by a SQLite database in WAL mode."""
+    
+    backend = 'sqlite'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            meta TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at DESC);
+        CREATE TABLE IF NOT EXISTS messages (
+            conversation_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (conversation_id, seq)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS summaries (
+            conversation_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    
+    # Statements are kept as constants so sqlite3's per-connection statement
+    # cache reuses the prepared form on every call
+    SQL_GET_CONVERSATION = "SELECT meta, message_count FROM conversations WHERE id = ?"
+    SQL_GET_MESSAGES = "SELECT data FROM messages WHERE conversation_id = ? ORDER BY seq"
+    SQL_UPSERT_CONVERSATION = """
+        INSERT INTO conversations (id, title, created_at, updated_at, message_count, meta)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET
+            title = excluded.title,
+            created_at = excluded.created_at,
+            updated_at = excluded.updated_at,
+            message_count = excluded.message_count,
+            meta = excluded.meta
+    """
+    SQL_APPEND_MESSAGE = "INSERT OR REPLACE INTO messages (conversation_id, seq, data) VALUES (?, ?, ?)"
+    SQL_TRUNCATE_MESSAGES = "DELETE FROM messages WHERE conversation_id = ? AND seq >= ?"
+    SQL_LIST_CONVERSATIONS = "SELECT id, title, updated_at, created_at FROM conversations ORDER BY updated_at DESC"
+    SQL_DELETE_CONVERSATION = "DELETE FROM conversations WHERE id = ?"
+    SQL_DELETE_SUMMARY = "DELETE FROM summaries WHERE conversation_id = ?"
+    SQL_GET_SUMMARY = "SELECT summary, covered FROM summaries WHERE conversation_id = ?"
+    SQL_SAVE_SUMMARY = "INSERT OR REPLACE INTO summaries (conversation_id, summary, covered) VALUES (?, ?, ?)"
+    
+    def __init__(self, db_path: Path = None):
+        """Initialize SQLite storage.
+        
+        Args:
+            db_path: Database file (defaults to history.db in the data directory)
+        """
+        self.db_path = Path(db_path) if db_path else get_history_db_path()
+        self._local = threading.local()
+        conn = self._connection()
+        with conn:
+            conn.executescript(self.SCHEMA)
+            # Databases created before summary watermarks existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(summaries)")}
+            if 'covered' not in columns:
+                conn.execute("ALTER TABLE summaries ADD COLUMN covered INTEGER NOT NULL DEFAULT 0")
+        # The FTS index lives in the same database so it commits with each write
+        self.search_index = SearchIndex(connection=self._connection)
+        if not self.search_index.is_built():
+            self._build_search_index()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+    
+    def get_conversation(self, conversation_id: str) -> Optional[Dict]:
+        try:
+            conn = self._connection()
+            row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            conversation = json.loads(row[0])
+            conversation['messages'] = [
+                json.loads(data) for (data,) in conn.execute(self.SQL_GET_MESSAGES, (conversation_id,))
+            ]
+            return conversation
+        except Exception as e:
+            print(f"Error reading conversation {conversation_id}: {e}")
+            return None
+    
+    def save_conversation(self, conversation: Dict, changed_from: int = None):
+        conversation_id = conversation.get('id')
+        if not conversation_id:
+            return
+        
+        meta, messages = _split_conversation(conversation)
+        try:
+            conn = self._connection()
+            with conn:
+                # BEGIN IMMEDIATE so the read of message_count and the writes are atomic
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+                stored_count = row[1] if row else 0
+                if len(messages) < stored_count:
+                    conn.execute(self.SQL_TRUNCATE_MESSAGES, (conversation_id, 0))
+                    stored_count = 0
+                elif changed_from is not None:
+                    # Rows from changed_from on are replaced in place
+                    stored_count = min(stored_count, changed_from)
+                conn.executemany(self.SQL_APPEND_MESSAGE, (
+                    (conversation_id, seq, json.dumps(message, ensure_ascii=False))
+                    for seq, message in enumerate(messages[stored_count:], start=stored_count)
+                ))
+                if stored_count < len(messages) or stored_count == 0:
+                    self.search_index.index_messages(conversation_id, stored_count, messages[stored_count:], commit=False)
+                conn.execute(self.SQL_UPSERT_CONVERSATION, (
+                    conversation_id, meta.get('title'), meta.get('created_at', ''),
+                    meta.get('updated_at', ''), len(messages), json.dumps(meta, ensure_ascii=False)
+                ))
+        except Exception as e:
+            print(f"Error saving conversation {conversation_id}: {e}")
+    
+    def list_conversations(self) -> List[Dict]:
+        conversations = []
+        for conversation_id, title, updated_at, created_at in self._connection().execute(self.SQL_LIST_CONVERSATIONS):
+            conversations.append({
+                'id': conversation_id,
+                'title': title or 'Untitled',
+                'updated_at': updated_at or '',
+                'created_at': created_at or ''
+            })
+        return conversations
+    
+    def delete_conversation(self, conversation_id: str) -> bool:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(self.SQL_TRUNCATE_MESSAGES, (conversation_id, 0))
+                conn.execute(self.SQL_DELETE_SUMMARY, (conversation_id,))
+                conn.execute(self.SQL_DELETE_CONVERSATION, (conversation_id,))
+                self.search_index.delete(conversation_id, commit=False)
+            return True
+        except Exception as e:
+            print(f"Error deleting conversation {conversation_id}: {e}")
+            return False
+    
+    def truncate_conversation(self, conversation_id: str, message_index: int) -> bool:
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+                if row is None or message_index < 0 or message_index >= row[1]:
+                    return False
+                
+                meta = json.loads(row[0])
+                meta['updated_at'] = datetime.now().isoformat()
+                conn.execute(self.SQL_TRUNCATE_MESSAGES, (conversation_id, message_index + 1))
+                self.search_index.truncate(conversation_id, message_index + 1, commit=False)
+                conn.execute(self.SQL_UPSERT_CONVERSATION, (
+                    conversation_id, meta.get('title'), meta.get('created_at', ''),
+                    meta['updated_at'], message_index + 1, json.dumps(meta, ensure_ascii=False)
+                ))
+                conn.execute(self.SQL_DELETE_SUMMARY, (conversation_id,))
+            return True
+        except Exception as e:
+            print(f"Error truncating conversation {conversation_id}: {e}")
+            return False
+    
+    def get_summary_state(self, conversation_id: str) -> Optional[Dict]:
+        try:
+            row = self._connection().execute(self.SQL_GET_SUMMARY, (conversation_id,)).fetchone()
+            return {'summary': row[0], 'covered': row[1] or 0} if row else None
+        except Exception as e:
+            print(f"Error reading summary {conversation_id}: {e}")
+            return None
+    
+    def save_summary(self, conversation_id: str, summary: str, covered: int = None):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(self.SQL_SAVE_SUMMARY, (conversation_id, summary, covered or 0))
+        except Exception as e:
+            print(f"Error saving summary {conversation_id}: {e}")
+    
+    def _build_search_index(self):
+        """Index messages stored before the search index existed, in a single statement pass."""
+        if not self.search_index.available:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM messages_fts")
+            conn.execute("DELETE FROM search_rows")
+            conn.execute("""
+                INSERT INTO search_rows (conversation_id, seq, role)
+                SELECT conversation_id, seq, json_extract(data, '$.role') FROM messages
+            """)
+            conn.execute("""
+                INSERT INTO messages_fts (rowid, content)
+                SELECT r.id, coalesce(json_extract(m.data, '$.content'), '')
+                FROM search_rows r
+                JOIN messages m ON m.conversation_id = r.conversation_id AND m.seq = r.seq
+            """)
+            self.search_index.mark_built(commit=False)
+    
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict:
+        results, total = self.search_index.search(query, limit, offset)
+        conn = self._connection()
+        for result in results:
+            row = conn.execute("SELECT title FROM conversations WHERE id = ?", (result['conversation_id'],)).fetchone()
+            result['title'] = (row[0] if row else None) or 'Untitled'
+        return {'results': results, 'total': total}
+    
+    def migrate_from_files(self, conversations_path: Path = None, summaries_path: Path = None) -> int:
+        """Import conversations and summaries from the JSON directories once.
+        
+        The source files are only read (see FileHistoryStorage.read_all) and
+        left in place; a marker in the settings table prevents the import
+        from running again.
+        
+        Args:
+            conversations_path: Conversations directory (defaults to the standard one)
+            summaries_path: Summaries directory (defaults to the standard one)
+        
+        Returns:
+            int: Number of conversations imported (0 if already migrated)
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM settings WHERE key = 'migrated_from_files'").fetchone()
+        if row is not None:
+            return 0
+        
+        imported = 0
+        for conversation, summary_state in FileHistoryStorage.read_all(conversations_path, summaries_path):
+            self.save_conversation(conversation)
+            if summary_state and summary_state['summary']:
+                self.save_summary(conversation['id'], summary_state['summary'], summary_state['covered'])
+            imported += 1
+        
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('migrated_from_files', ?)",
+                (datetime.now().isoformat(),)
+            )
+        if imported:
+            print(f"Migrated {imported} conversations to {self.db_path}")
+        return imported
+
+def create_storage(backend: str = None) -> HistoryStorage:
+    """Create the configured history storage backend.
+    
+    Args:
+        backend: 'file' or 'sqlite' (defaults to HISTORY_BACKEND)
+    
+    Returns:
+        HistoryStorage instance
+    """
+    backend = (backend or HISTORY_BACKEND).lower()
+    if backend == 'sqlite':
+        storage = SQLiteHistoryStorage()
+        storage.migrate_from_files()
+        return storage
+    if backend == 'file':
+        return FileHistoryStorage()
+    raise ValueError(f"Unknown history backend: {backend}")
@@ -0,0 +1,189 @@
+"""In-process metrics in Prometheus text format.
+
+Histograms are split into a fixed number of shards, each with its own
+lock, and an observation only touches the shard of the calling thread, so
+concurrent requests rarely contend. Shards are merged when /api/metrics is
+scraped.
+"""
+import itertools
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Number of independently locked shards per histogram
+SHARDS = 16
+
+# Threads get shards round-robin on first use. Thread idents are not usable
+# for this: on Linux they are page-aligned addresses, all in the same shard.
+_next_shard = itertools.count()
+_thread_shard = threading.local()
+
+def shard_index() -> int:
+    """Get the calling thread's shard index."""
+    try:
+        return _thread_shard.index
+    except AttributeError:
+        _thread_shard.index = next(_next_shard) % SHARDS
+        return _thread_shard.index
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+class Histogram:
+    """Cumulative histogram with optional labels."""
+    
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        """Initialize histogram.
+        
+        Args:
+            name: Metric name
+            documentation: HELP text
+            buckets: Upper bounds, ascending (+Inf is added)
+            labelnames: Label names; observe() takes the values in the same order
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # Each shard: labels -> [count per bucket..., +Inf count, sum, count]
+        self._shards = [({}, threading.Lock()) for _ in range(SHARDS)]
+    
+    def observe(self, value: float, *labels: str):
+        """Record a value."""
+        series, lock = self._shards[shard_index()]
+        with lock:
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    def collect(self) -> Dict[Tuple[str, ...], List]:
+        """Merge the shards into labels -> [bucket counts..., sum, count]."""
+        merged = {}
+        for series, lock in self._shards:
+            with lock:
+                for labels, state in series.items():
+                    total = merged.get(labels)
+                    if total is None:
+                        merged[labels] = list(state)
+                    else:
+                        for i, value in enumerate(state):
+                            total[i] += value
+        return merged
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_number(bound)
+                label_text = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_number(state[-2])}")
+            lines.append(f"{self.name}_count{label_text} {state[-1]}")
+        return lines
+
+class Gauge:
+    """Gauge whose values are read from a callback at scrape time."""
+    
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Dict[Tuple[str, ...], float]],
+                 labelnames: Sequence[str] = ()):
+        """Initialize gauge.
+        
+        Args:
+            name: Metric name
+            documentation: HELP text
+            callback: Returns label values tuple -> value
+            labelnames: Label names
+        """
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            values = {}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}")
+        return lines
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram(name, documentation, buckets, labelnames))
+    
+    def gauge(self, name: str, documentation: str, callback: Callable[[], Dict[Tuple[str, ...], float]],
+              labelnames: Sequence[str] = ()) -> Gauge:
+        """Register a callback gauge (replaces nothing if the name is taken)."""
+        return self._register(Gauge(name, documentation, callback, labelnames))
+    
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    'chat_time_to_first_token_seconds', 'Time from accepting a chat request to its first token (includes queue wait).',
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60), ('model',)
+)
+TOKENS_PER_SECOND = registry.histogram(
+    'chat_tokens_per_second', 'Generation speed reported by Ollama (eval_count / eval_duration).',
+    (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200), ('model',)
+)
+QUEUE_WAIT = registry.histogram(
+    'chat_queue_wait_seconds', 'Time a chat request waited for a scheduler slot.',
+    (0.001, 0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60), ('model',)
+)
+MODEL_LOAD = registry.histogram(
+    'model_load_seconds', 'Model load time reported by Ollama (load_duration).',
+    (0.01, 0.1, 0.5, 1, 2, 5, 10, 20, 60), ('model',)
+)
+HISTORY_READ = registry.histogram(
+    'history_read_seconds', 'Time to read a conversation from storage.',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1), ('backend',)
+)
+HISTORY_WRITE = registry.histogram(
+    'history_write_seconds', 'Time to write a conversation to storage.',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1), ('backend',)
+)
@@ -0,0 +1,237 @@
+"""Static catalog of models in the Ollama library.
+
+The catalog is built once at import: for every known library model it holds
+the category, approximate download size, family and parameter count. Lookups
+for names outside the catalog fall back to estimates from the name.
+"""
+import re
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+# Text models in the library (expanded list of popular Ollama models)
+LIBRARY_TEXT_MODELS = (
+    # Llama models
+    'llama3.2:1b', 'llama3.2:3b', 'llama3.1:8b', 'llama3.1:70b', 
+    'llama3:8b', 'llama3:70b', 'llama2', 'llama2:7b', 'llama2:13b', 'llama2:70b',
+    # Mistral models
+    'mistral:7b', 'mistral:8x7b', 'mistral-nemo:12b', 'mixtral:8x7b', 'mixtral:8x22b',
+    # CodeLlama models
+    'codellama:7b', 'codellama:13b', 'codellama:34b',
+    # Phi models
+    'phi3:mini', 'phi3:medium', 'phi3:14b',
+    # Gemma models
+    'gemma:2b', 'gemma:7b',
+    # Qwen models
+    'qwen2:0.5b', 'qwen2:1.5b', 'qwen2:7b', 'qwen2:72b', 'qwen:7b', 'qwen:14b',
+    # Tiny models
+    'tinyllama:1.1b',
+    # Chat models
+    'neural-chat:7b', 'starling-lm:7b',
+    # Orca models
+    'orca-mini:3b', 'orca-mini:7b',
+    # Vicuna models
+    'vicuna:7b', 'vicuna:13b',
+    # Wizard models
+    'wizardcoder:7b', 'wizardcoder:13b', 'wizard-vicuna:7b', 'wizard-vicuna:13b',
+    # DeepSeek models
+    'deepseek-coder:1.3b', 'deepseek-coder:6.7b', 'deepseek-coder:33b', 'deepseek:7b',
+    # Nous models
+    'nous-hermes:7b', 'nous-hermes:13b',
+    # Falcon models
+    'falcon:7b', 'falcon:40b',
+    # Other models
+    'dolphin-mixtral:8x7b', 'dolphin-llama3:8b',
+    'solar:10.7b',
+    'yi:6b', 'yi:34b',
+    # Additional popular models
+    'openchat:7b', 'openchat:3.5',
+    'zephyr:7b', 'zephyr:14b',
+    'nous-capybara:7b', 'nous-capybara:34b',
+    'airoboros:7b', 'airoboros:13b',
+    'alpaca:7b', 'alpaca:13b',
+    'guanaco:7b', 'guanaco:13b', 'guanaco:33b',
+    'mpt:7b', 'mpt:30b',
+    'starcoder:7b', 'starcoder:15b',
+    'replit-code:3b', 'replit-code:1.5b'
+)
+
+# Image generation models (verified installable models)
+# Note: Flux models may require manual installation - use custom input field
+# Some Flux models may not be available in all regions/versions
+LIBRARY_IMAGE_MODELS = (
+    # X/Z Image models (verified working)
+    'x/z-image-turbo',
+    'x/z-image'
+)
+
+# Model size mapping (approximate sizes in GB)
+KNOWN_SIZES = MappingProxyType({
+    # Tiny models (< 1GB)
+    'tinyllama:1.1b': '0.6 GB',
+    'qwen2:0.5b': '0.4 GB',
+    'llama3.2:1b': '0.7 GB',
+    'phi3:mini': '0.7 GB',
+    'gemma:2b': '1.4 GB',
+    'deepseek-coder:1.3b': '0.8 GB',
+
+    # Small models (1-5GB)
+    'llama3.2:3b': '2.0 GB',
+    'qwen2:1.5b': '1.0 GB',
+    'orca-mini:3b': '2.0 GB',
+    'phi3:medium': '2.3 GB',
+    'mistral:7b': '4.1 GB',
+    'codellama:7b': '3.8 GB',
+    'llama3:8b': '4.7 GB',
+    'llama3.1:8b': '4.7 GB',
+    'gemma:7b': '4.8 GB',
+    'qwen2:7b': '4.4 GB',
+    'neural-chat:7b': '4.1 GB',
+    'starling-lm:7b': '4.1 GB',
+    'vicuna:7b': '4.1 GB',
+    'wizardcoder:7b': '3.8 GB',
+    'deepseek-coder:6.7b': '3.9 GB',
+    'nous-hermes:7b': '4.1 GB',
+    'falcon:7b': '4.0 GB',
+    'yi:6b': '3.6 GB',
+    'solar:10.7b': '6.2 GB',
+    'mistral-nemo:12b': '7.0 GB',
+    'phi3:14b': '8.2 GB',
+    'codellama:13b': '7.3 GB',
+    'vicuna:13b': '7.3 GB',
+    'wizardcoder:13b': '7.3 GB',
+    'deepseek-coder:33b': '18.6 GB',
+    'nous-hermes:13b': '7.3 GB',
+    'codellama:34b': '19.0 GB',
+    'yi:34b': '19.5 GB',
+    'llama3:70b': '40.0 GB',
+    'llama3.1:70b': '40.0 GB',
+    'qwen2:72b': '42.0 GB',
+    'falcon:40b': '22.0 GB',
+    'mistral:8x7b': '26.0 GB',
+    'dolphin-mixtral:8x7b': '26.0 GB',
+
+    # X/Z Image models (verified working)
+    'x/z-image-turbo': '6.0 GB',
+    'x/z-image': '6.0 GB',
+    # Multimodal models (can generate images)
+    'llava': '4.5 GB',
+    'llava:7b': '4.5 GB',
+    'llava:13b': '7.3 GB',
+    'llava:34b': '19.0 GB',
+    'bakllava': '4.5 GB',
+    'moondream': '1.6 GB',
+    'llava-phi3': '2.3 GB',
+    'llava-llama3': '4.7 GB',
+})
+
+# Parameter count in a model name, e.g. "7b", "1.5b", "8x7b", "350m"
+_PARAMETERS_PATTERN = re.compile(r'(?:(\d+)x)?(\d+(?:\.\d+)?)(b|m)')
+_SIZE_PATTERN = re.compile(r'([\d.]+)\s*GB')
+
+class ModelSpec(NamedTuple):
+    """Catalog entry for one model."""
+    name: str
+    category: str  # 'text', 'image' or 'multimodal'
+    size: str  # Approximate download size, e.g. "4.1 GB" or "Unknown"
+    size_bytes: int  # The same in bytes (0 if unknown)
+    family: str  # Name without the tag, e.g. "llama3.2"
+    parameters: Optional[int]  # Parameter count, None if the name does not say
+
+def categorize(model_name: str) -> str:
+    """Categorize a model by type.
+    
+    Returns:
+        Category string: 'text', 'image', or 'multimodal'
+    """
+    name_lower = model_name.lower()
+    
+    # Image generation models
+    if any(img in name_lower for img in ['x/z-image', 'image-turbo']):
+        return 'image'
+    # Flux models - check for namespace format (may need manual installation)
+    if 'flux' in name_lower and ('black-forest-labs' in name_lower or '/' in name_lower):
+        return 'image'
+    
+    # Multimodal models (can do both text and images)
+    if any(multi in name_lower for multi in ['llava', 'bakllava', 'moondream', 'cogvlm', 'minicpm-v']):
+        return 'multimodal'
+    
+    # Default to text
+    return 'text'
+
+def parameter_count(model_name: str) -> Optional[int]:
+    """Get the parameter count from a model name (e.g. 'mixtral:8x7b' -> 56e9), or None."""
+    match = _PARAMETERS_PATTERN.search(model_name.lower())
+    if not match:
+        return None
+    experts = int(match.group(1)) if match.group(1) else 1
+    scale = 1e9 if match.group(3) == 'b' else 1e6
+    return int(experts * float(match.group(2)) * scale)
+
+def estimate_size(model_name: str) -> str:
+    """Get the approximate download size for a model.
+    
+    Known models use KNOWN_SIZES; others are estimated from the parameter
+    count in the name (e.g. "7b" = ~4GB, "13b" = ~7GB, "70b" = ~40GB).
+    
+    Returns:
+        Size string like "1.2 GB" or "Unknown"
+    """
+    if model_name in KNOWN_SIZES:
+        return KNOWN_SIZES[model_name]
+    
+    size_match = _PARAMETERS_PATTERN.search(model_name.lower())
+    if size_match:
+        size_num = float(size_match.group(2))
+        unit = size_match.group(3)
+        
+        if unit == 'm':  # Millions
+            if size_num < 2:
+                return f'{size_num * 0.4:.1f} GB'
+            elif size_num < 10:
+                return f'{size_num * 0.6:.1f} GB'
+            else:
+                return f'{size_num * 0.7:.1f} GB'
+        elif unit == 'b':  # Billions
+            if size_num <= 1:
+                return f'{size_num * 0.6:.1f} GB'
+            elif size_num <= 3:
+                return f'{size_num * 0.7:.1f} GB'
+            elif size_num <= 8:
+                return f'{size_num * 0.6:.1f} GB'
+            elif size_num <= 14:
+                return f'{size_num * 0.55:.1f} GB'
+            elif size_num <= 35:
+                return f'{size_num * 0.57:.1f} GB'
+            elif size_num <= 45:
+                return f'{size_num * 0.58:.1f} GB'
+            else:
+                return f'{size_num * 0.6:.1f} GB'
+    
+    return 'Unknown'
+
+def size_to_bytes(size: str) -> int:
+    """Convert a size string like "4.1 GB" to bytes (0 if unknown)."""
+    match = _SIZE_PATTERN.match(size)
+    return int(float(match.group(1)) * 1024 ** 3) if match else 0
+
+def describe(model_name: str) -> ModelSpec:
+    """Build the catalog entry for a model name."""
+    size = estimate_size(model_name)
+    return ModelSpec(
+        name=model_name,
+        category=categorize(model_name),
+        size=size,
+        size_bytes=size_to_bytes(size),
+        family=model_name.split(':')[0],
+        parameters=parameter_count(model_name)
+    )
+
+def lookup(model_name: str) -> ModelSpec:
+    """Get a model's catalog entry, describing names outside the catalog on the fly."""
+    return CATALOG.get(model_name) or describe(model_name)
+
+# name -> ModelSpec for every library model, sorted by name
+CATALOG = MappingProxyType({
+    name: describe(name) for name in sorted(set(LIBRARY_TEXT_MODELS) | set(LIBRARY_IMAGE_MODELS))
+})
@@ -1,6 +1,30 @@
-"""Model selection and management."""
-from typing import List, Dict
+"""Model selection and management.
+
+The installed model list (Ollama's ``/api/tags``) is cached:
+
+- for MODEL_LIST_TTL seconds; after that the stale list is still returned
+  while one background thread refreshes it
+- concurrent callers share a single in-flight request
+- when Ollama cannot be reached the last good list is kept, and no new
+  request is made for a backoff delay doubling from MODEL_LIST_RETRY_MIN
+  up to MODEL_LIST_RETRY_MAX seconds
+- invalidate() (called after installing or deleting a model) makes the next
+  call fetch the list again
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, List, Dict, NamedTuple
+from config import MODEL_LIST_TTL, MODEL_LIST_RETRY_MIN, MODEL_LIST_RETRY_MAX
 from utils.ollama_client import OllamaClient
+from utils.model_catalog import CATALOG, lookup
+
+class ModelsSnapshot(NamedTuple):
+    """Serialized /api/models payload for one state of the installed models."""
+    version: int  # Incremented whenever the installed models change
+    etag: str  # Entity tag of body
+    body: bytes  # JSON payload
 
 class ModelManager:
     """Manage Ollama models."""
@@ -26,30 +50,200 @@ class ModelManager:
         'moondream'
     ]
     
-    def __init__(self):
-        """Initialize model manager."""
-        self.client = OllamaClient()
-        self._cached_models = None
+    def __init__(self, client: OllamaClient = None):
+        """Initialize model manager.
+        
+        Args:
+            client: Ollama client (defaults to one for OLLAMA_BASE_URL)
+        """
+        self.client = client or OllamaClient()
+        self.list_ttl = MODEL_LIST_TTL
+        self.retry_min = MODEL_LIST_RETRY_MIN
+        self.retry_max = MODEL_LIST_RETRY_MAX
+        
+        self._cached_models = None  # Last good /api/tags result (None = never fetched)
+        self._models_by_name = {}  # name -> entry of _cached_models
+        self._fetched_at = 0.0  # When _cached_models was fetched (monotonic)
+        self._invalidated = False  # Set by invalidate(): fetch before serving _cached_models again
+        self._fetching = None  # Event set when the in-flight fetch ends
+        self._retry_at = 0.0  # No fetches before this after a failure (monotonic)
+        self._retry_delay = 0.0
+        self._last_error = None
+        self._models_lock = threading.Lock()
+        self._stats = {'fetches': 0, 'errors': 0, 'hits': 0, 'stale_hits': 0, 'shared_fetches': 0, 'invalidations': 0}
+        self._snapshot = None
+        self._snapshot_key = None  # Installed models the snapshot was built from
+        self._snapshot_version = 0
+        self._snapshot_lock = threading.Lock()
+        self._error_listeners = []
+    
+    def add_error_listener(self, callback: Callable[[Exception], None]):
+        """Call callback(error) when fetching the installed models fails (e.g. to check on Ollama sooner)."""
+        self._error_listeners.append(callback)
+    
+    def _notify_error(self, error: Exception):
+        for listener in list(self._error_listeners):
+            try:
+                listener(error)
+            except Exception as e:
+                print(f"Error in error listener: {e}")
     
     def get_available_models(self, refresh: bool = False) -> List[Dict]:
         """Get list of available models.
         
         Args:
-            refresh: Force refresh from Ollama API
+            refresh: Fetch from the Ollama API now instead of using the cache
             
         Returns:
-            List of model dictionaries
+            List of model dictionaries (empty if Ollama was never reachable)
         """
-        if self._cached_models and not refresh:
-            return self._cached_models
+        with self._models_lock:
+            now = time.monotonic()
+            models = self._cached_models
+            serve_stale = models is not None and not refresh and not self._invalidated
+            if not refresh:
+                if serve_stale and now - self._fetched_at < self.list_ttl:
+                    self._stats['hits'] += 1
+                    return models
+                if now < self._retry_at:
+                    # Ollama failed recently: don't retry until the backoff delay has passed
+                    self._stats['stale_hits'] += 1
+                    return models or []
+            fetching = self._fetching
+            started = fetching is None
+            if started:
+                fetching = self._fetching = threading.Event()
+            else:
+                self._stats['shared_fetches'] += 1
+            if serve_stale:
+                self._stats['stale_hits'] += 1
         
+        if serve_stale:
+            # Serve the stale list; it is refreshed in the background
+            if started:
+                threading.Thread(target=self._fetch, args=(fetching,), daemon=True).start()
+            return models
+        
+        if started:
+            self._fetch(fetching)
+        else:
+            fetching.wait()
+        with self._models_lock:
+            # If the fetch failed this is the last good list
+            return self._cached_models or []
+    
+    def _fetch(self, fetching: threading.Event):
+        """Fetch the installed models into the cache, then set fetching."""
         try:
             models = self.client.list_models()
-            self._cached_models = models
-            return models
+            error = None
         except Exception as e:
-            print(f"Error fetching models: {e}")
-            return []
+            models = None
+            error = e
+        
+        with self._models_lock:
+            current = self._fetching is fetching  # False if invalidate() ran meanwhile
+            if current:
+                self._fetching = None
+            if error is None:
+                self._stats['fetches'] += 1
+                self._retry_delay = 0.0
+                self._retry_at = 0.0
+                self._last_error = None
+                if current:
+                    self._cached_models = models
+                    self._models_by_name = {m.get('name'): m for m in models}
+                    self._fetched_at = time.monotonic()
+                    self._invalidated = False
+            else:
+                self._stats['errors'] += 1
+                self._retry_delay = min(self.retry_max, max(self.retry_min, self._retry_delay * 2))
+                self._retry_at = time.monotonic() + self._retry_delay
+                self._last_error = str(error)
+        fetching.set()
+        if error is not None:
+            print(f"Error fetching models: {error}")
+            self._notify_error(error)
+    
+    def invalidate(self):
+        """Mark the cached model list out of date, e.g. after installing or deleting a model.
+        
+        The next call waits for a new fetch (without waiting out an error
+        backoff) instead of getting the cached list; the cached list is only
+        returned again if that fetch fails. A fetch already in flight may have
+        started before the change, so its result is discarded.
+        """
+        with self._models_lock:
+            self._invalidated = True
+            self._fetching = None
+            self._retry_delay = 0.0
+            self._retry_at = 0.0
+            self._stats['invalidations'] += 1
+    
+    def cache_stats(self) -> Dict:
+        """Get model list cache counters.
+        
+        Returns:
+            Dict with fetches, errors, hits, stale_hits, shared_fetches, invalidations
+            and the current cache state
+        """
+        with self._models_lock:
+            stats = dict(self._stats)
+            now = time.monotonic()
+            stats['cached'] = self._cached_models is not None
+            stats['invalidated'] = self._invalidated
+            stats['models'] = len(self._models_by_name)
+            stats['age_seconds'] = round(now - self._fetched_at, 1) if self._cached_models is not None else None
+            stats['fetching'] = self._fetching is not None
+            stats['retry_in_seconds'] = round(max(0.0, self._retry_at - now), 1)
+            stats['last_error'] = self._last_error
+        return stats
+    
+    def get_models_snapshot(self, refresh: bool = False) -> ModelsSnapshot:
+        """Get the installed models merged with the catalog, serialized once per change.
+        
+        Args:
+            refresh: Force refresh of the installed models from Ollama
+            
+        Returns:
+            ModelsSnapshot: Reused until the installed models change
+        """
+        installed_models = self.get_available_models(refresh=refresh)
+        key = tuple(
+            (m.get('name'), m.get('digest'), m.get('size'), m.get('modified_at')) for m in installed_models
+        )
+        with self._snapshot_lock:
+            if self._snapshot is not None and key == self._snapshot_key:
+                return self._snapshot
+            
+            installed_names = {m.get('name') for m in installed_models}
+            all_models = [
+                {
+                    'name': spec.name,
+                    'installed': spec.name in installed_names,
+                    'category': spec.category,
+                    'size': spec.size,
+                    'size_bytes': spec.size_bytes,
+                    'family': spec.family,
+                    'parameters': spec.parameters,
+                    'verified': True  # All models in the catalog are verified
+                }
+                for spec in CATALOG.values()
+            ]
+            self._snapshot_version += 1
+            body = json.dumps({
+                'success': True,
+                'version': self._snapshot_version,
+                'models': installed_models,  # Currently installed models
+                'all_models': all_models,  # All available models from library
+                'popular_models': self.get_popular_models(),
+                'total_installed': len(installed_models),
+                'total_available': len(all_models)
+            }).encode('utf-8')
+            etag = f"models-{self._snapshot_version}-{hashlib.sha1(body).hexdigest()[:16]}"
+            self._snapshot = ModelsSnapshot(self._snapshot_version, etag, body)
+            self._snapshot_key = key
+            return self._snapshot
     
     def get_popular_models(self) -> List[str]:
         """Get list of popular models.
@@ -63,79 +257,12 @@ class ModelManager:
         """Get all available models from Ollama library (not just installed).
         
         This would require querying Ollama's model library API if available.
-        For now, returns a comprehensive list of known models.
+        For now, returns the names in the static model catalog.
         
         Returns:
             List of all known model names
         """
-        # Comprehensive list of Ollama models including image generation
-        all_models = set()
-        
-        # Text models (expanded list of popular Ollama models)
-        text_models = [
-            # Llama models
-            'llama3.2:1b', 'llama3.2:3b', 'llama3.1:8b', 'llama3.1:70b', 
-            'llama3:8b', 'llama3:70b', 'llama2', 'llama2:7b', 'llama2:13b', 'llama2:70b',
-            # Mistral models
-            'mistral:7b', 'mistral:8x7b', 'mistral-nemo:12b', 'mixtral:8x7b', 'mixtral:8x22b',
-            # CodeLlama models
-            'codellama:7b', 'codellama:13b', 'codellama:34b',
-            # Phi models
-            'phi3:mini', 'phi3:medium', 'phi3:14b',
-            # Gemma models
-            'gemma:2b', 'gemma:7b',
-            # Qwen models
-            'qwen2:0.5b', 'qwen2:1.5b', 'qwen2:7b', 'qwen2:72b', 'qwen:7b', 'qwen:14b',
-            # Tiny models
-            'tinyllama:1.1b',
-            # Chat models
-            'neural-chat:7b', 'starling-lm:7b',
-            # Orca models
-            'orca-mini:3b', 'orca-mini:7b',
-            # Vicuna models
-            'vicuna:7b', 'vicuna:13b',
-            # Wizard models
-            'wizardcoder:7b', 'wizardcoder:13b', 'wizard-vicuna:7b', 'wizard-vicuna:13b',
-            # DeepSeek models
-            'deepseek-coder:1.3b', 'deepseek-coder:6.7b', 'deepseek-coder:33b', 'deepseek:7b',
-            # Nous models
-            'nous-hermes:7b', 'nous-hermes:13b',
-            # Falcon models
-            'falcon:7b', 'falcon:40b',
-            # Other models
-            'dolphin-mixtral:8x7b', 'dolphin-llama3:8b',
-            'solar:10.7b',
-            'yi:6b', 'yi:34b',
-            # Additional popular models
-            'openchat:7b', 'openchat:3.5',
-            'zephyr:7b', 'zephyr:14b',
-            'nous-capybara:7b', 'nous-capybara:34b',
-            'airoboros:7b', 'airoboros:13b',
-            'alpaca:7b', 'alpaca:13b',
-            'guanaco:7b', 'guanaco:13b', 'guanaco:33b',
-            'mpt:7b', 'mpt:30b',
-            'starcoder:7b', 'starcoder:15b',
-            'replit-code:3b', 'replit-code:1.5b'
-        ]
-        
-        # Image generation models (verified installable models)
-        # Note: Flux models may require manual installation - use custom input field
-        # Some Flux models may not be available in all regions/versions
-        image_models = [
-            # X/Z Image models (verified working)
-            'x/z-image-turbo',
-            'x/z-image'
-        ]
-        
-        # Multimodal models
-        multimodal_models = [
-            'llava', 'bakllava', 'moondream', 'llava-phi3', 'llava-llama3'
-        ]
-        
-        all_models.update(text_models)
-        all_models.update(image_models)
-        
-        return sorted(list(all_models))
+        return list(CATALOG)
     
     def get_model_size(self, model_name: str) -> str:
         """Get approximate download size for a model.
@@ -146,103 +273,21 @@ class ModelManager:
         Returns:
             Size string like "1.2 GB" or "Unknown"
         """
-        name_lower = model_name.lower()
-        
-        # Model size mapping (approximate sizes in GB)
-        size_map = {
-            # Tiny models (< 1GB)
-            'tinyllama:1.1b': '0.6 GB',
-            'qwen2:0.5b': '0.4 GB',
-            'llama3.2:1b': '0.7 GB',
-            'phi3:mini': '0.7 GB',
-            'gemma:2b': '1.4 GB',
-            'deepseek-coder:1.3b': '0.8 GB',
-            
-            # Small models (1-5GB)
-            'llama3.2:3b': '2.0 GB',
-            'qwen2:1.5b': '1.0 GB',
-            'orca-mini:3b': '2.0 GB',
-            'phi3:medium': '2.3 GB',
-            'mistral:7b': '4.1 GB',
-            'codellama:7b': '3.8 GB',
-            'llama3:8b': '4.7 GB',
-            'llama3.1:8b': '4.7 GB',
-            'gemma:7b': '4.8 GB',
-            'qwen2:7b': '4.4 GB',
-            'neural-chat:7b': '4.1 GB',
-            'starling-lm:7b': '4.1 GB',
-            'vicuna:7b': '4.1 GB',
-            'wizardcoder:7b': '3.8 GB',
-            'deepseek-coder:6.7b': '3.9 GB',
-            'nous-hermes:7b': '4.1 GB',
-            'falcon:7b': '4.0 GB',
-            'yi:6b': '3.6 GB',
-            'solar:10.7b': '6.2 GB',
-            'mistral-nemo:12b': '7.0 GB',
-            'phi3:14b': '8.2 GB',
-            'codellama:13b': '7.3 GB',
-            'vicuna:13b': '7.3 GB',
-            'wizardcoder:13b': '7.3 GB',
-            'deepseek-coder:33b': '18.6 GB',
-            'nous-hermes:13b': '7.3 GB',
-            'codellama:34b': '19.0 GB',
-            'yi:34b': '19.5 GB',
-            'llama3:70b': '40.0 GB',
-            'llama3.1:70b': '40.0 GB',
-            'qwen2:72b': '42.0 GB',
-            'falcon:40b': '22.0 GB',
-            'mistral:8x7b': '26.0 GB',
-            'dolphin-mixtral:8x7b': '26.0 GB',
-            
-            # X/Z Image models (verified working)
-            'x/z-image-turbo': '6.0 GB',
-            'x/z-image': '6.0 GB',
-            # Multimodal models (can generate images)
-            'llava': '4.5 GB',
-            'llava:7b': '4.5 GB',
-            'llava:13b': '7.3 GB',
-            'llava:34b': '19.0 GB',
-            'bakllava': '4.5 GB',
-            'moondream': '1.6 GB',
-            'llava-phi3': '2.3 GB',
-            'llava-llama3': '4.7 GB',
-        }
-        
-        # Check exact match first
-        if model_name in size_map:
-            return size_map[model_name]
+        return lookup(model_name).size
+    
+    def get_model_bytes(self, model_name: str) -> int:
+        """Get a model's size in bytes: the installed size if known, else the estimate.
         
-        # Try to extract size from model name (e.g., "7b" = ~4GB, "13b" = ~7GB, "70b" = ~40GB)
-        import re
-        size_match = re.search(r'(\d+(?:\.\d+)?)(b|m)', name_lower)
-        if size_match:
-            size_num = float(size_match.group(1))
-            unit = size_match.group(2)
+        Args:
+            model_name: Model name
             
-            if unit == 'm':  # Millions
-                if size_num < 2:
-                    return f'{size_num * 0.4:.1f} GB'
-                elif size_num < 10:
-                    return f'{size_num * 0.6:.1f} GB'
-                else:
-                    return f'{size_num * 0.7:.1f} GB'
-            elif unit == 'b':  # Billions
-                if size_num <= 1:
-                    return f'{size_num * 0.6:.1f} GB'
-                elif size_num <= 3:
-                    return f'{size_num * 0.7:.1f} GB'
-                elif size_num <= 8:
-                    return f'{size_num * 0.6:.1f} GB'
-                elif size_num <= 14:
-                    return f'{size_num * 0.55:.1f} GB'
-                elif size_num <= 35:
-                    return f'{size_num * 0.57:.1f} GB'
-                elif size_num <= 45:
-                    return f'{size_num * 0.58:.1f} GB'
-                else:
-                    return f'{size_num * 0.6:.1f} GB'
-        
-        return 'Unknown'
+        Returns:
+            int: Size in bytes (0 if unknown)
+        """
+        installed = self.get_model_info(model_name).get('size')
+        if installed:
+            return int(installed)
+        return lookup(model_name).size_bytes
     
     def categorize_model(self, model_name: str) -> str:
         """Categorize a model by type.
@@ -251,23 +296,9 @@ class ModelManager:
             model_name: Model name
             
         Returns:
-            Category string: 'text', 'image', 'multimodal', or 'unknown'
+            Category string: 'text', 'image', or 'multimodal'
         """
-        name_lower = model_name.lower()
-        
-        # Image generation models
-        if any(img in name_lower for img in ['x/z-image', 'image-turbo']):
-            return 'image'
-        # Flux models - check for namespace format (may need manual installation)
-        if 'flux' in name_lower and ('black-forest-labs' in name_lower or '/' in name_lower):
-            return 'image'
-        
-        # Multimodal models (can do both text and images)
-        if any(multi in name_lower for multi in ['llava', 'bakllava', 'moondream', 'cogvlm', 'minicpm-v']):
-            return 'multimodal'
-        
-        # Default to text
-        return 'text'
+        return lookup(model_name).category
     
     def is_model_installed(self, model_name: str) -> bool:
         """Check if a model is installed.
@@ -278,9 +309,8 @@ class ModelManager:
         Returns:
             bool: True if model is installed
         """
-        models = self.get_available_models()
-        model_names = [m.get('name', '') for m in models]
-        return model_name in model_names
+        self.get_available_models()
+        return model_name in self._models_by_name
     
     def get_model_info(self, model_name: str) -> Dict:
         """Get information about a model.
@@ -291,8 +321,5 @@ class ModelManager:
         Returns:
             Model info dict
         """
-        models = self.get_available_models()
-        for model in models:
-            if model.get('name') == model_name:
-                return model
-        return {}
+        self.get_available_models()
+        return self._models_by_name.get(model_name, {})
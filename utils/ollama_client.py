@@ -1,32 +1,182 @@
 """Ollama API client for chat and model management."""
 import requests
+import codecs
 import json
+import socket
+import threading
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Optional, Generator
-from config import OLLAMA_BASE_URL, OLLAMA_TIMEOUT, OLLAMA_STREAM_READ_TIMEOUT
+from config import (
+    OLLAMA_BASE_URL, OLLAMA_TIMEOUT, OLLAMA_STREAM_READ_TIMEOUT, OLLAMA_POOL_SIZE,
+    OLLAMA_CONNECT_TIMEOUT, OLLAMA_LIST_TIMEOUT, OLLAMA_HEALTH_TIMEOUT
+)
+from utils.tracing import NULL_TRACE
+
+# Timing and token counts reported in Ollama's final chunk
+STAT_FIELDS = (
+    'total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration', 'eval_count', 'eval_duration'
+)
+
+# One keep-alive session per (base_url, pool_size), shared by every client instance
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(base_url: str, pool_size: int = None) -> requests.Session:
+    """Get the shared pooled HTTP session for an Ollama server.
+    
+    Args:
+        base_url: Ollama base URL
+        pool_size: Maximum number of kept-alive connections (defaults to config value)
+        
+    Returns:
+        requests.Session with a sized connection pool
+    """
+    pool_size = pool_size or OLLAMA_POOL_SIZE
+    key = (base_url, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # pool_block=False: extra concurrent requests still go through,
+            # they just aren't kept alive once the pool is full
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
+def iter_stream_lines(response: requests.Response, chunk_size: int = 8192) -> Generator[str, None, None]:
+    """Yield decoded lines from a streamed response as soon as they arrive.
+    
+    Unlike ``iter_lines``, this never waits for a full read buffer: each read
+    returns whatever bytes are already available, and UTF-8 is decoded
+    incrementally so a multibyte character split across reads stays intact.
+    
+    Args:
+        response: Streamed requests response
+        chunk_size: Maximum bytes per read
+        
+    Yields:
+        str: Non-empty lines without the trailing newline
+    """
+    raw = response.raw
+    read1 = getattr(raw, 'read1', None)
+    if read1 is not None:
+        def chunks():
+            while True:
+                chunk = read1(chunk_size, decode_content=True)
+                if not chunk:
+                    return
+                yield chunk
+        source = chunks()
+    else:
+        # Older urllib3: chunk_size=None yields each transfer chunk as it arrives
+        source = response.iter_content(chunk_size=None)
+    
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ''
+    for chunk in source:
+        pending += decoder.decode(chunk)
+        if '\n' not in pending:
+            continue
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+    pending += decoder.decode(b'', final=True)
+    if pending.strip():
+        yield pending.strip()
+
+class RequestCancelled(Exception):
+    """Raised by a streaming call after its CancelToken was cancelled."""
+
+def _abort_response(response: requests.Response):
+    """Close a streamed response's connection immediately, even while another thread reads it.
+    
+    Shutting the socket down wakes a blocked read and tells Ollama the client
+    is gone, so it stops generating. The connection is discarded, not pooled.
+    """
+    raw = response.raw
+    connection = getattr(raw, '_connection', None) or getattr(raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+class CancelToken:
+    """Lets another thread abort an in-flight streaming request."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._response = None
+        self.cancelled = False
+    
+    def cancel(self):
+        """Cancel the request, closing its upstream connection if it is open."""
+        with self._lock:
+            self.cancelled = True
+            response = self._response
+        if response is not None:
+            _abort_response(response)
+    
+    def attach(self, response: requests.Response) -> bool:
+        """Register the response to abort on cancel.
+        
+        Returns:
+            bool: False if the token was already cancelled
+        """
+        with self._lock:
+            self._response = response
+            return not self.cancelled
 
 class OllamaClient:
     """Client for interacting with Ollama API."""
     
-    def __init__(self, base_url: str = None):
+    def __init__(self, base_url: str = None, pool_size: int = None):
         """Initialize Ollama client.
         
         Args:
             base_url: Ollama base URL (defaults to config value)
+            pool_size: Connection pool size (defaults to config value)
         """
         self.base_url = base_url or OLLAMA_BASE_URL
+        self.session = get_session(self.base_url, pool_size)
         self.timeout = OLLAMA_TIMEOUT
         self.stream_read_timeout = OLLAMA_STREAM_READ_TIMEOUT
+        # (connect, read) timeouts for each kind of call
+        self.chat_stream_timeout = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_STREAM_READ_TIMEOUT)
+        self.chat_timeout = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)
+        self.list_timeout = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_LIST_TIMEOUT)
+        self.pull_timeout = (OLLAMA_CONNECT_TIMEOUT, None)  # No read timeout for model downloads
+        self.delete_timeout = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)
+        self.health_timeout = (min(OLLAMA_CONNECT_TIMEOUT, OLLAMA_HEALTH_TIMEOUT), OLLAMA_HEALTH_TIMEOUT)
     
-    def chat(self, model: str, messages: List[Dict], stream: bool = True) -> Generator[str, None, None]:
+    def chat(self, model: str, messages: List[Dict], stream: bool = True,
+             options: Optional[Dict] = None, cancel: CancelToken = None,
+             keep_alive: Optional[int] = None, stats: Optional[Dict] = None,
+             trace=NULL_TRACE) -> Generator[str, None, None]:
         """Send chat message to Ollama and stream response.
         
         Args:
             model: Model name to use
             messages: List of message dicts with 'role' and 'content'
             stream: Whether to stream the response
+            options: Ollama model options (e.g. num_ctx)
+            cancel: Token that aborts the request from another thread
+            keep_alive: Seconds Ollama keeps the model loaded afterwards (None = server default)
+            stats: Dict to fill with the STAT_FIELDS of Ollama's final chunk
+            trace: Trace that gets a 'connect' span (until Ollama's response headers arrive)
             
         Yields:
             str: Response chunks
+            
+        Raises:
+            RequestCancelled: If cancel was cancelled before the reply completed
         """
         url = f"{self.base_url}/api/chat"
         payload = {
@@ -34,31 +184,38 @@ class OllamaClient:
             "messages": messages,
             "stream": stream
         }
+        if options:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
         
+        response = None
         try:
-            # For streaming, use longer timeout and handle read timeout per chunk
-            # Connection timeout: 30s, Read timeout: stream_read_timeout (for each chunk)
-            if stream:
-                timeout = (30, self.stream_read_timeout)
-            else:
-                timeout = self.timeout
+            # For streaming, the read timeout applies to each chunk
+            timeout = self.chat_stream_timeout if stream else self.chat_timeout
             
-            response = requests.post(
-                url,
-                json=payload,
-                stream=stream,
-                timeout=timeout
-            )
+            with trace.span('connect'):
+                response = self.session.post(
+                    url,
+                    json=payload,
+                    stream=stream,
+                    timeout=timeout
+                )
+            if cancel is not None and not cancel.attach(response):
+                _abort_response(response)
+                raise RequestCancelled("Request cancelled")
             response.raise_for_status()
             
             if stream:
-                for line in response.iter_lines(decode_unicode=True, chunk_size=8192):
+                for line in iter_stream_lines(response):
                     if line:
                         try:
                             data = json.loads(line)
                             if 'message' in data and 'content' in data['message']:
                                 yield data['message']['content']
                             if data.get('done', False):
+                                if stats is not None:
+                                    stats.update((k, data[k]) for k in STAT_FIELDS if k in data)
                                 break
                             # Check for errors in stream
                             if 'error' in data:
@@ -67,8 +224,28 @@ class OllamaClient:
                             continue
             else:
                 data = response.json()
+                if stats is not None:
+                    stats.update((k, data[k]) for k in STAT_FIELDS if k in data)
                 if 'message' in data and 'content' in data['message']:
                     yield data['message']['content']
+            if cancel is not None and cancel.cancelled:
+                # The aborted stream can end like a normal one
+                raise RequestCancelled("Request cancelled")
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if cancel is not None and cancel.cancelled:
+                raise RequestCancelled("Request cancelled") from e
+            self._raise_chat_error(e, stream)
+        finally:
+            # Return the connection to the pool (or drop it if the stream was abandoned early)
+            if response is not None:
+                response.close()
+    
+    def _raise_chat_error(self, e: Exception, stream: bool):
+        """Re-raise a chat failure with a user-facing message."""
+        try:
+            raise e
         except requests.exceptions.Timeout as e:
             if stream:
                 raise Exception(f"Ollama request timed out. The model may be taking too long to respond. Try:\n- Using a smaller/faster model\n- Reducing the context length\n- Checking if Ollama is running properly\n\nOriginal error: {str(e)}")
@@ -95,32 +272,78 @@ class OllamaClient:
         """
         url = f"{self.base_url}/api/tags"
         try:
-            response = requests.get(url, timeout=self.timeout)
+            response = self.session.get(url, timeout=self.list_timeout)
             response.raise_for_status()
             data = response.json()
             return data.get('models', [])
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to fetch models: {str(e)}")
     
-    def pull_model(self, model: str) -> Generator[Dict, None, None]:
+    def list_running(self) -> List[Dict]:
+        """Get the models Ollama currently has loaded (/api/ps).
+        
+        Returns:
+            List of model dictionaries (name, size, size_vram, expires_at, ...)
+        """
+        url = f"{self.base_url}/api/ps"
+        try:
+            response = self.session.get(url, timeout=self.health_timeout)
+            response.raise_for_status()
+            return response.json().get('models', [])
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to fetch running models: {str(e)}")
+    
+    def set_keep_alive(self, model: str, keep_alive: int):
+        """Load a model, or change how long it stays loaded, without generating.
+        
+        Args:
+            model: Model name
+            keep_alive: Seconds to keep the model loaded (0 unloads it now)
+        """
+        url = f"{self.base_url}/api/generate"
+        payload = {"model": model, "keep_alive": keep_alive}
+        try:
+            # Loading a model can take as long as a reply
+            response = self.session.post(url, json=payload, timeout=self.chat_timeout)
+            response.raise_for_status()
+            response.close()
+        except requests.exceptions.RequestException as e:
+            error_msg = str(e)
+            if hasattr(e, 'response') and e.response is not None:
+                try:
+                    error_data = e.response.json()
+                    error_msg = error_data.get('error', error_msg)
+                except:
+                    pass
+            raise Exception(f"Failed to load model: {error_msg}")
+    
+    def pull_model(self, model: str, cancel: CancelToken = None) -> Generator[Dict, None, None]:
         """Pull/download an Ollama model.
         
         Args:
             model: Model name to pull
+            cancel: Token that aborts the download from another thread
             
         Yields:
             Dict: Progress updates
+            
+        Raises:
+            RequestCancelled: If cancel was cancelled before the download completed
         """
         url = f"{self.base_url}/api/pull"
         payload = {"name": model}
         
+        response = None
         try:
-            response = requests.post(
+            response = self.session.post(
                 url,
                 json=payload,
                 stream=True,
-                timeout=None  # No timeout for model downloads
+                timeout=self.pull_timeout
             )
+            if cancel is not None and not cancel.attach(response):
+                _abort_response(response)
+                raise RequestCancelled("Download cancelled")
             
             # Check for HTTP errors
             if response.status_code != 200:
@@ -134,7 +357,7 @@ class OllamaClient:
             
             response.raise_for_status()
             
-            for line in response.iter_lines():
+            for line in iter_stream_lines(response):
                 if line:
                     try:
                         data = json.loads(line)
@@ -144,6 +367,23 @@ class OllamaClient:
                         yield data
                     except json.JSONDecodeError:
                         continue
+            if cancel is not None and cancel.cancelled:
+                # The aborted stream can end like a normal one
+                raise RequestCancelled("Download cancelled")
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            if cancel is not None and cancel.cancelled:
+                raise RequestCancelled("Download cancelled") from e
+            self._raise_pull_error(e)
+        finally:
+            if response is not None:
+                response.close()
+    
+    def _raise_pull_error(self, e: Exception):
+        """Re-raise a pull failure with a user-facing message."""
+        try:
+            raise e
         except requests.exceptions.ConnectionError as e:
             raise Exception(f"Failed to connect to Ollama service at {self.base_url}. Please ensure Ollama is running.")
         except requests.exceptions.Timeout as e:
@@ -171,7 +411,7 @@ class OllamaClient:
         payload = {"name": model}
         
         try:
-            response = requests.delete(url, json=payload, timeout=self.timeout)
+            response = self.session.delete(url, json=payload, timeout=self.delete_timeout)
             response.raise_for_status()
             return True
         except requests.exceptions.RequestException as e:
@@ -184,6 +424,19 @@ class OllamaClient:
                     pass
             raise Exception(f"Failed to delete model: {error_msg}")
     
+    def get_version(self) -> str:
+        """Get the Ollama server version (/api/version).
+        
+        Returns:
+            str: Version string (e.g. "0.5.7")
+        """
+        try:
+            response = self.session.get(f"{self.base_url}/api/version", timeout=self.health_timeout)
+            response.raise_for_status()
+            return response.json().get('version', '')
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Failed to connect to Ollama at {self.base_url}: {str(e)}")
+    
     def check_health(self) -> bool:
         """Check if Ollama server is accessible.
         
@@ -191,7 +444,8 @@ class OllamaClient:
             bool: True if Ollama is accessible
         """
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.session.get(f"{self.base_url}/api/version", timeout=self.health_timeout)
+            response.close()
             return response.status_code == 200
         except:
             return False
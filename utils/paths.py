@@ -9,8 +9,11 @@ def get_base_path():
     Returns:
         Path: Base directory for storing data files
     """
+    # Explicit override (e.g. an isolated directory for load tests)
+    if os.getenv('CHATGPT_OLLAMA_DATA_DIR'):
+        base_path = Path(os.getenv('CHATGPT_OLLAMA_DATA_DIR'))
     # Check if running as .exe (PyInstaller)
-    if getattr(sys, 'frozen', False):
+    elif getattr(sys, 'frozen', False):
         # Running as compiled .exe
         base_path = Path(os.getenv('LOCALAPPDATA', '')) / 'ChatGPT-Ollama'
     else:
@@ -32,3 +35,19 @@ def get_summaries_path():
     path = get_base_path() / 'summaries'
     path.mkdir(parents=True, exist_ok=True)
     return path
+
+def get_history_db_path():
+    """Get path for the SQLite history database."""
+    return get_base_path() / 'history.db'
+
+def get_conversation_index_path():
+    """Get path for the conversation metadata index snapshot."""
+    return get_base_path() / 'conversation_index.json'
+
+def get_search_index_path():
+    """Get path for the full-text search index database."""
+    return get_base_path() / 'search.db'
+
+def get_slow_request_log_path():
+    """Get path for the slow request log."""
+    return get_base_path() / 'slow_requests.log'
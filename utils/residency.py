@@ -0,0 +1,197 @@
+"""Which models Ollama keeps loaded, and for how long.
+
+ResidencyManager tracks loaded models through Ollama's ``/api/ps`` and
+model usage in this process. Before a model is used it:
+
+- picks ``keep_alive`` from recent usage: RESIDENCY_KEEP_ALIVE_MIN seconds
+  per use within RESIDENCY_USAGE_WINDOW, capped at RESIDENCY_KEEP_ALIVE_MAX
+- unloads least recently used idle models until the model fits in
+  RESIDENCY_RAM_BUDGET_MB, using the sizes ModelManager knows
+
+Models can also be warmed (loaded ahead of the first message).
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+from config import (
+    RESIDENCY_RAM_BUDGET_MB, RESIDENCY_KEEP_ALIVE_MIN, RESIDENCY_KEEP_ALIVE_MAX,
+    RESIDENCY_USAGE_WINDOW, RESIDENCY_PS_TTL
+)
+from utils.ollama_client import OllamaClient
+from utils.model_manager import ModelManager
+from utils.scheduler import ModelScheduler
+
+class ResidencyManager:
+    """Warm, keep alive and evict models under a memory budget."""
+    
+    def __init__(self, client: OllamaClient, model_manager: ModelManager, scheduler: ModelScheduler = None):
+        """Initialize residency manager.
+        
+        Args:
+            client: Ollama client
+            model_manager: Source of model sizes
+            scheduler: Used to avoid unloading models with requests running
+        """
+        self.client = client
+        self.model_manager = model_manager
+        self.scheduler = scheduler
+        self.ram_budget = RESIDENCY_RAM_BUDGET_MB * 1024 * 1024  # 0 = no budget
+        self.keep_alive_min = RESIDENCY_KEEP_ALIVE_MIN
+        self.keep_alive_max = RESIDENCY_KEEP_ALIVE_MAX
+        self.usage_window = RESIDENCY_USAGE_WINDOW
+        self.ps_ttl = RESIDENCY_PS_TTL
+        
+        self._loaded = {}  # model -> /api/ps entry
+        self._loaded_at = 0.0  # When _loaded was last refreshed (monotonic)
+        self._uses = {}  # model -> deque of use times (monotonic)
+        self._warming = set()
+        self._lock = threading.Lock()
+        self._stats = {'warmups': 0, 'evictions': 0, 'ps_errors': 0}
+    
+    def refresh(self, force: bool = False) -> Dict[str, Dict]:
+        """Update the loaded model list from /api/ps if it is older than RESIDENCY_PS_TTL.
+        
+        Returns:
+            Dict of model name -> /api/ps entry
+        """
+        with self._lock:
+            if not force and time.monotonic() - self._loaded_at < self.ps_ttl:
+                return dict(self._loaded)
+        try:
+            running = self.client.list_running()
+        except Exception as e:
+            print(f"Error fetching running models: {e}")
+            with self._lock:
+                self._stats['ps_errors'] += 1
+                return dict(self._loaded)
+        with self._lock:
+            self._loaded = {m.get('name') or m.get('model'): m for m in running}
+            self._loaded_at = time.monotonic()
+            return dict(self._loaded)
+    
+    def is_loaded(self, model: str) -> bool:
+        """Whether the model was loaded at the last refresh (no network call)."""
+        with self._lock:
+            return model in self._loaded
+    
+    def _recent_uses(self, model: str, now: float) -> int:
+        """Count uses within the usage window. Must be called with the lock held."""
+        uses = self._uses.get(model)
+        if not uses:
+            return 0
+        while uses and now - uses[0] > self.usage_window:
+            uses.popleft()
+        return len(uses)
+    
+    def _last_used(self, model: str) -> float:
+        uses = self._uses.get(model)
+        return uses[-1] if uses else 0.0
+    
+    def keep_alive_for(self, model: str) -> int:
+        """Seconds Ollama should keep the model loaded after the current request."""
+        with self._lock:
+            uses = self._recent_uses(model, time.monotonic())
+        return int(min(self.keep_alive_max, self.keep_alive_min * max(1, uses)))
+    
+    def prepare(self, model: str) -> int:
+        """Record a use of the model and make room for it.
+        
+        Call right before sending a request for the model.
+        
+        Returns:
+            int: keep_alive to send with the request
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._uses.setdefault(model, deque()).append(now)
+        self._make_room(model)
+        keep_alive = self.keep_alive_for(model)
+        with self._lock:
+            # Count it as loaded right away so scheduling prefers it
+            self._loaded.setdefault(model, {'name': model})
+        return keep_alive
+    
+    def _make_room(self, model: str):
+        """Unload least recently used idle models until the model fits in the RAM budget."""
+        if self.ram_budget <= 0:
+            return
+        loaded = self.refresh()
+        if model in loaded:
+            return
+        needed = self.model_manager.get_model_bytes(model)
+        used = sum(entry.get('size') or self.model_manager.get_model_bytes(name) for name, entry in loaded.items())
+        if used + needed <= self.ram_budget:
+            return
+        
+        with self._lock:
+            victims = sorted(loaded, key=self._last_used)
+        for victim in victims:
+            if used + needed <= self.ram_budget:
+                break
+            if self.scheduler is not None and self.scheduler.is_running(victim):
+                continue
+            try:
+                self.client.set_keep_alive(victim, 0)
+            except Exception as e:
+                print(f"Error unloading model {victim}: {e}")
+                continue
+            used -= loaded[victim].get('size') or self.model_manager.get_model_bytes(victim)
+            with self._lock:
+                self._loaded.pop(victim, None)
+                self._stats['evictions'] += 1
+    
+    def warm(self, model: str) -> bool:
+        """Load a model ahead of its first request.
+        
+        Returns:
+            bool: True if the model was loaded (or already loaded)
+        """
+        if model in self.refresh():
+            return True
+        with self._lock:
+            if model in self._warming:
+                return True
+            self._warming.add(model)
+        try:
+            keep_alive = self.prepare(model)
+            self.client.set_keep_alive(model, keep_alive)
+            with self._lock:
+                self._stats['warmups'] += 1
+            self.refresh(force=True)
+            return True
+        finally:
+            with self._lock:
+                self._warming.discard(model)
+    
+    def snapshot(self) -> Dict:
+        """Get loaded models with usage, plus the budget.
+        
+        Returns:
+            Dict with 'models', 'used_bytes', 'budget_bytes', 'warming' and counters
+        """
+        loaded = self.refresh()
+        now = time.monotonic()
+        models: List[Dict] = []
+        with self._lock:
+            for name, entry in loaded.items():
+                last_used = self._last_used(name)
+                models.append({
+                    'name': name,
+                    'size': entry.get('size'),
+                    'size_vram': entry.get('size_vram'),
+                    'expires_at': entry.get('expires_at'),
+                    'recent_uses': self._recent_uses(name, now),
+                    'idle_seconds': round(now - last_used, 1) if last_used else None
+                })
+            warming = sorted(self._warming)
+            stats = dict(self._stats)
+        for model in models:
+            model['keep_alive'] = self.keep_alive_for(model['name'])
+        stats.update({
+            'models': models,
+            'used_bytes': sum(m['size'] or 0 for m in models),
+            'budget_bytes': self.ram_budget,
+            'warming': warming
+        })
+        return stats
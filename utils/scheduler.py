@@ -0,0 +1,232 @@
+"""Scheduling of model work in front of Ollama.
+
+Every request that makes Ollama run a model takes a slot from the
+ModelScheduler first. Slots are limited globally and per model, so requests
+for different models do not make Ollama swap models in and out of memory.
+Queued requests are ordered by:
+
+1. priority class (interactive before batch)
+2. model affinity: work for a model that is already loaded goes first,
+   unless another request has waited longer than SCHEDULER_AFFINITY_WAIT
+3. fairness: the conversation served least recently goes first
+4. arrival order
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from config import (
+    SCHEDULER_GLOBAL_CONCURRENCY, SCHEDULER_MODEL_CONCURRENCY, SCHEDULER_MAX_QUEUE,
+    SCHEDULER_MAX_QUEUE_PER_MODEL, SCHEDULER_AFFINITY_WAIT
+)
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITIES = {'interactive': INTERACTIVE, 'batch': BATCH}
+
+class SchedulerFull(Exception):
+    """Raised when a request is rejected because the queue is full."""
+    
+    def __init__(self, message: str, status_code: int, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code  # 429 (model queue full) or 503 (server queue full)
+        self.retry_after = retry_after
+
+class Ticket:
+    """A queued or running request for a model slot."""
+    
+    __slots__ = ('model', 'priority', 'key', 'seq', 'enqueued_at', 'granted_at', 'released', '_granted')
+    
+    def __init__(self, model: str, priority: int, key: str, seq: int):
+        self.model = model
+        self.priority = priority
+        self.key = key
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self._granted = threading.Event()
+    
+    @property
+    def granted(self) -> bool:
+        return self._granted.is_set()
+    
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the slot is granted.
+        
+        Returns:
+            bool: True if granted, False on timeout
+        """
+        return self._granted.wait(timeout)
+    
+    @property
+    def queue_wait(self) -> float:
+        """Seconds spent in the queue (so far, if not granted yet)."""
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+class ModelScheduler:
+    """Grant model slots under global and per-model concurrency limits."""
+    
+    def __init__(self, global_limit: int = None, model_limit: int = None, max_queue: int = None,
+                 max_queue_per_model: int = None, affinity_wait: float = None):
+        """Initialize scheduler.
+        
+        Args:
+            global_limit: Maximum requests running at once across all models
+            model_limit: Maximum requests running at once per model
+            max_queue: Maximum queued requests in total (beyond: 503)
+            max_queue_per_model: Maximum queued requests per model (beyond: 429)
+            affinity_wait: Seconds after which a queued request no longer yields to loaded models
+        """
+        self.global_limit = max(1, SCHEDULER_GLOBAL_CONCURRENCY if global_limit is None else global_limit)
+        self.model_limit = max(1, SCHEDULER_MODEL_CONCURRENCY if model_limit is None else model_limit)
+        self.max_queue = SCHEDULER_MAX_QUEUE if max_queue is None else max_queue
+        self.max_queue_per_model = SCHEDULER_MAX_QUEUE_PER_MODEL if max_queue_per_model is None else max_queue_per_model
+        self.affinity_wait = SCHEDULER_AFFINITY_WAIT if affinity_wait is None else affinity_wait
+        # Optional callable telling whether Ollama has a model loaded; by default
+        # the models running now and the last one dispatched count as loaded
+        self.is_loaded: Optional[Callable[[str], bool]] = None
+        
+        self._queue: List[Ticket] = []
+        self._running: Dict[str, int] = {}  # model -> running requests
+        self._running_total = 0
+        self._last_model = None
+        self._last_served: Dict[str, int] = {}  # key -> dispatch counter when last served
+        self._dispatches = itertools.count(1)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {'granted': 0, 'rejected': 0, 'cancelled': 0, 'reordered': 0}
+    
+    def submit(self, model: str, priority: int = INTERACTIVE, key: str = None) -> Ticket:
+        """Queue a request for a model slot.
+        
+        Args:
+            model: Model the request will run
+            priority: INTERACTIVE or BATCH
+            key: Fairness key (e.g. conversation ID); requests with the same key share a turn
+        
+        Returns:
+            Ticket: Wait on it, then release() it when the model work is done
+        
+        Raises:
+            SchedulerFull: If the queue is over its bound
+        """
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise SchedulerFull("Server is busy, try again shortly", 503, self._retry_after())
+            if sum(1 for t in self._queue if t.model == model) >= self.max_queue_per_model:
+                self._stats['rejected'] += 1
+                raise SchedulerFull(f"Too many queued requests for {model}", 429, self._retry_after())
+            ticket = Ticket(model, priority, key or '', next(self._seq))
+            self._queue.append(ticket)
+            self._dispatch()
+            return ticket
+    
+    def release(self, ticket: Ticket):
+        """Give back a granted slot, or drop the ticket from the queue if it is still waiting."""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self._running[ticket.model] -= 1
+                if not self._running[ticket.model]:
+                    del self._running[ticket.model]
+                self._running_total -= 1
+            elif ticket in self._queue:
+                self._queue.remove(ticket)
+                self._stats['cancelled'] += 1
+            self._dispatch()
+    
+    @contextmanager
+    def slot(self, model: str, priority: int = BATCH, key: str = None):
+        """Hold a model slot for the duration of a with block (waits in the queue)."""
+        ticket = self.submit(model, priority, key)
+        try:
+            ticket.wait()
+            yield ticket
+        finally:
+            self.release(ticket)
+    
+    def position(self, ticket: Ticket) -> int:
+        """Get a waiting ticket's place in the queue (1 = next), or 0 once granted."""
+        with self._lock:
+            if ticket.granted or ticket not in self._queue:
+                return 0
+            order = sorted(self._queue, key=self._order_key(time.monotonic()))
+            return order.index(ticket) + 1
+    
+    def is_running(self, model: str) -> bool:
+        """Whether any request for the model holds a slot."""
+        with self._lock:
+            return model in self._running
+    
+    def stats(self) -> Dict:
+        """Get queue and slot usage."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'running': dict(self._running),
+                'queued': len(self._queue),
+                'queued_by_model': self._queued_by_model(),
+                'global_limit': self.global_limit,
+                'model_limit': self.model_limit,
+                'max_queue': self.max_queue
+            })
+        return stats
+    
+    def _queued_by_model(self) -> Dict[str, int]:
+        counts = {}
+        for ticket in self._queue:
+            counts[ticket.model] = counts.get(ticket.model, 0) + 1
+        return counts
+    
+    def _retry_after(self) -> int:
+        """Rough seconds until a queued request could start. Must be called with the lock held."""
+        return max(1, len(self._queue) // self.global_limit)
+    
+    def _loaded(self, model: str) -> bool:
+        if self.is_loaded is not None:
+            try:
+                return self.is_loaded(model)
+            except Exception:
+                pass
+        return model in self._running or model == self._last_model
+    
+    def _order_key(self, now: float):
+        """Sort key for queued tickets (lowest runs first). Must be called with the lock held."""
+        loaded = {}
+        
+        def key(ticket: Ticket):
+            if ticket.model not in loaded:
+                loaded[ticket.model] = self._loaded(ticket.model)
+            # Past affinity_wait a ticket competes as if its model were loaded
+            affine = loaded[ticket.model] or now - ticket.enqueued_at >= self.affinity_wait
+            return (ticket.priority, not affine, self._last_served.get(ticket.key, 0), ticket.seq)
+        return key
+    
+    def _dispatch(self):
+        """Grant slots to queued tickets while capacity allows. Must be called with the lock held."""
+        while self._queue and self._running_total < self.global_limit:
+            now = time.monotonic()
+            order_key = self._order_key(now)
+            candidates = [t for t in self._queue if self._running.get(t.model, 0) < self.model_limit]
+            if not candidates:
+                return
+            ticket = min(candidates, key=order_key)
+            if ticket is not min(candidates, key=lambda t: (t.priority, t.seq)):
+                self._stats['reordered'] += 1
+            
+            self._queue.remove(ticket)
+            self._running[ticket.model] = self._running.get(ticket.model, 0) + 1
+            self._running_total += 1
+            self._last_model = ticket.model
+            self._last_served[ticket.key] = next(self._dispatches)
+            if len(self._last_served) > 4096:
+                queued_keys = {t.key for t in self._queue}
+                self._last_served = {k: v for k, v in self._last_served.items() if k in queued_keys}
+            self._stats['granted'] += 1
+            ticket.granted_at = now
+            ticket._granted.set()
@@ -0,0 +1,201 @@
+"""Full-text search index over conversation messages.
+
+The index is an SQLite FTS5 table (an on-disk inverted index) keyed by
+(conversation_id, message index). Storage backends update it incrementally
+as messages are appended, truncated or deleted. The file backend keeps it in
+its own ``search.db``; the SQLite backend keeps it inside ``history.db`` so
+index updates share the storage transaction.
+"""
+import html
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Words (letters/digits, including non-ASCII) used to build a safe FTS5 query
+QUERY_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Private-use characters FTS5 puts around matches; replaced by <mark> tags after escaping
+_MATCH_START = '\ue000'
+_MATCH_END = '\ue001'
+
+def _snippet_html(snippet: str) -> str:
+    """Escape a snippet's text as HTML and highlight its matches with <mark>."""
+    text = html.escape(snippet)
+    return text.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+class SearchIndex:
+    """Incremental FTS5 index of message contents."""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS search_rows (
+            id INTEGER PRIMARY KEY,
+            conversation_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_search_rows_conversation ON search_rows (conversation_id, seq);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+        CREATE TABLE IF NOT EXISTS search_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    
+    SQL_DELETE_FTS_FROM = """
+        DELETE FROM messages_fts WHERE rowid IN (
+            SELECT id FROM search_rows WHERE conversation_id = ? AND seq >= ?
+        )
+    """
+    SQL_DELETE_ROWS_FROM = "DELETE FROM search_rows WHERE conversation_id = ? AND seq >= ?"
+    SQL_INSERT_ROW = "INSERT INTO search_rows (conversation_id, seq, role) VALUES (?, ?, ?)"
+    SQL_INSERT_FTS = "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)"
+    SQL_SEARCH = """
+        SELECT r.conversation_id, r.seq, r.role,
+               snippet(messages_fts, 0, char(57344), char(57345), '...', 16),
+               messages_fts.rank
+        FROM messages_fts
+        JOIN search_rows r ON r.id = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+        ORDER BY messages_fts.rank
+        LIMIT ? OFFSET ?
+    """
+    SQL_COUNT = "SELECT count(*) FROM messages_fts WHERE messages_fts MATCH ?"
+    
+    def __init__(self, db_path: Path = None, connection: Callable[[], sqlite3.Connection] = None):
+        """Initialize the search index.
+        
+        Args:
+            db_path: Database file holding the index (used when no connection is given)
+            connection: Callable returning the caller's per-thread connection, so index
+                updates can join the caller's transactions
+        """
+        self.db_path = Path(db_path) if db_path else None
+        self._local = threading.local()
+        self._connection_factory = connection or self._own_connection
+        self.available = True
+        try:
+            conn = self._connection_factory()
+            with conn:
+                conn.executescript(self.SCHEMA)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5
+            print(f"Full-text search unavailable: {e}")
+            self.available = False
+    
+    def _own_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the index database."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, cached_statements=64)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _write(self, conn: sqlite3.Connection, conversation_id: str, start: int, messages: Iterable[Dict]):
+        conn.execute(self.SQL_DELETE_FTS_FROM, (conversation_id, start))
+        conn.execute(self.SQL_DELETE_ROWS_FROM, (conversation_id, start))
+        for seq, message in enumerate(messages, start=start):
+            content = message.get('content') or ''
+            if not isinstance(content, str):
+                content = str(content)
+            row_id = conn.execute(self.SQL_INSERT_ROW, (conversation_id, seq, message.get('role'))).lastrowid
+            conn.execute(self.SQL_INSERT_FTS, (row_id, content))
+    
+    def index_messages(self, conversation_id: str, start: int, messages: List[Dict], commit: bool = True):
+        """Index messages starting at a message index, replacing anything indexed from there on.
+        
+        Args:
+            conversation_id: Conversation ID
+            start: Message index of messages[0]
+            messages: Messages to index
+            commit: Commit the connection's transaction (False when the caller owns it)
+        """
+        if not self.available:
+            return
+        conn = self._connection_factory()
+        if commit:
+            with conn:
+                self._write(conn, conversation_id, start, messages)
+        else:
+            self._write(conn, conversation_id, start, messages)
+    
+    def truncate(self, conversation_id: str, start: int, commit: bool = True):
+        """Remove messages at index start and after from the index."""
+        self.index_messages(conversation_id, start, [], commit=commit)
+    
+    def delete(self, conversation_id: str, commit: bool = True):
+        """Remove a conversation from the index."""
+        self.index_messages(conversation_id, 0, [], commit=commit)
+    
+    def is_built(self) -> bool:
+        """Whether the initial indexing of existing conversations has completed."""
+        if not self.available:
+            return True
+        row = self._connection_factory().execute(
+            "SELECT value FROM search_settings WHERE key = 'built'"
+        ).fetchone()
+        return row is not None
+    
+    def mark_built(self, commit: bool = True):
+        """Record that existing conversations have been indexed."""
+        conn = self._connection_factory()
+        sql = "INSERT OR REPLACE INTO search_settings (key, value) VALUES ('built', '1')"
+        if commit:
+            with conn:
+                conn.execute(sql)
+        else:
+            conn.execute(sql)
+    
+    @staticmethod
+    def build_query(text: str) -> str:
+        """Turn free text into an FTS5 query: all words must match, the last as a prefix.
+        
+        Args:
+            text: User query
+        
+        Returns:
+            FTS5 MATCH expression, or '' if the text has no searchable words
+        """
+        tokens = QUERY_TOKEN_RE.findall(text.lower())
+        if not tokens:
+            return ''
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+    
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict], int]:
+        """Search indexed messages, best matches first.
+        
+        Args:
+            text: User query
+            limit: Maximum results to return
+            offset: Number of results to skip
+        
+        Returns:
+            (results, total) where each result has conversation_id, message_index,
+            role, snippet (HTML: escaped text with matches in <mark>) and score
+        """
+        if not self.available:
+            raise Exception("Full-text search is not available: SQLite was built without FTS5")
+        query = self.build_query(text)
+        if not query:
+            return [], 0
+        
+        conn = self._connection_factory()
+        total = conn.execute(self.SQL_COUNT, (query,)).fetchone()[0]
+        results = []
+        for conversation_id, seq, role, snippet, rank in conn.execute(self.SQL_SEARCH, (query, limit, offset)):
+            results.append({
+                'conversation_id': conversation_id,
+                'message_index': seq,
+                'role': role,
+                'snippet': _snippet_html(snippet),
+                'score': -rank  # bm25 rank is lower-is-better
+            })
+        return results, total
@@ -0,0 +1,105 @@
+"""Server-Sent Events framing helpers for streaming endpoints."""
+import json
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator
+from config import SSE_COALESCE_MS, SSE_COALESCE_BYTES, SSE_FLUSH_FIRST
+
+# Built once and reused for every frame
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+def encode_event(data: Dict) -> str:
+    """Encode a dict as a single SSE data frame."""
+    return f"data: {_encode(data)}\n\n"
+
+def content_frame(content: str) -> str:
+    """Encode a streamed content chunk (same shape as encode_event({'content': ..., 'done': False}))."""
+    return 'data: {"content": ' + _encode(content) + ', "done": false}\n\n'
+
+_CHUNK, _END, _ERROR = 0, 1, 2
+
+def coalesce_chunks(chunks: Iterable[str], window_ms: float = None, max_bytes: int = None,
+                    flush_first: bool = None) -> Iterator[str]:
+    """Merge small text chunks into fewer, larger ones.
+    
+    Chunks are buffered until window_ms has passed since the first buffered
+    chunk or the buffer reaches max_bytes, whichever comes first. The source
+    is read on a helper thread so a stalled upstream still flushes on time.
+    
+    Args:
+        chunks: Source of text chunks (e.g. OllamaClient.chat)
+        window_ms: Coalescing window in milliseconds (0 disables coalescing)
+        max_bytes: Flush once this many characters are buffered
+        flush_first: Send the first chunk immediately (keeps time-to-first-token low)
+    
+    Yields:
+        str: Coalesced chunks, in order
+    """
+    window = (SSE_COALESCE_MS if window_ms is None else window_ms) / 1000.0
+    max_bytes = SSE_COALESCE_BYTES if max_bytes is None else max_bytes
+    flush_first = SSE_FLUSH_FIRST if flush_first is None else flush_first
+    
+    if window <= 0:
+        yield from chunks
+        return
+    
+    items = queue.SimpleQueue()
+    stop = threading.Event()
+    
+    def pump():
+        try:
+            for chunk in chunks:
+                items.put((_CHUNK, chunk))
+                if stop.is_set():
+                    break
+            items.put((_END, None))
+        except BaseException as e:
+            items.put((_ERROR, e))
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+    
+    threading.Thread(target=pump, daemon=True).start()
+    
+    buffer = []
+    size = 0
+    deadline = 0.0
+    first = flush_first
+    try:
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if buffer else None
+            try:
+                kind, value = items.get(timeout=timeout)
+            except queue.Empty:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+                continue
+            
+            if kind == _END:
+                break
+            if kind == _ERROR:
+                if buffer:
+                    yield ''.join(buffer)
+                    buffer = []
+                raise value
+            if not value:
+                continue
+            if first:
+                first = False
+                yield value
+                continue
+            
+            if not buffer:
+                deadline = time.monotonic() + window
+            buffer.append(value)
+            size += len(value)
+            if size >= max_bytes or time.monotonic() >= deadline:
+                yield ''.join(buffer)
+                buffer, size = [], 0
+        
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        stop.set()
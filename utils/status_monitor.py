@@ -0,0 +1,203 @@
+"""Background monitor of Ollama and the installed dependencies.
+
+One thread probes Ollama (``/api/version``, and ``/api/ps`` for the loaded
+models while it is up) and keeps the result in a snapshot that endpoints
+read without any network call. Probes are adaptive: after any change the
+next probe comes STATUS_PROBE_MIN seconds later, and while nothing changes
+the delay doubles up to STATUS_PROBE_MAX. The ``ollama --version`` check
+runs every STATUS_DEPENDENCY_INTERVAL seconds, and whenever Ollama goes
+up or down.
+
+Each change increments the snapshot version and is pushed to subscribers
+as an SSE frame; change listeners (e.g. to refetch the model list once
+Ollama is back) are called on the monitor thread.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterator
+from config import STATUS_PROBE_MIN, STATUS_PROBE_MAX, STATUS_DEPENDENCY_INTERVAL, GENERATION_KEEPALIVE_SECONDS
+from utils.ollama_client import OllamaClient
+from utils.residency import ResidencyManager
+from utils.sse import encode_event
+from check_dependencies import check_python, check_ollama
+
+class StatusMonitor:
+    """Probe Ollama in the background and publish its state."""
+    
+    # Fields of the Ollama state whose change is published (error texts vary between attempts)
+    TRACKED = ('running', 'version', 'loaded_models', 'installed', 'cli_version')
+    
+    def __init__(self, client: OllamaClient, residency: ResidencyManager = None):
+        """Initialize status monitor.
+        
+        Args:
+            client: Ollama client used for the probes
+            residency: Refreshed with the loaded models on each probe (None = ask the client)
+        """
+        self.client = client
+        self.residency = residency
+        self.probe_min = STATUS_PROBE_MIN
+        self.probe_max = max(STATUS_PROBE_MIN, STATUS_PROBE_MAX)
+        self.dependency_interval = STATUS_DEPENDENCY_INTERVAL
+        
+        python_installed, python_version = check_python()
+        self._python = {'installed': python_installed, 'version': python_version}
+        self._ollama_cli = None  # (installed, version) from the last `ollama --version`
+        self._cli_checked_at = 0.0  # monotonic
+        self._snapshot = {'version': 0, 'checked': False}
+        self._interval = self.probe_min
+        self._probed_at = 0.0  # When the last probe ended (monotonic)
+        self._listeners = []
+        self._cond = threading.Condition()
+        self._probe_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start the monitor thread (the first probe runs right away)."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+    
+    def add_listener(self, callback: Callable[[Dict, Dict], None]):
+        """Call callback(old, new) with the snapshots whenever the state changes."""
+        self._listeners.append(callback)
+    
+    def snapshot(self) -> Dict:
+        """Get the latest state (no network call).
+        
+        Returns:
+            Dict with 'version', 'checked', 'checked_at', 'ollama' (running,
+            version, loaded_models, installed, cli_version, error, since)
+            and 'python' (installed, version)
+        """
+        return self._snapshot
+    
+    def wait_ready(self, timeout: float) -> Dict:
+        """Get the state, waiting up to timeout seconds for the first probe."""
+        with self._cond:
+            if not self._snapshot['checked']:
+                self._cond.wait_for(lambda: self._snapshot['checked'], timeout)
+            return self._snapshot
+    
+    def ollama_running(self) -> bool:
+        """Whether Ollama answered the last probe."""
+        return self._snapshot.get('ollama', {}).get('running', False)
+    
+    def check(self, max_age: float = 0.0) -> Dict:
+        """Probe now unless a probe ended less than max_age seconds ago.
+        
+        Concurrent callers wait for the probe in progress instead of starting another.
+        """
+        with self._probe_lock:
+            if self._snapshot['checked'] and time.monotonic() - self._probed_at < max_age:
+                return self._snapshot
+            return self._probe()
+    
+    def poke(self):
+        """Probe soon, e.g. after a request to Ollama failed."""
+        self._wake.set()
+    
+    def _run(self):
+        while True:
+            try:
+                self.check(max_age=self.probe_min / 2)
+            except Exception as e:
+                print(f"Error checking status: {e}")
+            self._wake.wait(self._interval)
+            self._wake.clear()
+    
+    def _probe(self) -> Dict:
+        """Probe Ollama (and the CLI when due) and publish the result. Must be called with the probe lock held."""
+        started = time.perf_counter()
+        error = None
+        try:
+            server_version = self.client.get_version()
+            running = True
+        except Exception as e:
+            server_version = None
+            running = False
+            error = str(e)
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        
+        loaded_models = []
+        if running:
+            try:
+                if self.residency is not None:
+                    loaded_models = sorted(self.residency.refresh(force=True))
+                else:
+                    loaded_models = sorted(m.get('name') or m.get('model') for m in self.client.list_running())
+            except Exception as e:
+                print(f"Error fetching running models: {e}")
+        
+        previous = self._snapshot
+        previous_ollama = previous.get('ollama', {})
+        now = time.monotonic()
+        if (self._ollama_cli is None or now - self._cli_checked_at >= self.dependency_interval
+                or previous_ollama.get('running') != running):
+            self._ollama_cli = check_ollama()
+            self._cli_checked_at = now
+        cli_installed, cli_version = self._ollama_cli
+        
+        ollama = {
+            'running': running,
+            'version': server_version,
+            'loaded_models': loaded_models,
+            'installed': cli_installed,
+            'cli_version': cli_version,
+            'error': error
+        }
+        changed = not previous['checked'] or any(ollama[key] != previous_ollama.get(key) for key in self.TRACKED)
+        if changed:
+            ollama['since'] = datetime.now().isoformat()
+            self._interval = self.probe_min
+        else:
+            ollama['since'] = previous_ollama.get('since')
+            self._interval = min(self.probe_max, self._interval * 2)
+        ollama['latency_ms'] = latency_ms
+        
+        snapshot = {
+            'version': previous['version'] + (1 if changed else 0),
+            'checked': True,
+            'checked_at': datetime.now().isoformat(),
+            'next_check_seconds': self._interval,
+            'ollama': ollama,
+            'python': self._python
+        }
+        with self._cond:
+            self._snapshot = snapshot
+            self._probed_at = time.monotonic()
+            self._cond.notify_all()
+        
+        if changed:
+            for listener in list(self._listeners):
+                try:
+                    listener(previous, snapshot)
+                except Exception as e:
+                    print(f"Error in status listener: {e}")
+        return snapshot
+    
+    def subscribe(self, keepalive: float = None) -> Iterator[str]:
+        """Follow the state as SSE frames: the current snapshot, then one per change.
+        
+        Args:
+            keepalive: Seconds between keepalive comments
+        
+        Yields:
+            str: SSE frames, with the snapshot version as the ``id:``
+        """
+        keepalive = GENERATION_KEEPALIVE_SECONDS if keepalive is None else keepalive
+        sent = None  # Version of the last snapshot sent
+        while True:
+            with self._cond:
+                changed = self._cond.wait_for(
+                    lambda: self._snapshot['checked'] and self._snapshot['version'] != sent, keepalive
+                )
+                snapshot = self._snapshot
+            if changed:
+                sent = snapshot['version']
+                yield f"id: {sent}\n{encode_event(snapshot)}"
+            else:
+                yield ': keepalive\n\n'
@@ -0,0 +1,211 @@
+"""Rolling conversation summarization off the request path.
+
+Messages that fall out of the context window are compressed by a small
+Ollama model (SUMMARY_MODEL) on a single low-priority worker thread. New
+batches of evicted messages are summarized and appended to the stored
+summary; once the summary grows past SUMMARY_MAX_TOKENS it is itself
+compressed one level up. Model calls take a batch-priority slot from the
+ModelScheduler. When the model is unavailable, or the queue is saturated,
+the heuristic summary from ContextBuilder is used instead.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from config import (
+    SUMMARY_MODEL, SUMMARY_QUEUE_SIZE, SUMMARY_MIN_BATCH, SUMMARY_MAX_TOKENS, SUMMARY_RETRY_DELAY
+)
+from utils.history_manager import HistoryManager
+from utils.context_builder import ContextBuilder
+from utils.ollama_client import OllamaClient
+from utils.scheduler import ModelScheduler, SchedulerFull, BATCH
+from utils.tokens import estimate_tokens
+
+SUMMARIZE_PROMPT = (
+    "Summarize the following conversation excerpt in a few sentences. Keep facts, names, "
+    "numbers, decisions and open questions. Reply with the summary only."
+)
+COMPRESS_PROMPT = (
+    "Combine the following partial summaries of one conversation into a single concise summary. "
+    "Keep facts, names, numbers, decisions and open questions. Reply with the summary only."
+)
+
+class RollingSummarizer:
+    """Keep conversation summaries up to date incrementally in the background.
+    
+    Each stored summary carries a watermark (how many leading messages it
+    covers); an update only looks at the messages after the watermark.
+    """
+    
+    def __init__(self, history_manager: HistoryManager, context_builder: ContextBuilder,
+                 client: OllamaClient = None, model: str = None, scheduler: ModelScheduler = None):
+        """Initialize summarizer.
+        
+        Args:
+            history_manager: Where summaries are stored
+            context_builder: Provides eviction boundaries and the heuristic summary
+            client: Ollama client for model summaries (defaults to a new one)
+            model: Summary model (defaults to SUMMARY_MODEL; '' disables model summaries)
+            scheduler: Scheduler granting model slots (None = call the model directly)
+        """
+        self.history_manager = history_manager
+        self.context_builder = context_builder
+        self.client = client or OllamaClient()
+        self.model = SUMMARY_MODEL if model is None else model
+        self.scheduler = scheduler
+        self.queue_size = SUMMARY_QUEUE_SIZE
+        self.min_batch = SUMMARY_MIN_BATCH
+        self.max_tokens = SUMMARY_MAX_TOKENS
+        self.retry_delay = SUMMARY_RETRY_DELAY
+        
+        self._pending = {}  # conversation_id -> job dict (latest snapshot wins)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._worker = None
+        self._interactive = 0  # Interactive generations in flight
+        self._model_disabled_until = 0.0
+        self.stats = {'model_summaries': 0, 'heuristic_summaries': 0, 'model_failures': 0, 'saturated': 0}
+    
+    @contextmanager
+    def interactive(self):
+        """Mark an interactive generation as running; model summaries wait until none are."""
+        with self._lock:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._interactive -= 1
+                self._wakeup.notify_all()
+    
+    def schedule(self, conversation_id: str, messages: List[Dict], model: str = None):
+        """Queue a summary update; repeated calls for one conversation collapse into one.
+        
+        Args:
+            conversation_id: Conversation ID
+            messages: Current messages of the conversation
+            model: Chat model (used for token estimates of the context window)
+        """
+        if not self.context_builder.should_summarize(messages):
+            return
+        with self._lock:
+            saturated = conversation_id not in self._pending and len(self._pending) >= self.queue_size
+            if saturated:
+                self.stats['saturated'] += 1
+            previous = self._pending.get(conversation_id)
+            self._pending[conversation_id] = {
+                'messages': list(messages),
+                'chat_model': model,
+                # Once a job has fallen back to the heuristic, keep it that way
+                'heuristic': saturated or bool(previous and previous['heuristic'])
+            }
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._wakeup.notify_all()
+    
+    def pending_count(self) -> int:
+        """Get the number of queued summary jobs."""
+        with self._lock:
+            return len(self._pending)
+    
+    def _next_job(self):
+        """Wait for a job that may run now. Must be called with the lock held.
+        
+        Heuristic jobs run immediately; model jobs wait until no interactive
+        generation is in flight.
+        """
+        while True:
+            for conversation_id, job in self._pending.items():
+                if job['heuristic'] or not self._uses_model() or self._interactive == 0:
+                    del self._pending[conversation_id]
+                    return conversation_id, job
+            self._wakeup.wait()
+    
+    def _run(self):
+        while True:
+            with self._lock:
+                conversation_id, job = self._next_job()
+            try:
+                self.update(conversation_id, job['messages'], job['chat_model'], use_model=not job['heuristic'])
+            except Exception as e:
+                print(f"Error updating summary {conversation_id}: {e}")
+    
+    def _uses_model(self) -> bool:
+        return bool(self.model) and time.monotonic() >= self._model_disabled_until
+    
+    def update(self, conversation_id: str, messages: List[Dict], chat_model: str = None,
+               use_model: bool = True) -> bool:
+        """Fold evicted messages past the stored watermark into the summary.
+        
+        Args:
+            conversation_id: Conversation ID
+            messages: Current messages of the conversation
+            chat_model: Chat model (for the context window boundary)
+            use_model: Allow the summary model (False forces the heuristic)
+        
+        Returns:
+            bool: True if the summary changed
+        """
+        target = self.context_builder.evicted_count(messages, chat_model, reserve=self.max_tokens,
+                                                    conversation_id=conversation_id)
+        state = self.history_manager.get_summary_state(conversation_id)
+        previous = state['summary'] if state else None
+        covered = state['covered'] if state else 0
+        if covered > len(messages):
+            # History was rewritten below the watermark; start over
+            previous, covered = None, 0
+        if target <= covered:
+            return False
+        
+        delta = messages[covered:target]
+        summary = None
+        if use_model and self._uses_model():
+            if len(delta) < self.min_batch:
+                # Wait for a bigger batch rather than calling the model for a message or two
+                return False
+            summary = self._model_fold(previous, delta)
+        if summary is None:
+            summary = self.context_builder.fold_summary(previous, delta, target)
+            self.stats['heuristic_summaries'] += 1
+        else:
+            self.stats['model_summaries'] += 1
+        
+        self.history_manager.save_summary(conversation_id, summary, target)
+        return True
+    
+    def _generate(self, instruction: str, text: str) -> str:
+        messages = [
+            {'role': 'system', 'content': instruction},
+            {'role': 'user', 'content': text}
+        ]
+        if self.scheduler is None:
+            return ''.join(self.client.chat(self.model, messages, stream=False, options={'temperature': 0.2})).strip()
+        with self.scheduler.slot(self.model, BATCH, key='summaries'):
+            return ''.join(self.client.chat(self.model, messages, stream=False, options={'temperature': 0.2})).strip()
+    
+    def _model_fold(self, previous: Optional[str], delta: List[Dict]) -> Optional[str]:
+        """Summarize a batch with the model and merge it into the previous summary.
+        
+        Returns:
+            New summary, or None if the model failed
+        """
+        transcript = '\n'.join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in delta)
+        try:
+            chunk = self._generate(SUMMARIZE_PROMPT, transcript)
+            if not chunk:
+                raise Exception("empty summary")
+            summary = f"{previous}\n{chunk}" if previous else chunk
+            if estimate_tokens(summary, self.model) > self.max_tokens:
+                compressed = self._generate(COMPRESS_PROMPT, summary)
+                if compressed:
+                    summary = compressed
+            return summary
+        except SchedulerFull:
+            # Busy rather than broken; don't disable the model
+            return None
+        except Exception as e:
+            print(f"Summary model '{self.model}' failed, using heuristic summaries for {self.retry_delay:.0f}s: {e}")
+            self.stats['model_failures'] += 1
+            self._model_disabled_until = time.monotonic() + self.retry_delay
+            return None
@@ -0,0 +1,94 @@
+"""Fast token-count estimation for context budgeting.
+
+Exact tokenizers are model-specific and slow to load, so context assembly
+uses cheap per-family estimates instead. Estimators are registered by model
+family prefix and can be replaced with something more precise.
+"""
+import math
+from functools import lru_cache
+from typing import Callable, Dict
+
+# Per-message overhead for role markers / template tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+# Message token counts remembered by (content, family)
+TOKEN_CACHE_SIZE = 8192
+
+def _ratio_estimator(chars_per_token: float) -> Callable[[str], int]:
+    """Build an estimator from an average characters-per-token ratio.
+    
+    Non-ASCII text tokenizes much more densely than English, so every extra
+    UTF-8 byte beyond the first is counted as half a token on top.
+    """
+    def estimate(text: str) -> int:
+        if not text:
+            return 0
+        extra_bytes = len(text.encode('utf-8')) - len(text)
+        return int(math.ceil(len(text) / chars_per_token + extra_bytes / 2))
+    return estimate
+
+# Model family prefix -> estimator; the longest matching prefix wins
+_estimators: Dict[str, Callable[[str], int]] = {
+    'llama3': _ratio_estimator(4.0),
+    'llama2': _ratio_estimator(3.5),
+    'codellama': _ratio_estimator(3.2),
+    'mistral': _ratio_estimator(3.6),
+    'mixtral': _ratio_estimator(3.6),
+    'qwen': _ratio_estimator(3.8),
+    'gemma': _ratio_estimator(4.0),
+    'phi': _ratio_estimator(3.6),
+    'deepseek': _ratio_estimator(3.5),
+}
+DEFAULT_FAMILY = 'default'
+_default_estimator = _ratio_estimator(3.5)
+
+def register_estimator(family: str, estimator: Callable[[str], int]):
+    """Register a token estimator for a model family.
+    
+    Args:
+        family: Model name prefix, e.g. 'llama3' (matches 'llama3.2:1b')
+        estimator: Callable returning the token count for a string
+    """
+    _estimators[family.lower()] = estimator
+    _content_tokens.cache_clear()
+
+def model_family(model: str) -> str:
+    """Get the registered family for a model name, or DEFAULT_FAMILY."""
+    name = (model or '').lower().split('/')[-1]
+    best = DEFAULT_FAMILY
+    for family in _estimators:
+        if name.startswith(family) and (best == DEFAULT_FAMILY or len(family) > len(best)):
+            best = family
+    return best
+
+def estimate_tokens(text: str, model: str = None) -> int:
+    """Estimate the number of tokens in a string for a model.
+    
+    Args:
+        text: Text to measure
+        model: Model name (selects the family estimator)
+    
+    Returns:
+        int: Estimated token count
+    """
+    family = model_family(model)
+    return _estimators.get(family, _default_estimator)(text)
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _content_tokens(content: str, family: str) -> int:
+    return _estimators.get(family, _default_estimator)(content) + MESSAGE_OVERHEAD_TOKENS
+
+def message_tokens(message: Dict, model: str = None) -> int:
+    """Get the estimated token count of a chat message.
+    
+    Counts are cached by content and model family outside the message, so
+    each message is measured once per family and the dict is left as is
+    (nothing extra ends up in stored or served conversations).
+    
+    Args:
+        message: Message dict with 'content'
+        model: Model name
+    
+    Returns:
+        int: Estimated tokens including per-message overhead
+    """
+    return _content_tokens(message.get('content') or '', model_family(model))
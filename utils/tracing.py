@@ -0,0 +1,212 @@
+"""Lightweight per-request tracing.
+
+A Trace records named spans (durations) and marks (points in time, relative
+to the start of the request). Routes add spans around their expensive steps;
+the timings are returned in a ``Server-Timing`` header, and chat generations
+also send them in their final SSE event since their headers go out before
+the reply is generated.
+
+Finished traces slower than TRACE_SLOW_REQUEST_MS are appended as JSON lines
+to a rotating slow request log. Spans listed in ``slow_exclude`` (e.g. the
+token stream, whose length depends on the reply) do not count towards the
+threshold.
+
+With TRACING_ENABLED off, start_trace() returns NULL_TRACE, whose methods do
+nothing and whose span() returns a shared no-op context manager.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Sequence
+from config import TRACING_ENABLED, TRACE_SLOW_REQUEST_MS, TRACE_SLOW_LOG_MAX_BYTES, TRACE_SLOW_LOG_BACKUPS
+from utils.paths import get_slow_request_log_path
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+def _get_slow_log() -> logging.Logger:
+    """Get the slow request logger, creating its rotating file handler on first use."""
+    global _slow_log
+    with _slow_log_lock:
+        if _slow_log is None:
+            logger = logging.getLogger('chatgpt_ollama.slow_requests')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                get_slow_request_log_path(), maxBytes=TRACE_SLOW_LOG_MAX_BYTES,
+                backupCount=TRACE_SLOW_LOG_BACKUPS, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _slow_log = logger
+        return _slow_log
+
+class _Span:
+    """Context manager timing one span of a trace."""
+    
+    __slots__ = ('trace', 'name', 'started')
+    
+    def __init__(self, trace: 'Trace', name: str):
+        self.trace = trace
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, self.started)
+        return False
+
+class Trace:
+    """Timings of one request."""
+    
+    enabled = True
+    
+    def __init__(self, name: str, slow_exclude: Sequence[str] = ()):
+        """Initialize trace.
+        
+        Args:
+            name: Request name (e.g. "POST /api/chat")
+            slow_exclude: Span names not counted towards the slow request threshold
+        """
+        self.name = name
+        self.slow_exclude = tuple(slow_exclude)
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat()
+        self.attributes = {}
+        self.finished = False
+        self._spans = []  # (name, start offset, duration) in seconds
+        self._marks = []  # (name, offset) in seconds
+        self._lock = threading.Lock()
+    
+    def span(self, name: str) -> _Span:
+        """Time a with block as a span."""
+        return _Span(self, name)
+    
+    def add(self, name: str, started: float, ended: float = None):
+        """Record a span measured elsewhere.
+        
+        Args:
+            name: Span name
+            started: time.perf_counter() when the span started
+            ended: time.perf_counter() when it ended (defaults to now)
+        """
+        ended = time.perf_counter() if ended is None else ended
+        with self._lock:
+            self._spans.append((name, started - self.started, ended - started))
+    
+    def mark(self, name: str):
+        """Record the current time under a name."""
+        offset = time.perf_counter() - self.started
+        with self._lock:
+            self._marks.append((name, offset))
+    
+    def set(self, key: str, value):
+        """Attach an attribute (e.g. the model) written with the slow request log entry."""
+        self.attributes[key] = value
+    
+    def timings(self) -> Dict:
+        """Get the timings so far in milliseconds.
+        
+        Returns:
+            Dict with 'total_ms', 'spans' (name, start_ms, ms) and 'marks' (name -> ms)
+        """
+        total = time.perf_counter() - self.started
+        with self._lock:
+            spans = list(self._spans)
+            marks = list(self._marks)
+        return {
+            'total_ms': round(total * 1000, 2),
+            'spans': [
+                {'name': name, 'start_ms': round(offset * 1000, 2), 'ms': round(duration * 1000, 2)}
+                for name, offset, duration in spans
+            ],
+            'marks': {name: round(offset * 1000, 2) for name, offset in marks}
+        }
+    
+    def server_timing(self) -> str:
+        """Format the timings so far as a Server-Timing header value.
+        
+        Marks are reported as durations since the start of the request.
+        """
+        timings = self.timings()
+        entries = [f"{span['name']};dur={span['ms']}" for span in timings['spans']]
+        entries.extend(f'{name};dur={ms};desc="since start"' for name, ms in timings['marks'].items())
+        entries.append(f"total;dur={timings['total_ms']}")
+        return ', '.join(entries)
+    
+    def finish(self) -> Dict:
+        """End the trace and log it if it was slow.
+        
+        Returns:
+            Dict: Final timings (see timings())
+        """
+        timings = self.timings()
+        with self._lock:
+            if self.finished:
+                return timings
+            self.finished = True
+        excluded = sum(span['ms'] for span in timings['spans'] if span['name'] in self.slow_exclude)
+        counted = timings['total_ms'] - excluded
+        if TRACE_SLOW_REQUEST_MS > 0 and counted >= TRACE_SLOW_REQUEST_MS:
+            try:
+                _get_slow_log().info(json.dumps({
+                    'request': self.name,
+                    'started_at': self.started_at,
+                    'counted_ms': round(counted, 2),
+                    **timings,
+                    **({'attributes': self.attributes} if self.attributes else {})
+                }))
+            except Exception as e:
+                print(f"Error writing slow request log: {e}")
+        return timings
+
+class _NullSpan:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _NullTrace:
+    """Trace that records nothing, used when tracing is disabled."""
+    
+    enabled = False
+    finished = True
+    
+    def span(self, name: str) -> _NullSpan:
+        return _NULL_SPAN
+    
+    def add(self, name: str, started: float, ended: float = None):
+        pass
+    
+    def mark(self, name: str):
+        pass
+    
+    def set(self, key: str, value):
+        pass
+    
+    def timings(self) -> Dict:
+        return {}
+    
+    def server_timing(self) -> str:
+        return ''
+    
+    def finish(self) -> Dict:
+        return {}
+
+NULL_TRACE = _NullTrace()
+
+def start_trace(name: str, slow_exclude: Sequence[str] = ()):
+    """Start a trace, or get NULL_TRACE if tracing is disabled."""
+    if not TRACING_ENABLED:
+        return NULL_TRACE
+    return Trace(name, slow_exclude)